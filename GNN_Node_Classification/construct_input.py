@@ -4,17 +4,23 @@
 节点信息(nodes.tsv)：(node_id, code_embedding) node_id即java_code的文件id即可，code_embedding 即 200 embedding vector
 边信息(edges.tsv)：(start_node_id, end_node_id, relation_vector) relation_vector即四种关系的one-hot编码表示
 [declares, calls, inherits, implements]
+默认保存为二进制格式(graph.npz)，每个划分最终合并为 graph_store，见 utils_nc/graph_store.py，tsv 仅在 export_tsv 时导出
 """
+import json
 import math
 import os
 import shutil
 from os.path import join
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
+import numpy as np
 import pandas as pd
 import torch
 
 from dataset_split_util import get_models_by_ratio
+from .utils_nc import graph_store
 
 root_path = join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'params_validation', 'git_repo_code')
 
@@ -68,160 +74,225 @@ def adjust_edge(edge: ET.Element, nodes: list[ET.Element]):
     #     return [start, end, edge_vector[label]]
 
 
-def save_composed_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name, embedding_type,
-                        description):
-    if embedding_type == 'astnn+codebert':
-        embedding_file_1 = f'{description}_{step}_astnn_embedding.pkl'
-        embedding_file_2 = f'{step}_codebert_embedding.pkl'
-    elif embedding_type == 'astnn+glove':
-        embedding_file_1 = f'{description}_{step}_astnn_embedding.pkl'
-        embedding_file_2 = f'{description}_{step}_glove_embedding.pkl'
-    elif embedding_type == 'astnn+codebert+stereotype':
-        embedding_file_1 = f'{description}_{step}_astnn_embedding.pkl'
-        embedding_file_2 = f'{step}_codebert_embedding.pkl'
-    model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-    for model_dir in model_dir_list:
-        print('---------------', model_dir)
-        model_path = join(project_path, model_dir)
-        model_file = join(model_path, f'new_{step}_step_expanded_model.xml')
-        # 如果不存在模型，跳过处理
-        if not os.path.exists(model_file):
-            continue
-        # 读 embedding
-        embedding_list_1 = pd.read_pickle(join(model_path, embedding_file_1))
-        embedding_list_2 = pd.read_pickle(join(model_path, embedding_file_2))
-        tree = ET.parse(model_file)  # 拿到xml树
-        # 获取XML文档的根元素
-        code_context_model = tree.getroot()
-        graphs = code_context_model.findall("graph")
-        base = 0
-        # seed_num_list = list()
-        if len(graphs) == 0:
-            continue
-        for graph in graphs:
-            # 创建保存nodes和edges的数据结构
-            nodes_tsv = list()
-            edges_tsv = list()
-            true_edge = 0
-            true_node = 0
-            vertices = graph.find('vertices')
-            vertex_list = vertices.findall('vertex')
-            for vertex in vertex_list:
-                node_id = '_'.join([model_dir, vertex.get('kind'), vertex.get('ref_id')])
-                _id = int(vertex.get('id'))
-                # 去找 embedding 并添加  这儿不知道为什么会多一层列表
-                # embedding_list_1[embedding_list_1['id'] == node_id]['embedding']
-                # print(node_id)
-                embedding_1 = embedding_list_1[embedding_list_1['id'] == node_id]['embedding'].iloc[0]
-                embedding_2 = embedding_list_2[embedding_list_2['id'] == node_id]['embedding'].iloc[0]
-                # 进行组合
-                embedding = embedding_1.tolist() + embedding_2.tolist()
-                if embedding_type == 'astnn+codebert':
-                    embedding = embedding
-                elif embedding_type == 'astnn+codebert+stereotype':
-                    stereotype = vertex.get('stereotype')
-                    embedding_stereotype = STEREOTYPE_EMBEDDING(
-                        torch.tensor(step_1.index(stereotype))).squeeze().tolist()
-                    embedding = embedding + embedding_stereotype
-                nodes_tsv.append(
-                    [_id, embedding, int(vertex.get('origin')), vertex.get('kind')])
-                if int(vertex.get('origin')) == 1:
-                    true_node += 1
-            edges = graph.find('edges')
-            edge_list = edges.findall('edge')
-            for edge in edge_list:
-                start, end, edge_label = adjust_edge(edge, vertex_list)
-                edges_tsv.append([start, end, edge_label])
-                if int(edge.get('origin')) == 1:
-                    true_edge += 1
-            dest = join(dest_path, f'{embedding_type}_model_dataset_{str(step)}', dataset,
-                        f'{project_model_name}_{model_dir}_{str(base)}')
-            if os.path.exists(dest):
-                shutil.rmtree(dest)
-            os.makedirs(dest)
-            if len(nodes_tsv) > 0 and len(edges_tsv) > 0:
-                if true_node > step:
-                    pd.DataFrame(nodes_tsv, columns=['node_id', 'code_embedding', 'label', 'kind']).to_csv(
-                        join(dest, 'nodes.tsv'), index=False)
-                    pd.DataFrame(edges_tsv, columns=['start_node_id', 'end_node_id', 'relation']).to_csv(
-                        join(dest, 'edges.tsv'), index=False)
-            base += 1
-
-
-def save_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name, embedding_type, description):
+def load_embedding_index(embedding_file):
+    """
+    读取 embedding pkl，转换为连续的 embedding 矩阵以及 id -> 行号 的索引，只需要读取一次
+
+    :param embedding_file: embedding 文件，columns=['id', 'embedding']
+    :return: (index: pd.Series id -> 行号, embeddings: np.ndarray [R, D])
+    """
+    embedding_list = pd.read_pickle(embedding_file)
+    embeddings = np.array([np.asarray(e.tolist(), dtype=np.float32).reshape(-1)
+                           for e in embedding_list['embedding']], dtype=np.float32)
+    index = pd.Series(np.arange(len(embedding_list)), index=embedding_list['id'].tolist())
+    # 与之前的 iloc[0] 一致，重复 id 取第一个
+    index = index[~index.index.duplicated(keep='first')]
+    return index, embeddings
+
+
+def lookup_embedding(embedding_index, node_ids):
+    """
+    根据 node_id 批量查找 embedding
+
+    :param embedding_index: load_embedding_index 的返回值
+    :param node_ids: node_id 列表, model_dir_kind_ref_id
+    :return: np.ndarray [len(node_ids), D]
+    """
+    index, embeddings = embedding_index
+    return embeddings[index.loc[node_ids].to_numpy()]
+
+
+def read_graph(graph: ET.Element, model_dir):
+    """
+    读取 xml 中的一个 graph
+
+    :param graph: graph 节点
+    :param model_dir: 模型目录
+    :return: (nodes: DataFrame columns=['node_id', 'label', 'kind', 'stereotype', 'key'], edges_tsv, true_node)
+    """
+    vertex_list = graph.find('vertices').findall('vertex')
+    nodes = pd.DataFrame({
+        'node_id': [int(vertex.get('id')) for vertex in vertex_list],
+        'label': [int(vertex.get('origin')) for vertex in vertex_list],
+        'kind': [vertex.get('kind') for vertex in vertex_list],
+        'stereotype': [vertex.get('stereotype') for vertex in vertex_list],
+        # 用于查找 embedding 的 id
+        'key': ['_'.join([model_dir, vertex.get('kind'), vertex.get('ref_id')]) for vertex in vertex_list]
+    })
+    edges_tsv = [adjust_edge(edge, vertex_list) for edge in graph.find('edges').findall('edge')]
+    true_node = int((nodes['label'] == 1).sum())
+    return nodes, edges_tsv, true_node
+
+
+def save_graph_data(dest, nodes: pd.DataFrame, embedding, edges_tsv, export_tsv=False):
+    """
+    保存单个图，默认保存为二进制的 graph.npz，export_tsv 时额外导出原来的 nodes.tsv 和 edges.tsv
+
+    :param dest: 图目录
+    :param nodes: read_graph 返回的节点信息
+    :param embedding: 节点 embedding [N, D]
+    :param edges_tsv: [[start_node_id, end_node_id, relation], ...]
+    :param export_tsv: 是否导出 tsv
+    :return: none
+    """
+    src, dst, relation = zip(*edges_tsv)
+    graph_store.save_graph(dest, embedding, nodes['label'], nodes['kind'], src, dst, relation)
+    if export_tsv:
+        pd.DataFrame({'node_id': nodes['node_id'], 'code_embedding': embedding.tolist(), 'label': nodes['label'],
+                      'kind': nodes['kind']}).to_csv(join(dest, 'nodes.tsv'), index=False)
+        pd.DataFrame(edges_tsv, columns=['start_node_id', 'end_node_id', 'relation']).to_csv(
+            join(dest, 'edges.tsv'), index=False)
+
+
+def get_embedding_files(embedding_type, description, step):
+    """
+    :return: 需要拼接的 embedding 文件名列表
+    """
     if embedding_type == 'astnn':
-        embedding_file = f'{description}_{step}_astnn_embedding.pkl'
+        return [f'{description}_{step}_astnn_embedding.pkl']
     elif embedding_type == 'glove':
-        embedding_file = f'{description}_{step}_glove_embedding.pkl'
+        return [f'{description}_{step}_glove_embedding.pkl']
     elif embedding_type == 'codebert':
-        embedding_file = f'{step}_codebert_embedding.pkl'
-    elif embedding_type == 'astnn+codebert' or embedding_type == 'astnn+glove' or embedding_type == 'astnn+codebert+stereotype':
-        save_composed_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name, embedding_type,
-                            description)
-        return
+        return [f'{step}_codebert_embedding.pkl']
+    elif embedding_type == 'astnn+codebert' or embedding_type == 'astnn+codebert+stereotype':
+        return [f'{description}_{step}_astnn_embedding.pkl', f'{step}_codebert_embedding.pkl']
+    elif embedding_type == 'astnn+glove':
+        return [f'{description}_{step}_astnn_embedding.pkl', f'{description}_{step}_glove_embedding.pkl']
     else:
-        embedding_file = f'{description}_{step}_astnn_embedding.pkl'
+        return [f'{description}_{step}_astnn_embedding.pkl']
+
+
+def save_model_dir(project_path, model_dir, step, dest_path, dataset, project_model_name, embedding_type, description,
+                   export_tsv=False):
+    """
+    处理单个模型目录，每个目录相互独立，可以并行处理
+
+    :return: 生成的图目录名列表
+    """
+    print('---------------', model_dir)
+    model_path = join(project_path, model_dir)
+    model_file = join(model_path, f'new_{step}_step_expanded_model.xml')
+    graph_names = []
+    # 如果不存在模型，跳过处理
+    if not os.path.exists(model_file):
+        return graph_names
+    # 读 embedding, 建立 id 索引
+    embedding_indexes = [load_embedding_index(join(model_path, embedding_file))
+                         for embedding_file in get_embedding_files(embedding_type, description, step)]
+    tree = ET.parse(model_file)  # 拿到xml树
+    # 获取XML文档的根元素
+    code_context_model = tree.getroot()
+    graphs = code_context_model.findall("graph")
+    base = 0
+    for graph in graphs:
+        nodes, edges_tsv, true_node = read_graph(graph, model_dir)
+        graph_names.append(f'{project_model_name}_{model_dir}_{str(base)}')
+        dest = join(dest_path, f'{embedding_type}_model_dataset_{str(step)}', dataset, graph_names[-1])
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        os.makedirs(dest)
+        # 如果没有节点，或者没有边，或者节点数小于step 都需要过滤掉,也就是stimulation
+        if len(nodes) > 0 and len(edges_tsv) > 0:
+            if true_node > step:
+                # 组合 embedding
+                embeddings = [lookup_embedding(embedding_index, nodes['key']) for embedding_index in embedding_indexes]
+                if embedding_type == 'astnn+codebert+stereotype':
+                    stereotype_ids = torch.tensor([step_1.index(stereotype) for stereotype in nodes['stereotype']])
+                    embeddings.append(STEREOTYPE_EMBEDDING(stereotype_ids).detach().numpy())
+                save_graph_data(dest, nodes, np.concatenate(embeddings, axis=1), edges_tsv, export_tsv)
+        base += 1
+    return graph_names
+
+
+def get_fingerprint(model_path, step, embedding_type, description, export_tsv):
+    """
+    模型目录输入文件的指纹，用于增量构建时判断是否需要重新生成
+
+    :return: {'embedding_type': ..., 'export_tsv': ..., 文件名: [size, mtime_ns] or None}
+    """
+    fingerprint = {'embedding_type': embedding_type, 'export_tsv': export_tsv}
+    for file in [f'new_{step}_step_expanded_model.xml'] + get_embedding_files(embedding_type, description, step):
+        path = join(model_path, file)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint[file] = [stat.st_size, stat.st_mtime_ns]
+        else:
+            fingerprint[file] = None
+    return fingerprint
+
+
+def init_worker(stereotype_weight):
+    """
+    进程池初始化，保证所有进程使用同一个 stereotype embedding
+    """
+    with torch.no_grad():
+        STEREOTYPE_EMBEDDING.weight.copy_(stereotype_weight)
+
+
+def save_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name, embedding_type, description,
+               export_tsv=False, workers=1, manifest=None):
+    """
+    处理一个项目的一个数据集划分
+
+    :param workers: 进程数，大于 1 时使用进程池并行处理模型目录
+    :param manifest: 上一次构建的 manifest，不为 None 时只重新生成输入发生变化的模型目录
+    :return: 本次划分的 manifest 记录 {dataset/project_model_dir: {'fingerprint': ..., 'graphs': [...]}}
+    """
     model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
+    split_path = join(dest_path, f'{embedding_type}_model_dataset_{str(step)}', dataset)
+    entries = dict()
+    stale_list = []
     for model_dir in model_dir_list:
-        print('---------------', model_dir)
-        model_path = join(project_path, model_dir)
-        model_file = join(model_path, f'new_{step}_step_expanded_model.xml')
-        # 如果不存在模型，跳过处理
-        if not os.path.exists(model_file):
-            continue
-        # 读 embedding
-        embedding_list = pd.read_pickle(join(model_path, embedding_file))
-        tree = ET.parse(model_file)  # 拿到xml树
-        # 获取XML文档的根元素
-        code_context_model = tree.getroot()
-        graphs = code_context_model.findall("graph")
-        base = 0
-        # seed_num_list = list()
-        if len(graphs) == 0:
-            continue
-        for graph in graphs:
-            # 创建保存nodes和edges的数据结构
-            nodes_tsv = list()
-            edges_tsv = list()
-            true_edge = 0
-            true_node = 0
-            vertices = graph.find('vertices')
-            vertex_list = vertices.findall('vertex')
-            # print(embedding_list)
-            for vertex in vertex_list:
-                node_id = '_'.join([model_dir, vertex.get('kind'), vertex.get('ref_id')])
-                _id = int(vertex.get('id'))
-                # print(node_id)
-                # 去找 embedding 并添加  这儿不知道为什么会多一层列表
-                embedding = embedding_list[embedding_list['id'] == node_id]['embedding'].iloc[0].tolist()
-                nodes_tsv.append(
-                    [_id, embedding, int(vertex.get('origin')), vertex.get('kind')])
-                if int(vertex.get('origin')) == 1:
-                    true_node += 1
-            edges = graph.find('edges')
-            edge_list = edges.findall('edge')
-            for edge in edge_list:
-                start, end, edge_label = adjust_edge(edge, vertex_list)
-                edges_tsv.append([start, end, edge_label])
-                if int(edge.get('origin')) == 1:
-                    true_edge += 1
-            dest = join(dest_path, f'{embedding_type}_model_dataset_{str(step)}', dataset,
-                        f'{project_model_name}_{model_dir}_{str(base)}')
-            if os.path.exists(dest):
-                shutil.rmtree(dest)
-            os.makedirs(dest)
-            # 如果没有节点，或者没有边，或者节点数小于step 都需要过滤掉,也就是stimulation
-            # if graphs.index(graph) in remain_seed_list and len(nodes_tsv) > 0 and len(edges_tsv) > 0:
-            if len(nodes_tsv) > 0 and len(edges_tsv) > 0:
-                if true_node > step:
-                    pd.DataFrame(nodes_tsv, columns=['node_id', 'code_embedding', 'label', 'kind']).to_csv(
-                        join(dest, 'nodes.tsv'), index=False)
-                    pd.DataFrame(edges_tsv, columns=['start_node_id', 'end_node_id', 'relation']).to_csv(
-                        join(dest, 'edges.tsv'), index=False)
-            base += 1
-
-
-def main_func(description: str, step: int, dest_path: str, embedding_type: str):
+        key = f'{dataset}/{project_model_name}_{model_dir}'
+        fingerprint = get_fingerprint(join(project_path, model_dir), step, embedding_type, description, export_tsv)
+        old_entry = manifest.get(key) if manifest is not None else None
+        if (old_entry is not None and old_entry['fingerprint'] == fingerprint
+                and all(os.path.exists(join(split_path, name)) for name in old_entry['graphs'])):
+            entries[key] = old_entry
+        else:
+            entries[key] = {'fingerprint': fingerprint, 'graphs': []}
+            stale_list.append(model_dir)
+    task = partial(save_model_dir, project_path, step=step, dest_path=dest_path, dataset=dataset,
+                   project_model_name=project_model_name, embedding_type=embedding_type, description=description,
+                   export_tsv=export_tsv)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(STEREOTYPE_EMBEDDING.weight.detach().clone(),)) as executor:
+            # list 保证子进程的异常会抛出
+            results = list(executor.map(task, stale_list))
+    else:
+        results = [task(model_dir) for model_dir in stale_list]
+    for model_dir, graph_names in zip(stale_list, results):
+        entries[f'{dataset}/{project_model_name}_{model_dir}']['graphs'] = graph_names
+    return entries
+
+
+def get_split_tasks(description: str):
+    """
+    :return: [(project_model_name, dataset, start_ratio, end_ratio), ...]
+    """
+    if description == 'all':
+        return [(project_model_name, dataset, ratios[0], ratios[1])
+                for project_model_name in ['my_pde', 'my_platform', 'my_mylyn']
+                for dataset, ratios in dataset_ratio.items()]
+    elif description == 'onlymylyn':
+        tasks = [('my_mylyn', 'train', 0, 1)]
+        for project_model_name in ['my_pde', 'my_platform']:
+            tasks += [(project_model_name, 'valid', 0, 0.5), (project_model_name, 'test', 0.5, 1)]
+        return tasks
+    elif description == 'nopde':
+        return [('my_pde', 'valid', 0, 0.5), ('my_pde', 'test', 0.5, 1),
+                ('my_mylyn', 'train', 0, 1), ('my_platform', 'train', 0, 1)]
+    elif description == 'noplatform':
+        return [('my_platform', 'valid', 0, 0.5), ('my_platform', 'test', 0.5, 1),
+                ('my_mylyn', 'train', 0, 1), ('my_pde', 'train', 0, 1)]
+    elif description == 'mylyn':
+        return [('my_mylyn', dataset, ratios[0], ratios[1]) for dataset, ratios in mylyn_dataset_ratio.items()]
+    return []
+
+
+def main_func(description: str, step: int, dest_path: str, embedding_type: str, export_tsv=False, workers=1,
+              incremental=False):
     """
     构建并拆分数据集
     all: 四个项目分别拆分成train,valid,test : 比例8:1:1 \n
@@ -232,78 +303,47 @@ def main_func(description: str, step: int, dest_path: str, embedding_type: str):
     :param description: all, onlymylyn, nopde, noplatform
     :param step: 步长
     :param dest_path: 数据集保存的路径
+    :param embedding_type: type of embedding
+    :param export_tsv: 是否额外导出 nodes.tsv, edges.tsv
+    :param workers: 并行处理模型目录的进程数
+    :param incremental: 增量构建，只重新生成输入文件发生变化的图，并删除不再属于任何模型的图
     :return:
     """
-    if os.path.exists(join(dest_path, f'{embedding_type}_model_dataset_{str(step)}')):
-        shutil.rmtree(join(dest_path, f'{embedding_type}_model_dataset_{str(step)}'))
-    if description == 'all':
-        project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
-        for project_model_name in project_model_list:
-            project_path = join(root_path, project_model_name, 'repo_first_3')
-            for dataset in dataset_ratio:
-                ratios = dataset_ratio.get(dataset)
-                model_dir_list = get_models_by_ratio(project_model_name, ratios[0], ratios[1])
-                model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-                save_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name, embedding_type,
-                           description)
-    elif description == 'onlymylyn':
-        project_model_name = 'my_mylyn'
-        project_path = join(root_path, project_model_name, 'repo_first_3')
-        model_dir_list = get_models_by_ratio(project_model_name, 0, 1)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        save_model(project_path, model_dir_list, step, dest_path, 'train', project_model_name, embedding_type,
-                   description)
-        for project_model_name in ['my_pde', 'my_platform']:
-            project_path = join(root_path, project_model_name, 'repo_first_3')
-            model_dir_list = get_models_by_ratio(project_model_name, 0, 0.5)
-            model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-            save_model(project_path, model_dir_list, step, dest_path, 'valid', project_model_name, embedding_type,
-                       description)
-            model_dir_list = get_models_by_ratio(project_model_name, 0.5, 1)
-            model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-            save_model(project_path, model_dir_list, step, dest_path, 'test', project_model_name, embedding_type,
-                       description)
-    elif description == 'nopde':
-        project_model_name = 'my_pde'
-        project_path = join(root_path, project_model_name, 'repo_first_3')
-        model_dir_list = get_models_by_ratio(project_model_name, 0, 0.5)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        save_model(project_path, model_dir_list, step, dest_path, 'valid', project_model_name, embedding_type,
-                   description)
-        model_dir_list = get_models_by_ratio(project_model_name, 0.5, 1)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        save_model(project_path, model_dir_list, step, dest_path, 'test', project_model_name, embedding_type,
-                   description)
-        for project_model_name in ['my_mylyn', 'my_platform']:
-            project_path = join(root_path, project_model_name, 'repo_first_3')
-            model_dir_list = get_models_by_ratio(project_model_name, 0, 1)
-            model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-            save_model(project_path, model_dir_list, step, dest_path, 'train', project_model_name, embedding_type,
-                       description)
-    elif description == 'noplatform':
-        project_model_name = 'my_platform'
+    dataset_path = join(dest_path, f'{embedding_type}_model_dataset_{str(step)}')
+    manifest_path = join(dataset_path, 'manifest.json')
+    if incremental and embedding_type == 'astnn+codebert+stereotype':
+        # stereotype embedding 每次运行随机初始化，无法与之前生成的图混用
+        print('stereotype embedding is not reproducible, rebuild all')
+        incremental = False
+    if incremental and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old_manifest = json.load(f)
+    else:
+        old_manifest = dict()
+        if os.path.exists(dataset_path):
+            shutil.rmtree(dataset_path)
+    manifest = dict()
+    for project_model_name, dataset, start_ratio, end_ratio in get_split_tasks(description):
         project_path = join(root_path, project_model_name, 'repo_first_3')
-        model_dir_list = get_models_by_ratio(project_model_name, 0, 0.5)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        save_model(project_path, model_dir_list, step, dest_path, 'valid', project_model_name, embedding_type,
-                   description)
-        model_dir_list = get_models_by_ratio(project_model_name, 0.5, 1)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        save_model(project_path, model_dir_list, step, dest_path, 'test', project_model_name, embedding_type,
-                   description)
-        for project_model_name in ['my_mylyn', 'my_pde']:
-            project_path = join(root_path, project_model_name, 'repo_first_3')
-            model_dir_list = get_models_by_ratio(project_model_name, 0, 1)
-            model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-            save_model(project_path, model_dir_list, step, dest_path, 'train', project_model_name, embedding_type,
-                       description)
-    elif description == 'mylyn':
-        project_model_list = ['my_mylyn']
-        for project_model_name in project_model_list:
-            project_path = join(root_path, project_model_name, 'repo_first_3')
-            for dataset in mylyn_dataset_ratio:
-                ratios = mylyn_dataset_ratio.get(dataset)
-                model_dir_list = get_models_by_ratio(project_model_name, ratios[0], ratios[1])
-                model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-                save_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name, embedding_type,
-                           description)
+        model_dir_list = get_models_by_ratio(project_model_name, start_ratio, end_ratio)
+        manifest.update(save_model(project_path, model_dir_list, step, dest_path, dataset, project_model_name,
+                                   embedding_type, description, export_tsv, workers,
+                                   old_manifest if incremental else None))
+    # 删除不再属于任何模型的图，只重新合并发生变化的划分
+    changed = {key.split('/')[0] for key in set(old_manifest) ^ set(manifest)}
+    changed |= {key.split('/')[0] for key in manifest if manifest[key] != old_manifest.get(key)}
+    graphs = {join(key.split('/')[0], name) for key, entry in manifest.items() for name in entry['graphs']}
+    for dataset in dataset_ratio:
+        split_path = join(dataset_path, dataset)
+        if not os.path.exists(split_path):
+            continue
+        for name in os.listdir(split_path):
+            if name != graph_store.STORE_DIR and join(dataset, name) not in graphs:
+                shutil.rmtree(join(split_path, name))
+                changed.add(dataset)
+        # 每个划分的图合并为 graph_store
+        if dataset in changed or graph_store.get_store_path(split_path) is None:
+            graph_store.pack(split_path)
+    os.makedirs(dataset_path, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
@@ -5,14 +5,11 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import nni
-from torchmetrics.classification import BinaryAccuracy, BinaryAveragePrecision
-from torchmetrics.classification import BinaryPrecision
-from torchmetrics.classification import BinaryRecall
-from torchmetrics.classification import BinaryF1Score
-from torchmetrics.classification import BinaryAUROC
+from torchmetrics.classification import BinaryAccuracy
 
 from .utils_nc import util
 from .utils_nc.data_loader import load_prediction_data
+from .utils_nc.metrics import get_valid_metrics
 
 from .utils_nc.wo_attention_prediction_model import WoAttentionPredictionModel
 from .utils_nc.wo_concat_prediction_model import WoConcatPredictionModel
@@ -33,12 +30,8 @@ def valid(gnn_model, data_loader, device, threshold):
         gnn_model.eval()
         criterion = nn.BCELoss()  # 二元交叉熵
         total_loss = 0.0
-        accuracy = 0.0
-        precision = 0.0
-        recall = 0.0
-        auroc = 0.0
-        auprc = 0.0
-        f_1 = 0.0
+        # 整个验证集累积之后统一计算
+        metrics = get_valid_metrics(threshold, device)
         for g, features, labels, edge_types, kinds in data_loader:
             output = gnn_model(g, features, edge_types)
             # output = output[torch.eq(seeds, 1)]
@@ -46,42 +39,14 @@ def valid(gnn_model, data_loader, device, threshold):
             # 计算 loss
             loss = criterion(output, labels)
             total_loss += loss.item()
-            # print(predict_res, labels)
-            # 计算 accuracy
-            accuracy_metrics = BinaryAccuracy(threshold=threshold).to(device)
-            acc = accuracy_metrics(output, labels).item()
-            accuracy += acc
-            # 计算 precision
-            precision_metrics = BinaryPrecision(threshold=threshold).to(device)
-            pre = precision_metrics(output, labels).item()
-            precision += pre
-            # 计算 recall
-            recall_metrics = BinaryRecall(threshold=threshold).to(device)
-            rec = recall_metrics(output, labels).item()
-            recall += rec
-            # 计算F1
-            f1_metrics = BinaryF1Score(threshold=threshold).to(device)
-            f1 = f1_metrics(output, labels).item()
-            f_1 += f1
-            # 计算AUC
-            metric = BinaryAUROC(thresholds=None).to(device)
-            roc = metric(output, labels).item()
-            auroc += roc
-            # AUPRC
-            # metric = BinaryAveragePrecision(thresholds=None).to(device)
-            # prc = metric(output, labels.int()).item()
-            # auprc += 0 if np.isnan(prc) else prc
-            # print(f'precision: {pre}, recall: {rec}, f1_score: {f1}, AUROC: {roc}, AUPRC: {prc}')
+            metrics.update(output, labels.int())
         total_loss = total_loss / len(data_loader)
-        accuracy = accuracy / len(data_loader)
-        precision = precision / len(data_loader)
-        recall = recall / len(data_loader)
-        auroc = auroc / len(data_loader)
-        # auprc = auprc / len(data_loader)
-        if precision + recall > 0:
-            f_1 = 2 * precision * recall / (precision + recall)
-        else:
-            f_1 = f_1 / len(data_loader)
+        result = {key: value.item() for key, value in metrics.compute().items()}
+        accuracy = result['accuracy']
+        precision = result['precision']
+        recall = result['recall']
+        f_1 = result['f1']
+        auroc = result['auroc']
         print(f'--valid: '
               # f'Loss: {total_loss}, '
               # f'Accuracy: {accuracy}, '
@@ -89,12 +54,11 @@ def valid(gnn_model, data_loader, device, threshold):
               f'Recall: {Decimal(recall).quantize(Decimal("0.01"), rounding="ROUND_HALF_UP")}, '
               f'F1: {Decimal(f_1).quantize(Decimal("0.01"), rounding="ROUND_HALF_UP")}')
         # f'AUROC: {auroc},'
-        # f'AUPRC: {auprc}')
         return [total_loss, accuracy, precision, recall, f_1, auroc]
 
 
 def train(save_path, save_name, embedding_type, step, gnn_model, data_loader, epochs, lr, device, threshold, self_loop, load_lazy,
-          weight_decay, use_nni, under_sampling_threshold):
+          weight_decay, use_nni, under_sampling_threshold, num_workers=0):
     """
     训练函数
 
@@ -110,6 +74,7 @@ def train(save_path, save_name, embedding_type, step, gnn_model, data_loader, ep
     :param self_loop: whether need self_loop edge
     :param load_lazy: load dataset lazy
     :param weight_decay: adam 权重衰减系数
+    :param num_workers: 数据加载进程数，大于 0 时使用 streaming 模式
     :return: none
     """
     gnn_model.train()
@@ -117,37 +82,38 @@ def train(save_path, save_name, embedding_type, step, gnn_model, data_loader, ep
     criterion = nn.BCELoss()  # 二元交叉熵
     print('----load valid dataset----')
     valid_data_loader = load_prediction_data(save_path, 'valid', embedding_type, batch_size=1, step=step, self_loop=self_loop,
-                                             load_lazy=load_lazy, under_sampling_threshold=under_sampling_threshold)
+                                             load_lazy=load_lazy, under_sampling_threshold=under_sampling_threshold,
+                                             num_workers=num_workers)
     valid(gnn_model=gnn_model, data_loader=valid_data_loader, device=device, threshold=threshold)
     result = []
     max_epoch = [0, 0, 0, 0]  # epoch precision recall f1
     best_count = 0
     patience = 20
+    accuracy_metrics = BinaryAccuracy(threshold=threshold).to(device)
     for epoch in range(epochs):
         total_loss = 0.0
-        train_accuracy = 0.0
+        accuracy_metrics.reset()
         for g, features, labels, edge_types, kinds in data_loader:
             optimizer.zero_grad()
             output = gnn_model(g, features, edge_types)
             # 计算 accuracy
-            accuracy_metrics = BinaryAccuracy(threshold=threshold).to(device)
             # 将 seed 为1的节点丢弃
             # output = output[torch.eq(seeds, 0)]
             # labels = labels[torch.eq(seeds, 0)]
-            acc = accuracy_metrics(output, labels).item()
-            train_accuracy += acc
+            accuracy_metrics.update(output.detach(), labels.int())
             loss = criterion(output, labels)
             loss.backward()
             optimizer.step()
             total_loss += loss.item()
+        train_accuracy = accuracy_metrics.compute().item()
         print(f'--train: '
               f'Epoch {epoch}, '
               f'Loss: {Decimal(total_loss / len(data_loader)).quantize(Decimal("0.01"), rounding="ROUND_HALF_UP")}, '
-              f'Acc: {Decimal(train_accuracy / len(data_loader)).quantize(Decimal("0.01"), rounding="ROUND_HALF_UP")}')
+              f'Acc: {Decimal(train_accuracy).quantize(Decimal("0.01"), rounding="ROUND_HALF_UP")}')
         res = valid(gnn_model=gnn_model, data_loader=valid_data_loader, device=device, threshold=threshold)
         res.insert(0, epoch)
         res.insert(1, total_loss / len(data_loader))
-        res.insert(2, train_accuracy / len(data_loader))
+        res.insert(2, train_accuracy)
         result.append(res)
         if use_nni:
             nni.report_intermediate_result(res[7])
@@ -168,13 +134,13 @@ def train(save_path, save_name, embedding_type, step, gnn_model, data_loader, ep
 
 
 def start_train(save_path, save_name, embedding_type, step, under_sampling_threshold, model, device, epochs, lr, batch_size, threshold,
-                self_loop, load_lazy, weight_decay, use_nni):
+                self_loop, load_lazy, weight_decay, use_nni, num_workers=0, node_budget=None):
     print('----load train dataset----')
     data_loader = load_prediction_data(save_path, 'train', embedding_type, batch_size, step, under_sampling_threshold, self_loop,
-                                       load_lazy)
+                                       load_lazy, num_workers=num_workers, node_budget=node_budget)
     # print('----start train----')
     train(save_path, save_name, embedding_type, step, model, data_loader, epochs, lr, device, threshold, self_loop, load_lazy,
-          weight_decay, use_nni, under_sampling_threshold)
+          weight_decay, use_nni, under_sampling_threshold, num_workers)
 
 
 def init(model_type, num_layers, in_feats, hidden_size, dropout, num_heads, num_edge_types, use_gpu,
@@ -204,7 +170,7 @@ def init(model_type, num_layers, in_feats, hidden_size, dropout, num_heads, num_
 def main_func(save_path: str, save_name: str, embedding_type: str, step: int, under_sampling_threshold=15, model_type="GCN",
               num_layers=3, in_feats=1280, hidden_size=1024, dropout=0.1, attention_heads=8, num_heads=8,
               num_edge_types=6, epochs=50, lr=0.001, batch_size=16, threshold=0.5, use_gpu=True, load_lazy=True,
-              weight_decay=1e-6, approach='attention', use_nni=False):
+              weight_decay=1e-6, approach='attention', use_nni=False, num_workers=0, node_budget=None):
     """
     node classification
 
@@ -230,6 +196,8 @@ def main_func(save_path: str, save_name: str, embedding_type: str, step: int, un
     :param weight_decay: Adam 权重衰减系数 default: 1e-6
     :param approach: train approach: attention or concat
     :param use_nni: default False
+    :param num_workers: 数据加载进程数，大于 0 时图保存在 cpu 上，后台 collate 并异步拷贝到 gpu, default 0
+    :param node_budget: 训练集每个 batch 的最大节点数，设置后按图大小分桶组 batch，batch_size 为最大图数量 default: None
     :return: None
     """
     if model_type.startswith('RGCN'):
@@ -239,4 +207,4 @@ def main_func(save_path: str, save_name: str, embedding_type: str, step: int, un
     device, model = init(model_type, num_layers, in_feats, hidden_size, dropout, num_heads, num_edge_types, use_gpu,
                          attention_heads, approach)
     start_train(save_path, save_name, embedding_type, step, under_sampling_threshold, model, device, epochs, lr, batch_size, threshold,
-                self_loop, load_lazy, weight_decay, use_nni)
+                self_loop, load_lazy, weight_decay, use_nni, num_workers, node_budget)
@@ -1,16 +1,12 @@
 from decimal import Decimal
 
-import numpy as np
 import torch
 import nni
 from torch import nn
-from torchmetrics.classification import BinaryPrecision
-from torchmetrics.classification import BinaryRecall
-from torchmetrics.classification import BinaryF1Score
-from torchmetrics.classification import BinaryAveragePrecision
 
 from .utils_nc import util
 from .utils_nc.data_loader import load_prediction_data
+from .utils_nc.metrics import ThresholdMetrics
 
 from .utils_nc.wo_attention_prediction_model import WoAttentionPredictionModel
 from .utils_nc.wo_concat_prediction_model import WoConcatPredictionModel
@@ -35,29 +31,6 @@ def calculate_result(labels: torch.Tensor, output: torch.Tensor, final_k: int):
     return res
 
 
-def calculate_result_full(labels, output, device):
-    res = []
-    for threshold in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]:
-        if labels.shape[0] == 0:
-            print('0')
-            res.append([0, 0, 0, 0])
-        # 计算 precision
-        precision_metrics = BinaryPrecision(threshold=threshold).to(device)
-        pre = precision_metrics(output, labels).item()
-        # 计算 recall
-        recall_metrics = BinaryRecall(threshold=threshold).to(device)
-        rec = recall_metrics(output, labels).item()
-        # 计算F1
-        f1_metrics = BinaryF1Score(threshold=threshold).to(device)
-        f1 = f1_metrics(output, labels).item()
-        # AUPRC the area under the precision-recall curve
-        metric = BinaryAveragePrecision(thresholds=None).to(device)
-        prc = metric(output, labels.int()).item()
-        prc = 0 if np.isnan(prc) else prc
-        res.append([pre, rec, f1, prc])
-    return res
-
-
 def save_specific_result(labels, output, threshold, kinds, s_file):
     """
     Save specific results based on conditions to a file.
@@ -121,6 +94,8 @@ def test(gnn_model, data_loader, device, top_k, threshold, use_nni, s_file=None)
         criterion = nn.BCELoss()  # 二元交叉熵
         total_loss = 0.0
         result = []
+        # top_k = 0 时整个测试集累积之后统一计算
+        metrics = ThresholdMetrics(device)
         for g, features, labels, edge_types, kinds in data_loader:
             output = gnn_model(g, features, edge_types)
             # output = output[torch.eq(seeds, 0)]
@@ -134,9 +109,11 @@ def test(gnn_model, data_loader, device, top_k, threshold, use_nni, s_file=None)
             else:
                 # output = select_result(output)
                 # print(labels, output)
-                result.append(calculate_result_full(labels, output, device))
+                metrics.update(output, labels)
                 # if s_file is not None:
                 #     save_specific_result(labels, output, threshold, kinds, s_file)
+        if top_k == 0:
+            result.append(metrics.compute())
         target = print_result(result, threshold)
         if use_nni:
             print(target[2])
@@ -171,7 +148,7 @@ def init(model_path, load_name, step, model_type, num_layers, in_feats, hidden_s
 
 def main_func(model_path, load_name, embedding_type, step, model_type="GCN", num_layers=3, in_feats=1280, hidden_size=1024,
               attention_heads=8, num_heads=8, num_edge_types=6, use_gpu=True, load_lazy=True, approach="attention",
-              use_nni=False, under_sampling_threshold=15):
+              use_nni=False, under_sampling_threshold=15, num_workers=0):
     """
     测试模型
 
@@ -191,6 +168,7 @@ def main_func(model_path, load_name, embedding_type, step, model_type="GCN", num
     :param approach: train approach: attention or concat
     :param use_nni: default true
     :param under_sampling_threshold: under sampling threshold
+    :param num_workers: number of data loading workers, > 0 for streaming mode
     :return: None
     """
     model, device = init(model_path, load_name, step, model_type, num_layers, in_feats, hidden_size,
@@ -201,7 +179,8 @@ def main_func(model_path, load_name, embedding_type, step, model_type="GCN", num
     else:
         self_loop = True
     data_loader = load_prediction_data(model_path, 'test', embedding_type, batch_size=1, step=step, self_loop=self_loop,
-                                       load_lazy=load_lazy, under_sampling_threshold=under_sampling_threshold)
+                                       load_lazy=load_lazy, under_sampling_threshold=under_sampling_threshold,
+                                       num_workers=num_workers)
     # thresholds = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
     threshold = 0.4
     for k in [0]:
@@ -1,10 +1,13 @@
 import ast
+import hashlib
 import math
 import os
 from os.path import join
 from typing import Literal
 
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
 from sklearn.cluster import KMeans
 from collections import Counter
 
@@ -12,11 +15,14 @@ import dgl
 import pandas as pd
 import torch
 from dgl import DGLGraph
-from pandas import DataFrame
 from torch.utils.data import DataLoader
 import torch.nn.functional as F
 
+from .graph_store import GraphStore, KIND_MAPPING, get_store_path
+
 LOAD_MODE = Literal['train', 'valid', 'test']
+# 预处理图缓存的版本，处理逻辑变化时需要修改
+CACHE_VERSION = 1
 
 
 def get_graph_files(dataset_path, mode: LOAD_MODE, embedding_type: str, step: int):
@@ -54,16 +60,33 @@ def get_graph_files(dataset_path, mode: LOAD_MODE, embedding_type: str, step: in
 
 
 def compute_similarity(embeddings):
-    num_nodes = embeddings.shape[0]
-    similarity_matrix = torch.zeros((num_nodes, num_nodes))
-    for i in range(num_nodes):
-        for j in range(i + 1, num_nodes):
-            similarity = F.cosine_similarity(embeddings[i].unsqueeze(0), embeddings[j].unsqueeze(0))
-            similarity_matrix[i, j] = similarity
-            similarity_matrix[j, i] = similarity
+    """
+    节点两两之间的余弦相似度，对角线为 0
+    """
+    normalized = F.normalize(embeddings, dim=1, eps=1e-8)
+    similarity_matrix = normalized @ normalized.T
+    similarity_matrix.fill_diagonal_(0)
     return similarity_matrix
 
 
+def remove_unconnected_nodes(graph: DGLGraph):
+    """
+    删除与正样本不连通的节点（边视为无向），只保留包含正样本的连通分量
+
+    :param graph: 图
+    :return: 删除节点之后的图
+    """
+    num_nodes = graph.num_nodes()
+    src, dst = graph.edges()
+    adj = sp.coo_matrix((np.ones(src.shape[0]), (src.cpu().numpy(), dst.cpu().numpy())), shape=(num_nodes, num_nodes))
+    _, component = connected_components(adj, directed=False)
+    component = torch.from_numpy(component)
+    true_component = torch.unique(component[graph.ndata['label'].cpu() == 1])
+    need_to_remove = (~torch.isin(component, true_component)).nonzero(as_tuple=True)[0]
+    graph.remove_nodes(need_to_remove.to(graph.device))
+    return graph
+
+
 def similarity_sample(graph: DGLGraph):
     kinds = torch.unique(graph.ndata['kind'])
     # 去除负样本那种和正样本相似度超过平均值的 elements
@@ -82,15 +105,11 @@ def similarity_sample(graph: DGLGraph):
             avg_label_1_similarity = label_1_similarities[label_1_similarities != 0].mean().item()
 
         label_0_to_label_1_similarities = []
-        for node_0 in label_0_nodes:
-            curr_node = []
-            for node_1 in label_1_nodes:
-                similarity = F.cosine_similarity(graph.ndata['embedding'][node_0].unsqueeze(0),
-                                                 graph.ndata['embedding'][node_1].unsqueeze(0), dim=1)
-                curr_node.append(similarity.item())
-            # (curr_node > avg_label_1_similarity).count()
-            if len(curr_node) > 0:
-                label_0_to_label_1_similarities.append(sum(curr_node) / len(curr_node))
+        if label_1_nodes.numel() > 0 and label_0_nodes.numel() > 0:
+            # 每个负样本与所有正样本相似度的平均值
+            label_0_embeddings = F.normalize(graph.ndata['embedding'][label_0_nodes], dim=1, eps=1e-8)
+            label_1_embeddings = F.normalize(graph.ndata['embedding'][label_1_nodes], dim=1, eps=1e-8)
+            label_0_to_label_1_similarities = (label_0_embeddings @ label_1_embeddings.T).mean(dim=1).tolist()
 
         if label_0_to_label_1_similarities and label_1_nodes.numel() > 1:
             new_s = label_0_to_label_1_similarities.copy()
@@ -101,24 +120,7 @@ def similarity_sample(graph: DGLGraph):
             t = torch.tensor(label_0_to_label_1_similarities)
             need_to_remove = label_0_nodes[t < avg_label_1_similarity]
             graph.remove_nodes(need_to_remove.tolist())
-    true_nodes = (graph.ndata['label'] == 1).nonzero(as_tuple=True)[0].tolist()
-    while True:
-        curr_len = len(true_nodes)
-        src, dst = graph.edges()
-        for i in range(len(src)):
-            if src[i].item() in true_nodes and dst[i].item() not in true_nodes:
-                true_nodes.append(dst[i].item())
-            if dst[i].item() in true_nodes and src[i].item() not in true_nodes:
-                true_nodes.append(src[i].item())
-        if len(true_nodes) == curr_len:
-            break
-    all_nodes = graph.nodes()
-    need_to_remove = []
-    for node in all_nodes:
-        if node not in true_nodes:
-            need_to_remove.append(node)
-    graph.remove_nodes(need_to_remove)
-    return graph
+    return remove_unconnected_nodes(graph)
 
 
 def cluster_sample(graph: DGLGraph):
@@ -160,169 +162,192 @@ def cluster_sample(graph: DGLGraph):
             need_to_remove_1 = label_1_nodes[label_1 != mode]
             if need_to_remove_1.shape[0] != 0:
                 graph.remove_nodes(need_to_remove_1.tolist())
-    true_nodes = (graph.ndata['label'] == 1).nonzero(as_tuple=True)[0].tolist()
-    while True:
-        curr_len = len(true_nodes)
-        src, dst = graph.edges()
-        for i in range(len(src)):
-            if src[i].item() in true_nodes and dst[i].item() not in true_nodes:
-                true_nodes.append(dst[i].item())
-            if dst[i].item() in true_nodes and src[i].item() not in true_nodes:
-                true_nodes.append(src[i].item())
-        if len(true_nodes) == curr_len:
-            break
-    all_nodes = graph.nodes()
-    need_to_remove = []
-    for node in all_nodes:
-        if node not in true_nodes:
-            need_to_remove.append(node)
-    graph.remove_nodes(need_to_remove)
-    return graph
+    return remove_unconnected_nodes(graph)
 
 
 
-def my_under_sampling(nodes: DataFrame, edges: DataFrame, mode: str, threshold: float):
+def random_under_sampling(graph: DGLGraph, mode: LOAD_MODE, under_sampling_threshold: float, seed=None):
     """
-    分层随机欠采样（保证图的连通性），根据阈值随机欠采样，如果超过阈值，则随机采样生成多对结果，count = neg / pos / threshold
+    分层随机欠采样（保证图的连通性），根据阈值随机欠采样负样本，直接在图的张量上进行
 
-    :param nodes: 节点数据 columns=['node_id', 'code_embedding', 'label', 'kind']
-    :param edges: 边数据 columns=['start_node_id', 'end_node_id', 'relation']
-    :param threshold: 欠采样阈值 负样本/正样本
+    :param graph: 图
     :param mode: 样本选择，train, valid, test
-    :return: 随机欠采样后的节点数据和边数据,可能有多对
+    :param under_sampling_threshold: 欠采样阈值 负样本/正样本
+    :param seed: 随机种子，不为 None 时结果可复现
+    :return: 欠采样后的图，节点顺序为 正样本 + 依次采样的负样本
     """
-    # print('threshold = ', threshold)
     # 验证集和测试集固定采样比,也就是峰值，训练集之后在此基础上进行网格搜索
     if mode == 'valid' or mode == 'test':
-        threshold = 30.0
-    neg_count = (nodes['label'] == 0).sum()
-    pos_count = (nodes['label'] == 1).sum()
-    if pos_count == 0:
-        pos_count = 1
+        under_sampling_threshold = 30.0
+    labels = graph.ndata['label'].cpu()
+    neg_count = int((labels == 0).sum())
+    pos_count = max(int((labels == 1).sum()), 1)
     # 如果没有达到阈值，不需要采样
-    if neg_count / pos_count <= threshold:
-        return [(nodes, edges)]
-    # 最多采样 1 次
-    count = min(math.floor(neg_count / pos_count / threshold), 1)
-    final_graphs = []
-    # print(neg_count, pos_count)
-    all_neg_nodes = nodes[nodes['label'] == 0]
-    need_sample_num = pos_count * threshold
-    # 循环不重复采样，生成多个图，防止信息过分丢失
-    for _ in range(count):
-        final_nodes = nodes[(nodes['label'] == 1)]
-        sample_count = need_sample_num
-        while len(final_nodes) < (pos_count + need_sample_num):
-            # print(len(final_nodes), ' ', pos_count + need_sample_num, ' ', sample_count)
-            sample_neg_nodes = all_neg_nodes.sample(int(sample_count))
-            # 只留下与final_nodes中的节点有关联的节点
-            middle_ids = final_nodes['node_id'].tolist()
-            middle_edges = edges[edges['start_node_id'].isin(middle_ids) | edges['end_node_id'].isin(middle_ids)]
-            t_nodes = list(set(middle_edges['start_node_id'].tolist() + middle_edges['end_node_id'].tolist()))
-            sample_neg_nodes = sample_neg_nodes[sample_neg_nodes['node_id'].isin(t_nodes)]
-            sample_count -= len(sample_neg_nodes)
-            final_nodes = pd.concat([final_nodes, sample_neg_nodes])
-        merged_ids = final_nodes['node_id'].tolist()
-        final_edges = edges[edges['start_node_id'].isin(merged_ids) & edges['end_node_id'].isin(merged_ids)]
-        final_nodes = final_nodes.copy(deep=True)
-        final_edges = final_edges.copy(deep=True)
-        final_nodes.reset_index(drop=True, inplace=True)  # 下面需要根据索引修改，需要重置
-        final_edges.reset_index(drop=True, inplace=True)
-        # 构建新的节点id映射关系
-        map_ids = dict()
-        index = 0
-        id_list = final_nodes['node_id'].tolist()
-        # print('id_list', id_list)
-        # 更新节点
-        for _id in id_list:
-            map_ids[_id] = index
-            final_nodes.at[index, 'node_id'] = index
-            index += 1
-        # 更新边
-        for i, row in final_edges.iterrows():
-            final_edges.at[i, 'start_node_id'] = map_ids.get(row['start_node_id'])
-            final_edges.at[i, 'end_node_id'] = map_ids.get(row['end_node_id'])
-        final_graphs.append((final_nodes, final_edges))
-    return final_graphs
-
-
-def random_under_sampling(graph, mode, under_sampling_threshold):
-    # 提取第一个维度的数据并转成 DataFrame 的列
-    data = {
-        'node_id': [graph.nodes()[i].item() for i in range(graph.nodes().shape[0])],
-        'embedding': [graph.ndata['embedding'][i].tolist() for i in range(graph.ndata['embedding'].shape[0])],
-        'label': [graph.ndata['label'][i].item() for i in range(graph.ndata['label'].shape[0])],
-        'kind': [graph.ndata['kind'][i].item() for i in range(graph.ndata['kind'].shape[0])]
-    }
-    # 创建 DataFrame
-    nodes = pd.DataFrame(data)
-    (src, dst) = graph.edges()
-    data = {
-        'start_node_id': [src[i].item() for i in range(src.shape[0])],
-        'end_node_id': [dst[i].item() for i in range(dst.shape[0])],
-        'relation': [graph.edata['relation'][i].item() for i in range(graph.edata['relation'].shape[0])]
-    }
-    # 创建 DataFrame
-    edges = pd.DataFrame(data)
-    sample_nodes, sample_edges = my_under_sampling(nodes, edges, mode, under_sampling_threshold)[0]
-    src, dst = sample_edges['start_node_id'].tolist(), sample_edges['end_node_id'].tolist()
-    g = dgl.graph(data=(src, dst), num_nodes=len(sample_nodes))
-    g.ndata['embedding'] = torch.Tensor(sample_nodes['embedding'].tolist())
-    g.ndata['label'] = torch.tensor(sample_nodes['label'].tolist(), dtype=torch.float32)
-    g.ndata['kind'] = torch.tensor(sample_nodes['kind'].tolist(), dtype=torch.int64)
-    g.edata['relation'] = torch.tensor(sample_edges['relation'].tolist(), dtype=torch.int64)
+    if neg_count / pos_count <= under_sampling_threshold:
+        return graph
+    generator = torch.Generator()
+    if seed is not None:
+        generator.manual_seed(seed)
+    else:
+        generator.seed()
+    src, dst = [t.cpu() for t in graph.edges()]
+    need_sample_num = pos_count * under_sampling_threshold
+    selected = labels == 1
+    order = [selected.nonzero(as_tuple=True)[0]]
+    selected_count = int(selected.sum())
+    sample_count = need_sample_num
+    while selected_count < pos_count + need_sample_num:
+        # 与已选节点相邻的节点
+        neighbor = torch.zeros_like(selected)
+        neighbor[dst[selected[src]]] = True
+        neighbor[src[selected[dst]]] = True
+        candidates = ((labels == 0) & ~selected).nonzero(as_tuple=True)[0]
+        if not neighbor[candidates].any():
+            break
+        permutation = torch.randperm(candidates.shape[0], generator=generator)
+        sample_neg_nodes = candidates[permutation[:max(int(sample_count), 1)]]
+        # 只留下与已选节点有关联的节点
+        sample_neg_nodes = sample_neg_nodes[neighbor[sample_neg_nodes]]
+        selected[sample_neg_nodes] = True
+        order.append(sample_neg_nodes)
+        selected_count += sample_neg_nodes.shape[0]
+        sample_count -= sample_neg_nodes.shape[0]
+    nodes = torch.cat(order).to(graph.device)
+    return dgl.node_subgraph(graph, nodes, store_ids=False)
+
+
+def process_graph(g: DGLGraph, mode: LOAD_MODE, under_sampling_threshold: float, self_loop=True, seed=None,
+                  sampling=cluster_sample):
+    """
+    对加载好的图进行过滤、欠采样以及添加自环
+
+    :param g: 图
+    :param mode: 数据集模式 Literal['train', 'valid', 'test']
+    :param under_sampling_threshold: 欠采样阈值
+    :param self_loop: self loop
+    :param seed: 欠采样随机种子
+    :param sampling: 过滤函数 cluster_sample or similarity_sample
+    :return: 图
+    """
+    # 是否 similarity 过滤
+    g = sampling(g)
+    # 是否 undersample
+    if under_sampling_threshold > 0:
+        g = random_under_sampling(g, mode, under_sampling_threshold, seed)
+    # 添加自环边
+    if self_loop:
+        g = dgl.add_self_loop(g, edge_feat_names=['relation'], fill_data=4)
     return g
 
 
-def load_graph_data(node_file, edge_file, mode: LOAD_MODE, under_sampling_threshold: float, self_loop=True):
+def read_graph_data(node_file, edge_file):
     """
-    加载图，从nodes.tsv,edges.tsv文件加载节点特征和边信息
+    从nodes.tsv,edges.tsv文件读取原始的图，不做任何处理
 
     :param node_file: 节点文件
     :param edge_file: 边文件
-    :param mode: 数据集模式 Literal['train', 'valid', 'test']
-    :param under_sampling_threshold: 欠采样阈值
-    :param self_loop: self loop
     :return: 图
     """
-    # print('handling {0}'.format(node_file))
     nodes = pd.read_csv(node_file)  # columns=['node_id', 'code_embedding', 'label', 'kind']
     edges = pd.read_csv(edge_file)  # columns=['start_node_id', 'end_node_id', 'relation']
-    graphs = []
     src, dst = edges['start_node_id'].tolist(), edges['end_node_id'].tolist()
     g = dgl.graph(data=(src, dst), num_nodes=len(nodes))
     g.ndata['embedding'] = torch.Tensor(nodes['code_embedding'].apply(lambda x: ast.literal_eval(x)).tolist())
     g.ndata['label'] = torch.tensor(nodes['label'].tolist(), dtype=torch.float32)
-    kind_mapping = {'variable': 0, 'function': 1, 'class': 2, 'interface': 3}
-    nodes['kind_encoded'] = nodes['kind'].map(kind_mapping)
+    nodes['kind_encoded'] = nodes['kind'].map(KIND_MAPPING)
     g.ndata['kind'] = torch.tensor(nodes['kind_encoded'].tolist(), dtype=torch.int64)
     g.edata['relation'] = torch.tensor(edges['relation'].tolist(), dtype=torch.int64)
-    # 是否 similarity 过滤
-    # if under_sampling_threshold == 0:
-    # g = similarity_sample(g)
-    g = cluster_sample(g)
-    # 是否 undersample
-    if under_sampling_threshold > 0:
-        g = random_under_sampling(g, mode, under_sampling_threshold)
-    # 添加自环边
-    if self_loop:
-        g = dgl.add_self_loop(g, edge_feat_names=['relation'], fill_data=4)
-    # 是否使用 similarity 过滤
-    graphs.append(g)
-    # print(g, g.nodes(), g.edges())
+    return g
+
+
+def read_store_data(store_path):
+    """
+    从二进制 graph_store 读取一个划分的所有原始图，不需要解析文本
+
+    :param store_path: graph_store 路径
+    :return: 图列表
+    """
+    graphs = []
+    store = GraphStore(store_path)
+    for i in range(len(store)):
+        data = store[i]
+        g = dgl.graph(data=(torch.from_numpy(data['src']), torch.from_numpy(data['dst'])),
+                      num_nodes=data['label'].shape[0])
+        g.ndata['embedding'] = torch.from_numpy(data['embedding'])
+        g.ndata['label'] = torch.from_numpy(data['label']).to(torch.float32)
+        g.ndata['kind'] = torch.from_numpy(data['kind'])
+        g.edata['relation'] = torch.from_numpy(data['relation'])
+        graphs.append(g)
+    return graphs
+
+
+def load_graph_data(node_file, edge_file, mode: LOAD_MODE, under_sampling_threshold: float, self_loop=True,
+                    seed=None):
+    """
+    加载图，从nodes.tsv,edges.tsv文件加载节点特征和边信息
+
+    :param node_file: 节点文件
+    :param edge_file: 边文件
+    :param mode: 数据集模式 Literal['train', 'valid', 'test']
+    :param under_sampling_threshold: 欠采样阈值
+    :param self_loop: self loop
+    :param seed: 欠采样随机种子
+    :return: 图
+    """
+    # print('handling {0}'.format(node_file))
+    return [process_graph(read_graph_data(node_file, edge_file), mode, under_sampling_threshold, self_loop, seed)]
+
+
+def get_cache_key(source_path, source_files, *params):
+    """
+    缓存的 key，由源文件(相对路径, 大小, 修改时间)、缓存版本以及处理参数计算 hash
+
+    :param source_path: 源文件所在目录
+    :param source_files: 源文件列表
+    :param params: 处理参数
+    :return: key
+    """
+    sha = hashlib.sha1(f'v{CACHE_VERSION}'.encode())
+    for file in sorted(source_files):
+        stat = os.stat(file)
+        sha.update(f'{os.path.relpath(file, source_path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    for param in params:
+        sha.update(f'{param};'.encode())
+    return sha.hexdigest()[:16]
+
+
+def load_cached_graphs(cache_file, load_lazy, build):
+    """
+    如果存在缓存则直接读取，否则调用 build 生成图并保存为 dgl 二进制格式, 缓存中的图都在 cpu 上
+
+    :param cache_file: 缓存文件
+    :param load_lazy: 是否读取缓存
+    :param build: 生成图的函数
+    :return: 图列表
+    """
+    if load_lazy and os.path.exists(cache_file):
+        print(f'lazyload {os.path.basename(cache_file)}...')
+        graphs, _ = dgl.load_graphs(cache_file)
+        return graphs
+    graphs = build()
+    if len(graphs) > 0:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        dgl.save_graphs(cache_file, graphs)
     return graphs
 
 
 # 构建数据集和 DataLoader
 class PreloadedGraphDataset(torch.utils.data.Dataset):
     def __init__(self, gs: list[DGLGraph], device):
-        self.graphs = [graph.to(device) for graph in gs]
+        # 图保存在 cpu 上，取 batch 的时候再放到 device 上
+        self.graphs = gs
+        self.device = device
 
     def __len__(self):
         return len(self.graphs)
 
     def __getitem__(self, idx):
-        gra = self.graphs[idx]
+        gra = self.graphs[idx].to(self.device)
         features = gra.ndata['embedding']
         labels = gra.ndata['label']
         edge_types = gra.edata['relation']
@@ -350,10 +375,135 @@ def collate(batch):
     return batched_graph, features, labels, edge_types, kinds
 
 
+class SizeBucketBatchSampler(torch.utils.data.Sampler):
+    """
+    按照图的大小分桶，并按节点数/边数预算组 batch，而不是固定的图数量。
+    节点数在 [bucket_base^k, bucket_base^(k+1)) 之间的图为同一个桶，shuffle 时只在桶内打乱，组好的 batch 再整体打乱
+    """
+
+    def __init__(self, graphs: list[DGLGraph], node_budget=None, edge_budget=None, max_batch_size=None, shuffle=True,
+                 bucket_base=2.0, seed=None):
+        """
+        :param graphs: 图列表
+        :param node_budget: 每个 batch 的最大节点数
+        :param edge_budget: 每个 batch 的最大边数
+        :param max_batch_size: 每个 batch 的最大图数量
+        :param shuffle: 是否打乱
+        :param bucket_base: 分桶的底数，越小桶内图的大小越接近
+        :param seed: 随机种子
+        """
+        self.num_nodes = [g.num_nodes() for g in graphs]
+        self.num_edges = [g.num_edges() for g in graphs]
+        self.node_budget = node_budget
+        self.edge_budget = edge_budget
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+        buckets = dict()
+        for i in sorted(range(len(graphs)), key=lambda i: (self.num_nodes[i], self.num_edges[i])):
+            buckets.setdefault(math.floor(math.log(max(self.num_nodes[i], 1), bucket_base)), []).append(i)
+        self.buckets = [buckets[key] for key in sorted(buckets)]
+        self.batches = self.plan()
+
+    def fits(self, batch, nodes, edges):
+        if len(batch) == 0:
+            return True
+        if self.max_batch_size is not None and len(batch) >= self.max_batch_size:
+            return False
+        if self.node_budget is not None and nodes > self.node_budget:
+            return False
+        if self.edge_budget is not None and edges > self.edge_budget:
+            return False
+        return True
+
+    def plan(self):
+        """
+        :return: 一个 epoch 的所有 batch
+        """
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = [bucket[i] for i in torch.randperm(len(bucket), generator=self.generator).tolist()]
+            batch, nodes, edges = [], 0, 0
+            for idx in bucket:
+                # 单个图超过预算时单独作为一个 batch
+                if not self.fits(batch, nodes + self.num_nodes[idx], edges + self.num_edges[idx]):
+                    batches.append(batch)
+                    batch, nodes, edges = [], 0, 0
+                batch.append(idx)
+                nodes += self.num_nodes[idx]
+                edges += self.num_edges[idx]
+            if len(batch) > 0:
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=self.generator).tolist()]
+        return batches
+
+    def __iter__(self):
+        self.batches = self.plan()
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def stream_collate(batch):
+    """
+    streaming 模式下的 collate，在 DataLoader 的 worker 进程中执行。
+    合并后的图只保留结构，节点和边的特征单独返回，由 DataLoader 放到 pinned memory
+
+    :param batch: batch图集合
+    :return: 合并后的大图，以及特征集合
+    """
+    graphs, features, labels, edge_types, kinds = map(list, zip(*batch))
+    batched_graph = dgl.batch(graphs, ndata=None, edata=None)
+    return batched_graph, torch.cat(features, dim=0), torch.cat(labels, dim=0), torch.cat(edge_types, dim=0), \
+        torch.cat(kinds, dim=0)
+
+
+class DeviceDataLoader:
+    """
+    包装 DataLoader，将 cpu 上的 batch 异步拷贝到 device，并提前拷贝下一个 batch
+    """
+
+    def __init__(self, data_loader: DataLoader, device):
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def transfer(self, batch):
+        if batch is None:
+            return None
+        g, features, labels, edge_types, kinds = batch
+        non_blocking = self.device.type == 'cuda'
+        return g.to(self.device), features.to(self.device, non_blocking=non_blocking), \
+            labels.to(self.device, non_blocking=non_blocking), edge_types.to(self.device, non_blocking=non_blocking), \
+            kinds.to(self.device, non_blocking=non_blocking)
+
+    def __iter__(self):
+        batches = iter(self.data_loader)
+        next_batch = self.transfer(next(batches, None))
+        while next_batch is not None:
+            batch = next_batch
+            # 当前 batch 计算的同时，下一个 batch 已经开始拷贝
+            next_batch = self.transfer(next(batches, None))
+            yield batch
+
+
 def load_prediction_data(dataset_path, mode: LOAD_MODE, embedding_type: str, batch_size: int, step: int, under_sampling_threshold=15,
-                         self_loop=True, load_lazy=True) -> torch.utils.data.dataloader.DataLoader:
+                         self_loop=True, load_lazy=True, seed=None, sampling=cluster_sample, num_workers=0,
+                         prefetch_factor=2, node_budget=None, edge_budget=None):
     """
-    根据模式加载数据集,可以选择懒加载
+    根据模式加载数据集,可以选择懒加载 \n
+    缓存分为两层，保存在 {embedding_type}_model_dataset_{step}/cache 下：
+    {mode}_raw_{key}.bin 为解析后的原始图，只与源文件有关，不同的欠采样阈值可以共用；
+    {mode}_processed_{key}.bin 为过滤、欠采样、自环之后的图
 
     :param dataset_path: 数据集保存路径
     :param step: 步长
@@ -363,23 +513,54 @@ def load_prediction_data(dataset_path, mode: LOAD_MODE, embedding_type: str, bat
     :param under_sampling_threshold: 欠采样阈值，最终负/正样本比例
     :param self_loop: 是否需要添加自环
     :param load_lazy: 是否加载之前的数据
+    :param seed: 欠采样随机种子
+    :param sampling: 过滤函数 cluster_sample or similarity_sample
+    :param num_workers: 大于 0 时使用 streaming 模式：图保存在 cpu 上，在 num_workers 个进程中 collate，
+    使用 pinned memory 并且异步拷贝到 device，适用于大于显存的数据集
+    :param prefetch_factor: streaming 模式下每个 worker 预取的 batch 数
+    :param node_budget: 设置后按图的大小分桶，每个 batch 的节点数不超过 node_budget，batch_size 作为最大图数量
+    :param edge_budget: 设置后按图的大小分桶，每个 batch 的边数不超过 edge_budget
     :return: 相应数据集的DataLoader
     """
-    old_data_path = join(dataset_path, f'{embedding_type}_model_dataset_{str(step)}', f'{mode}',
-                         f'old_data_{mode}_{under_sampling_threshold}.pkl')
-    if load_lazy and os.path.exists(old_data_path):
-        print('lazyload...')
-        preloaded_dataset = pd.read_pickle(old_data_path)
+    graph_path = join(dataset_path, f'{embedding_type}_model_dataset_{str(step)}')
+    # 优先使用二进制的 graph_store
+    store_path = get_store_path(join(graph_path, mode))
+    if store_path is not None:
+        source_files = [join(store_path, file) for file in os.listdir(store_path)]
     else:
-        # 从文件加载多个图数据
-        graphs = []
-        for node_file, edge_file in get_graph_files(dataset_path, mode, embedding_type, step):
-            graphs = graphs + load_graph_data(node_file, edge_file, mode, under_sampling_threshold, self_loop)
-        # 创建数据集和 DataLoader
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        preloaded_dataset = PreloadedGraphDataset(graphs, device)
-        pd.to_pickle(preloaded_dataset, old_data_path)
-    print(f'total graph: {len(preloaded_dataset)}')
+        graph_files = get_graph_files(dataset_path, mode, embedding_type, step)
+        source_files = [file for pair in graph_files for file in pair]
+    raw_key = get_cache_key(graph_path, source_files)
+    processed_key = get_cache_key(graph_path, source_files, under_sampling_threshold, self_loop, sampling.__name__,
+                                  seed)
+
+    def build_raw():
+        if store_path is not None:
+            return read_store_data(store_path)
+        return [read_graph_data(node_file, edge_file) for node_file, edge_file in graph_files]
+
+    def build_processed():
+        raw_graphs = load_cached_graphs(join(graph_path, 'cache', f'{mode}_raw_{raw_key}.bin'), load_lazy, build_raw)
+        return [process_graph(g, mode, under_sampling_threshold, self_loop, seed, sampling) for g in raw_graphs]
+
+    graphs = load_cached_graphs(join(graph_path, 'cache', f'{mode}_processed_{processed_key}.bin'), load_lazy,
+                                build_processed)
+    # 创建数据集和 DataLoader
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     shuffle = True if mode == 'train' else False
-    data_loader = DataLoader(preloaded_dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate)
+    if node_budget is not None or edge_budget is not None:
+        batch_sampler = SizeBucketBatchSampler(graphs, node_budget, edge_budget, batch_size, shuffle, seed=seed)
+        loader_args = {'batch_sampler': batch_sampler}
+    else:
+        loader_args = {'batch_size': batch_size, 'shuffle': shuffle}
+    if num_workers > 0:
+        preloaded_dataset = PreloadedGraphDataset(graphs, 'cpu')
+        print(f'total graph: {len(preloaded_dataset)}')
+        data_loader = DataLoader(preloaded_dataset, collate_fn=stream_collate, num_workers=num_workers,
+                                 pin_memory=device.type == 'cuda', persistent_workers=True,
+                                 prefetch_factor=prefetch_factor, **loader_args)
+        return DeviceDataLoader(data_loader, device)
+    preloaded_dataset = PreloadedGraphDataset(graphs, device)
+    print(f'total graph: {len(preloaded_dataset)}')
+    data_loader = DataLoader(preloaded_dataset, collate_fn=collate, **loader_args)
     return data_loader
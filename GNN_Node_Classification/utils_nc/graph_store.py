@@ -0,0 +1,132 @@
+"""
+二进制图存储，替代 nodes.tsv/edges.tsv 的文本格式
+
+单个图(construct_input 生成, 每个图目录一个): graph.npz
+    embedding(float32, [N, D]), label(int64, [N]), kind(int64, [N]),
+    src(int64, [E]), dst(int64, [E]), relation(int64, [E])
+整个数据集划分(train/valid/test 目录下): graph_store/*.npy, 可以直接 mmap 读取
+    names: 图目录名
+    node_offsets / edge_offsets: 每个图在节点/边数组中的起止位置, 长度为 图数量 + 1
+    embedding, label, kind: 所有图的节点数据拼接
+    src, dst, relation: 所有图的边数据拼接, src/dst 为图内的节点编号
+"""
+import os
+import shutil
+from os.path import join
+
+import numpy as np
+
+GRAPH_FILE = 'graph.npz'
+STORE_DIR = 'graph_store'
+KIND_MAPPING = {'variable': 0, 'function': 1, 'class': 2, 'interface': 3}
+NODE_ARRAYS = ['embedding', 'label', 'kind']
+EDGE_ARRAYS = ['src', 'dst', 'relation']
+
+
+def save_graph(dest, embedding, label, kind, src, dst, relation):
+    """
+    保存单个图到 dest/graph.npz
+
+    :param dest: 图目录
+    :param embedding: 节点 embedding, [N, D]
+    :param label: 节点标签 origin
+    :param kind: 节点类型，字符串或者 KIND_MAPPING 编码后的整数
+    :param src: 边起点
+    :param dst: 边终点
+    :param relation: 边类型
+    :return: none
+    """
+    kind = [KIND_MAPPING[k] if isinstance(k, str) else k for k in kind]
+    np.savez(join(dest, GRAPH_FILE),
+             embedding=np.asarray(embedding, dtype=np.float32),
+             label=np.asarray(label, dtype=np.int64),
+             kind=np.asarray(kind, dtype=np.int64),
+             src=np.asarray(src, dtype=np.int64),
+             dst=np.asarray(dst, dtype=np.int64),
+             relation=np.asarray(relation, dtype=np.int64))
+
+
+def pack(split_path):
+    """
+    将划分目录下所有图目录中的 graph.npz 按照目录名排序合并成 graph_store
+
+    :param split_path: 数据集划分目录，如 .../astnn_model_dataset_1/train
+    :return: 合并的图数量
+    """
+    store_path = join(split_path, STORE_DIR)
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    names = [name for name in sorted(os.listdir(split_path))
+             if os.path.exists(join(split_path, name, GRAPH_FILE))]
+    if len(names) == 0:
+        return 0
+    # 先读取每个图的大小，计算偏移量
+    node_counts, edge_counts = [], []
+    dim = 0
+    for name in names:
+        with np.load(join(split_path, name, GRAPH_FILE)) as graph:
+            node_counts.append(graph['label'].shape[0])
+            edge_counts.append(graph['src'].shape[0])
+            dim = graph['embedding'].shape[1]
+    node_offsets = np.concatenate([[0], np.cumsum(node_counts)]).astype(np.int64)
+    edge_offsets = np.concatenate([[0], np.cumsum(edge_counts)]).astype(np.int64)
+    os.makedirs(store_path)
+    # 直接写入 memmap，不需要把整个划分放进内存
+    arrays = {
+        'embedding': np.lib.format.open_memmap(join(store_path, 'embedding.npy'), mode='w+', dtype=np.float32,
+                                               shape=(int(node_offsets[-1]), dim)),
+    }
+    for key in ['label', 'kind']:
+        arrays[key] = np.lib.format.open_memmap(join(store_path, f'{key}.npy'), mode='w+', dtype=np.int64,
+                                                shape=(int(node_offsets[-1]),))
+    for key in EDGE_ARRAYS:
+        arrays[key] = np.lib.format.open_memmap(join(store_path, f'{key}.npy'), mode='w+', dtype=np.int64,
+                                                shape=(int(edge_offsets[-1]),))
+    for i, name in enumerate(names):
+        with np.load(join(split_path, name, GRAPH_FILE)) as graph:
+            for key in NODE_ARRAYS:
+                arrays[key][node_offsets[i]:node_offsets[i + 1]] = graph[key]
+            for key in EDGE_ARRAYS:
+                arrays[key][edge_offsets[i]:edge_offsets[i + 1]] = graph[key]
+    for array in arrays.values():
+        array.flush()
+    np.save(join(store_path, 'names.npy'), np.array(names))
+    np.save(join(store_path, 'node_offsets.npy'), node_offsets)
+    np.save(join(store_path, 'edge_offsets.npy'), edge_offsets)
+    return len(names)
+
+
+class GraphStore:
+    """
+    只读的 graph_store，节点和边数组以 mmap 方式打开，按图切片读取
+    """
+
+    def __init__(self, store_path):
+        self.names = np.load(join(store_path, 'names.npy')).tolist()
+        self.node_offsets = np.load(join(store_path, 'node_offsets.npy'))
+        self.edge_offsets = np.load(join(store_path, 'edge_offsets.npy'))
+        self.arrays = {key: np.load(join(store_path, f'{key}.npy'), mmap_mode='r')
+                       for key in NODE_ARRAYS + EDGE_ARRAYS}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        """
+        :return: dict, 包含 NODE_ARRAYS 和 EDGE_ARRAYS 对应的 numpy 数组
+        """
+        n_start, n_end = self.node_offsets[idx], self.node_offsets[idx + 1]
+        e_start, e_end = self.edge_offsets[idx], self.edge_offsets[idx + 1]
+        graph = {key: np.array(self.arrays[key][n_start:n_end]) for key in NODE_ARRAYS}
+        graph.update({key: np.array(self.arrays[key][e_start:e_end]) for key in EDGE_ARRAYS})
+        return graph
+
+
+def get_store_path(split_path):
+    """
+    :return: graph_store 路径，如果不存在则返回 None
+    """
+    store_path = join(split_path, STORE_DIR)
+    if os.path.exists(join(store_path, 'names.npy')):
+        return store_path
+    return None
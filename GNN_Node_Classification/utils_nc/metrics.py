@@ -0,0 +1,62 @@
+"""
+验证和测试用的评价指标，在整个验证/测试过程中累积状态，最后统一计算（micro average）
+"""
+import numpy as np
+import torch
+from torchmetrics import MetricCollection
+from torchmetrics.classification import BinaryAccuracy, BinaryPrecision, BinaryRecall, BinaryF1Score, BinaryAUROC
+from torchmetrics.classification import BinaryAveragePrecision
+
+THRESHOLDS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+
+
+def get_valid_metrics(threshold, device):
+    """
+    验证集的指标集合，每次验证只创建一次，每个 batch 调用 update，最后 compute
+
+    :param threshold: classification threshold
+    :param device: device
+    :return: MetricCollection, keys: accuracy, precision, recall, f1, auroc
+    """
+    return MetricCollection({
+        'accuracy': BinaryAccuracy(threshold=threshold),
+        'precision': BinaryPrecision(threshold=threshold),
+        'recall': BinaryRecall(threshold=threshold),
+        'f1': BinaryF1Score(threshold=threshold),
+        'auroc': BinaryAUROC(thresholds=None),
+    }).to(device)
+
+
+class ThresholdMetrics:
+    """
+    同时计算多个阈值下的 precision, recall, f1，以及与阈值无关的 AUPRC。
+    每次 update 对所有阈值做一次向量化比较，只累积 tp, fp, fn
+    """
+
+    def __init__(self, device, thresholds=None):
+        self.thresholds = torch.tensor(THRESHOLDS if thresholds is None else thresholds, device=device)
+        self.tp = torch.zeros(self.thresholds.shape[0], dtype=torch.long, device=device)
+        self.fp = torch.zeros_like(self.tp)
+        self.fn = torch.zeros_like(self.tp)
+        self.average_precision = BinaryAveragePrecision(thresholds=None).to(device)
+
+    def update(self, output: torch.Tensor, labels: torch.Tensor):
+        # 与 torchmetrics 一致，大于阈值的预测为正样本, [阈值数, 节点数]
+        preds = output.unsqueeze(0) > self.thresholds.unsqueeze(1)
+        target = (labels == 1).unsqueeze(0)
+        self.tp += (preds & target).sum(dim=1)
+        self.fp += (preds & ~target).sum(dim=1)
+        self.fn += (~preds & target).sum(dim=1)
+        self.average_precision.update(output, labels.int())
+
+    def compute(self):
+        """
+        :return: [[precision, recall, f1, auprc], ...] 每个阈值一行，分母为 0 时结果为 0
+        """
+        tp, fp, fn = self.tp.double(), self.fp.double(), self.fn.double()
+        precision = torch.where(tp + fp > 0, tp / (tp + fp), torch.zeros_like(tp))
+        recall = torch.where(tp + fn > 0, tp / (tp + fn), torch.zeros_like(tp))
+        f1 = torch.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), torch.zeros_like(tp))
+        prc = self.average_precision.compute().item()
+        prc = 0 if np.isnan(prc) else prc
+        return [[p, r, f, prc] for p, r, f in zip(precision.tolist(), recall.tolist(), f1.tolist())]
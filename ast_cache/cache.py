@@ -0,0 +1,221 @@
+"""
+javalang 解析结果的持久化缓存，astnn_embedding 和 my_embedding 共享
+
+同一段源码只解析一次：解析结果按 sha1(解析方式 + 源码) 保存在 SQLite 中，
+每个 model 的 astnn_ast.pkl 旁边保存 processed_java_codes.tsv 的 sha1，源码文件没有变化时直接跳过
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from os.path import join
+
+import pandas as pd
+
+__all__ = ['SOURCE_FILE', 'AST_FILE', 'FINGERPRINT_FILE', 'ParseCache', 'recursion_limit', 'parse_executor', 'parse_code',
+           'parse_sources', 'solve_model', 'load_ast']
+
+SOURCE_FILE = 'processed_java_codes.tsv'
+AST_FILE = 'astnn_ast.pkl'
+FINGERPRINT_FILE = 'astnn_ast.sha1'
+CACHE_FILE = 'ast_cache.sqlite'
+# javalang 的 ast 很深，pickle 时需要更大的递归深度
+RECURSION_LIMIT = 10000
+
+repo_root_path = join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'params_validation',
+                      'git_repo_code')
+
+
+
+@contextmanager
+def recursion_limit(limit=RECURSION_LIMIT):
+    """
+    只在 pickle ast 期间提高递归深度，结束后恢复，不影响导入 ast_cache 的其他模块
+    """
+    old = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(old, limit))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(old)
+
+
+def init_worker():
+    # 子进程中解析结果需要 pickle 后传回，子进程只做解析，直接设置
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), RECURSION_LIMIT))
+
+
+def parse_executor(workers=None):
+    """
+    整个运行过程共用一个进程池，不要每个 model 创建一次；进程在第一次提交任务时才启动，全部命中缓存时不会启动子进程
+
+    :param workers: 进程数，None 为 cpu 数量，1 为在当前进程中解析
+    :return: with 语句中得到 ProcessPoolExecutor，workers 为 1 时得到 None
+    """
+    if workers == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+
+def get_parse_type(_id: str):
+    """
+    :param _id: model_dir_kind_ref_id
+    :return: 'type' 表示 class/interface, 否则为 'member'
+    """
+    _id = _id[_id.find('_') + 1:]
+    code_type = _id[:_id.find('_')]
+    return 'type' if code_type == 'class' or code_type == 'interface' else 'member'
+
+
+def parse_code(parse_type: str, code: str):
+    """
+    call javalang to get ast tree for element
+
+    :param parse_type: get_parse_type 的返回值
+    :param code: java 源码
+    :return: ast tree
+    """
+    import javalang
+    tokens = javalang.tokenizer.tokenize(code)
+    parser = javalang.parser.Parser(tokens)
+    # 其实可以统一用 parse_member_declaration()
+    if parse_type == 'type':
+        return parser.parse_class_or_interface_declaration()
+    return parser.parse_member_declaration()
+
+
+class ParseCache:
+    """
+    SQLite 键值存储, key 为 sha1(解析方式 + 源码), value 为 pickle 后的 ast
+    """
+
+    def __init__(self, path=None):
+        self.path = join(repo_root_path, CACHE_FILE) if path is None else path
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS ast (key TEXT PRIMARY KEY, tree BLOB)')
+        self.conn.commit()
+
+    @staticmethod
+    def get_key(parse_type, code):
+        return hashlib.sha1(f'{parse_type}\0{code}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """
+        :return: dict, key -> ast, 只包含命中的 key
+        """
+        result = {}
+        keys = list(keys)
+        # sqlite 默认最多 999 个参数
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i + 900]
+            rows = self.conn.execute(f'SELECT key, tree FROM ast WHERE key IN ({",".join("?" * len(batch))})', batch)
+            with recursion_limit():
+                for key, tree in rows:
+                    result[key] = pickle.loads(tree)
+        return result
+
+    def put_many(self, items):
+        """
+        :param items: [(key, ast), ...]
+        """
+        with recursion_limit():
+            rows = [(key, pickle.dumps(tree)) for key, tree in items]
+        self.conn.executemany('INSERT OR REPLACE INTO ast (key, tree) VALUES (?, ?)', rows)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_sources(source: pd.DataFrame, cache: ParseCache = None, executor: ProcessPoolExecutor = None) -> list:
+    """
+    解析 processed_java_codes.tsv 中的所有元素，相同的源码只解析一次，未命中缓存的在进程池中并行解析
+
+    :param source: 第一列为 id, 第二列为源码
+    :param cache: ParseCache, 为 None 时不使用缓存
+    :param executor: parse_executor 创建的进程池，None 为在当前进程中解析
+    :return: 与 source 每行对应的 ast
+    """
+    parse_types = [get_parse_type(_id) for _id in source.iloc[:, 0]]
+    codes = source.iloc[:, 1].tolist()
+    keys = [ParseCache.get_key(t, c) for t, c in zip(parse_types, codes)]
+    trees = {} if cache is None else cache.get_many(set(keys))
+    # 每个未命中的 key 只解析第一次出现的元素
+    misses = {}
+    for i, key in enumerate(keys):
+        if key not in trees and key not in misses:
+            misses[key] = i
+    print(f'ast cache: {len(trees)} hits, {len(misses)} misses')
+    miss_types = [parse_types[i] for i in misses.values()]
+    miss_codes = [codes[i] for i in misses.values()]
+    if executor is None or len(misses) < 2:
+        parsed = list(map(parse_code, miss_types, miss_codes))
+    else:
+        # 子进程传回的 ast 在当前进程中反序列化
+        with recursion_limit():
+            parsed = list(executor.map(parse_code, miss_types, miss_codes, chunksize=64))
+    new_items = list(zip(misses.keys(), parsed))
+    if cache is not None:
+        cache.put_many(new_items)
+    trees.update(new_items)
+    return [trees[key] for key in keys]
+
+
+def get_fingerprint(file):
+    sha = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def solve_model(model_path, cache: ParseCache = None, executor: ProcessPoolExecutor = None, force=False):
+    """
+    解析 model 的 processed_java_codes.tsv 并保存为 astnn_ast.pkl，源码文件没有变化时跳过
+
+    :param model_path: model 目录
+    :param cache: ParseCache
+    :param executor: parse_executor 创建的进程池
+    :param force: 是否忽略 sha1 强制重新生成 astnn_ast.pkl
+    :return: 是否重新生成了 astnn_ast.pkl
+    """
+    source_file = join(model_path, SOURCE_FILE)
+    ast_file = join(model_path, AST_FILE)
+    fingerprint_file = join(model_path, FINGERPRINT_FILE)
+    fingerprint = get_fingerprint(source_file)
+    if not force and os.path.exists(ast_file) and os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as f:
+            if f.read().strip() == fingerprint:
+                return False
+    # 读java数据文件
+    source = pd.read_csv(source_file, delimiter='\t')
+    ast = pd.DataFrame({'id': source.iloc[:, 0], 'code': parse_sources(source, cache, executor)})
+    with recursion_limit():
+        ast.to_pickle(ast_file)  # 保存解析的结果
+    with open(fingerprint_file, 'w') as f:
+        f.write(fingerprint)
+    return True
+
+
+def load_ast(model_path, cache: ParseCache = None, executor: ProcessPoolExecutor = None):
+    """
+    读取 model 的 astnn_ast.pkl，如果源码文件有变化则先重新解析
+
+    :param executor: parse_executor 创建的进程池，None 为在当前进程中解析
+    :return: pd.DataFrame(['id', 'code']), 没有源码和 ast 时返回 None
+    """
+    if os.path.exists(join(model_path, SOURCE_FILE)):
+        solve_model(model_path, cache, executor)
+    elif not os.path.exists(join(model_path, AST_FILE)):
+        return None
+    with recursion_limit():
+        return pd.read_pickle(join(model_path, AST_FILE))
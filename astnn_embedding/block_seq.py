@@ -0,0 +1,294 @@
+"""
+ASTNN 的紧凑 block sequence 格式，每个 model 一个 astnn_blocks.npz，由 astnn_ast.pkl 转换一次得到，
+之后 word2vec 训练和 ASTNN 编码都只读取数组，不再反序列化 javalang 对象和遍历 ast
+
+token 以字符串表保存（与 word2vec 词表无关），编码时再映射为词表下标:
+    ids: 元素 id, [E]
+    fingerprint: 对应的 processed_java_codes.tsv 的 sha1
+    tokens: token 字符串表, [T]
+    sequence, sequence_offsets: get_sequence 得到的 token 序列（word2vec 语料），按元素拼接
+    node_token, node_parent, node_depth: block 树节点，先序排列，parent 为 block 内的下标，根节点为 -1
+    block_offsets: 每个 block 在节点数组中的起止位置, [B + 1]
+    block_zero: traverse_mul 是否会对该 block 输出全零向量（同一 sequence 中存在该 block 没有的子节点路径）
+    segment_offsets: 每个 sequence（一次 encode 的输入）在 block 数组中的起止位置, [S + 1]，
+        内容相同的 sequence 只保存一次，例如同时作为独立元素的类成员
+    element_refs: 每个元素引用的 sequence 的起止位置, [E + 1]
+    ref_segment, ref_weight: 引用的 sequence 以及在元素 embedding 中的权重, [R]
+元素的 embedding 为其引用的 sequence 编码结果的加权和。成员元素只有一个权重为 1 的引用；
+类/接口为自身（不含 body）和所有成员的平均值，内部类/接口先递归平均，展开后每个引用的权重为路径上 1 / 成员数 的乘积
+"""
+import os
+import re
+from os.path import join
+
+import numpy as np
+import pandas as pd
+from javalang.tree import FieldDeclaration, ConstructorDeclaration, ClassDeclaration, InterfaceDeclaration, \
+    MethodDeclaration, ConstantDeclaration
+
+from ast_cache import AST_FILE, FINGERPRINT_FILE, SOURCE_FILE, ParseCache, recursion_limit, solve_model
+
+BLOCK_FILE = 'astnn_blocks.npz'
+# 格式变化时更新，旧版本的文件会重新转换
+FORMAT_VERSION = 2
+# 写入 word2vec 语料文件时，token 中的空白字符替换为该字符，空 token 也替换为该字符
+SPACE_MARK = '\u2423'
+ARRAYS = ['ids', 'tokens', 'sequence', 'sequence_offsets', 'node_token', 'node_parent', 'node_depth', 'block_offsets',
+          'block_zero', 'segment_offsets', 'element_refs', 'ref_segment', 'ref_weight']
+
+
+def flatten_blocks(seq, stop=-1):
+    """
+    将一个 sequence 的 block 树 ([token, child, ...] 嵌套列表) 按先序展开
+
+    :param seq: block 树列表
+    :param stop: token 为 stop 的子节点及其子树会被忽略，与 traverse_mul 一致
+    :return: tokens, parents (block 内的下标，根节点为 -1), depths, block_sizes, block_zero
+    """
+    tokens, parents, depths, block_sizes = [], [], [], []
+    # (父路径, 子节点位置) -> 路径编号，根节点的路径为 0
+    paths = {}
+    for block in seq:
+        start = len(tokens)
+        stack = [(block, -1, 0, 0)]
+        while stack:
+            node, parent, depth, path = stack.pop()
+            current = len(tokens) - start
+            tokens.append(node[0])
+            parents.append(parent)
+            depths.append(depth)
+            for j in range(len(node) - 1, 0, -1):
+                if node[j][0] != stop:
+                    stack.append((node[j], current, depth + 1, paths.setdefault((path, j - 1), len(paths) + 1)))
+        block_sizes.append(len(tokens) - start)
+    block_zero = [size < len(paths) + 1 for size in block_sizes]
+    return tokens, parents, depths, block_sizes, block_zero
+
+
+def escape_token(token: str):
+    """
+    语料文件按空白字符分词，token 中的空白需要转义，否则会被拆成多个词
+    """
+    return re.sub(r'\s', SPACE_MARK, token) if token != '' else SPACE_MARK
+
+
+def expand(nested_list):
+    for item in nested_list:
+        if isinstance(item, list):
+            for sub_item in expand(item):
+                yield sub_item
+        elif item:
+            yield item
+
+
+def get_header_blocks(tree):
+    """
+    类/接口去掉 body (children[4]) 之后的 block，与清空 body 后调用 get_blocks_v1 的结果相同，但不修改 ast
+
+    :param tree: ClassDeclaration / InterfaceDeclaration
+    :return: block 列表
+    """
+    from tree import BlockNode
+    from utils import get_blocks_v1, get_token
+
+    children = list(tree.children)
+    children[4] = []
+    blocks = [BlockNode(get_token(tree))]
+    for child in expand(children):
+        get_blocks_v1(child, blocks)
+    return blocks
+
+
+def convert(ast: pd.DataFrame, fingerprint=''):
+    """
+    将 astnn_ast.pkl 转换为紧凑格式
+
+    :param ast: pd.DataFrame(['id', 'code'])
+    :param fingerprint: processed_java_codes.tsv 的 sha1
+    :return: dict, ARRAYS 中的所有数组以及 fingerprint
+    """
+    from utils import get_blocks_v1, get_sequence
+
+    token_table = {}
+    sequence, sequence_offsets = [], [0]
+    node_token, node_parent, node_depth, block_offsets, block_zero = [], [], [], [0], []
+    segment_offsets, element_refs, ref_segment, ref_weight = [0], [0], [], []
+    # sequence 内容 -> sequence 下标
+    segment_index = {}
+
+    def get_token_id(token):
+        return token_table.setdefault(token, len(token_table))
+
+    def tree_to_index(node):
+        return [get_token_id(node.token)] + [tree_to_index(child) for child in node.children]
+
+    def add_segment(blocks, weight):
+        tokens, parents, depths, sizes, zero = flatten_blocks([tree_to_index(b) for b in blocks])
+        key = (tuple(tokens), tuple(parents), tuple(sizes))
+        if key not in segment_index:
+            segment_index[key] = len(segment_offsets) - 1
+            node_token.extend(tokens)
+            node_parent.extend(parents)
+            node_depth.extend(depths)
+            block_offsets.extend((np.cumsum(sizes) + block_offsets[-1]).tolist())
+            block_zero.extend(zero)
+            segment_offsets.append(len(block_zero))
+        ref_segment.append(segment_index[key])
+        ref_weight.append(weight)
+
+    def add_member(code_ast, weight):
+        blocks = []
+        get_blocks_v1(code_ast, blocks)
+        add_segment(blocks, weight)
+
+    def add_class(tree, weight):
+        # first get embedding of all fields and methods, and then mean pooling
+        members = [c for c in tree.children[4] if isinstance(c, (FieldDeclaration, ConstantDeclaration,
+                                                                  MethodDeclaration, ConstructorDeclaration,
+                                                                  ClassDeclaration, InterfaceDeclaration))]
+        weight = weight / (len(members) + 1)
+        # embedding first using self information, prevent the error from no body
+        add_segment(get_header_blocks(tree), weight)
+        for c in members:
+            if isinstance(c, (ClassDeclaration, InterfaceDeclaration)):
+                add_class(c, weight)
+            else:
+                add_member(c, weight)
+
+    for _id, code_ast in zip(ast['id'], ast['code']):
+        words = []
+        get_sequence(code_ast, words)
+        sequence.extend(get_token_id(word) for word in words)
+        sequence_offsets.append(len(sequence))
+        code_type = _id.split('_')[1]
+        if code_type == 'class' or code_type == 'interface':
+            add_class(code_ast, 1.0)
+        else:
+            add_member(code_ast, 1.0)
+        element_refs.append(len(ref_segment))
+
+    tokens = np.empty(len(token_table), dtype=object)
+    for token, index in token_table.items():
+        tokens[index] = token
+    return {
+        'version': np.array(FORMAT_VERSION),
+        'ids': np.array(ast['id'].tolist(), dtype=str),
+        'fingerprint': np.array(fingerprint),
+        # 所有 token 都是字符串，保存为定长字符串数组，不需要 pickle
+        'tokens': tokens.astype(str) if len(tokens) else np.array([], dtype=str),
+        'sequence': np.array(sequence, dtype=np.int32),
+        'sequence_offsets': np.array(sequence_offsets, dtype=np.int64),
+        'node_token': np.array(node_token, dtype=np.int32),
+        'node_parent': np.array(node_parent, dtype=np.int32),
+        'node_depth': np.array(node_depth, dtype=np.int32),
+        'block_offsets': np.array(block_offsets, dtype=np.int64),
+        'block_zero': np.array(block_zero, dtype=bool),
+        'segment_offsets': np.array(segment_offsets, dtype=np.int64),
+        'element_refs': np.array(element_refs, dtype=np.int64),
+        'ref_segment': np.array(ref_segment, dtype=np.int64),
+        'ref_weight': np.array(ref_weight, dtype=np.float32),
+    }
+
+
+class BlockSeqs:
+    """
+    只读的 astnn_blocks.npz
+    """
+
+    def __init__(self, arrays):
+        for key in ARRAYS:
+            setattr(self, key, arrays[key])
+        self.fingerprint = str(arrays['fingerprint'])
+        self.ids = self.ids.tolist()
+
+    @classmethod
+    def load(cls, file):
+        """
+        :return: BlockSeqs，文件格式版本不一致时返回 None
+        """
+        with np.load(file, allow_pickle=False) as arrays:
+            if 'version' not in arrays or int(arrays['version']) != FORMAT_VERSION:
+                return None
+            return cls({key: arrays[key] for key in ARRAYS + ['fingerprint']})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_sequence(self, idx) -> list[str]:
+        """
+        :return: 第 idx 个元素的 token 序列，即 get_sequence 的结果
+        """
+        return self.tokens[self.sequence[self.sequence_offsets[idx]:self.sequence_offsets[idx + 1]]].tolist()
+
+    def get_token_index(self, vocab, max_token):
+        """
+        :return: token 表中每个 token 在词汇表中的下标，不在词汇表中为 max_token
+        """
+        index = []
+        for token in self.tokens.tolist():
+            # 由语料文件训练的 word2vec 词表中是转义后的 token
+            if token not in vocab:
+                token = escape_token(token)
+            index.append(vocab[token].index if token in vocab else max_token)
+        return np.array(index, dtype=np.int64)
+
+    def get_refs(self, indices):
+        """
+        :param indices: 元素下标
+        :return: (ref_element: 每个引用属于 indices 中的第几个元素, ref_segment, ref_weight)
+        """
+        starts, ends = self.element_refs[indices], self.element_refs[np.asarray(indices) + 1]
+        ref_element = np.repeat(np.arange(len(indices)), ends - starts)
+        refs = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(indices) else np.array([], int)
+        return ref_element, self.ref_segment[refs], self.ref_weight[refs]
+
+    def gather(self, segments, token_index):
+        """
+        取出多个 sequence 的节点数组，用于 BatchTreeEncoder.linearize_arrays
+
+        :param segments: sequence 下标
+        :param token_index: get_token_index 的返回值
+        :return: tokens, parents (block 内下标), depths, block_sizes, block_zero, lens
+        """
+        block_ranges = [(self.segment_offsets[s], self.segment_offsets[s + 1]) for s in segments]
+        node_slices = [slice(self.block_offsets[b0], self.block_offsets[b1]) for b0, b1 in block_ranges]
+        block_slices = [slice(b0, b1) for b0, b1 in block_ranges]
+        tokens = token_index[np.concatenate([self.node_token[s] for s in node_slices])]
+        parents = np.concatenate([self.node_parent[s] for s in node_slices])
+        depths = np.concatenate([self.node_depth[s] for s in node_slices])
+        block_sizes = np.concatenate([np.diff(self.block_offsets[s.start:s.stop + 1]) for s in block_slices])
+        block_zero = np.concatenate([self.block_zero[s] for s in block_slices])
+        lens = [b1 - b0 for b0, b1 in block_ranges]
+        return tokens, parents, depths, block_sizes, block_zero, lens
+
+
+def load_blocks(model_path, parse_cache: ParseCache = None, executor=None):
+    """
+    读取 model 的 astnn_blocks.npz，不存在或者源码有变化时先由 astnn_ast.pkl 转换
+
+    :param model_path: model 目录
+    :param parse_cache: ast_cache.ParseCache
+    :param executor: ast_cache.parse_executor 创建的进程池，None 为在当前进程中解析
+    :return: BlockSeqs，没有源码和 ast 时返回 None
+    """
+    block_file = join(model_path, BLOCK_FILE)
+    if os.path.exists(join(model_path, SOURCE_FILE)):
+        solve_model(model_path, parse_cache, executor)
+    if not os.path.exists(join(model_path, AST_FILE)):
+        return None
+    fingerprint = ''
+    if os.path.exists(join(model_path, FINGERPRINT_FILE)):
+        with open(join(model_path, FINGERPRINT_FILE)) as f:
+            fingerprint = f.read().strip()
+    blocks = BlockSeqs.load(block_file) if os.path.exists(block_file) else None
+    if blocks is not None:
+        # 没有 sha1 时 (旧的 astnn_ast.pkl) 只能以 ast 文件更新时间判断
+        if fingerprint != '' and blocks.fingerprint == fingerprint:
+            return blocks
+        if fingerprint == '' and os.path.getmtime(block_file) >= os.path.getmtime(join(model_path, AST_FILE)):
+            return blocks
+    with recursion_limit():
+        ast = pd.read_pickle(join(model_path, AST_FILE))
+    arrays = convert(ast, fingerprint)
+    np.savez(block_file, **arrays)
+    return BlockSeqs(arrays)
@@ -1,21 +1,22 @@
 """
 根据 word2vec 模型和 block sequence 生成词向量
 """
-import copy
 import os
 from os.path import join
 
 import pandas as pd
 import numpy as np
 import torch
-from javalang.tree import FieldDeclaration, ConstructorDeclaration, ClassDeclaration, InterfaceDeclaration, \
-    MethodDeclaration, ConstantDeclaration
 from tqdm.auto import tqdm
 import xml.etree.ElementTree as ET
 
 import warnings
 from gensim.models.word2vec import Word2Vec
 
+from ast_cache import ParseCache, parse_executor
+from block_seq import BlockSeqs, load_blocks
+from embedding_cache import EmbeddingCache, JobJournal, atomic_to_pickle, cached_embedding, get_file_identity, \
+    get_state_identity, select_shard
 from my_model import BatchProgramCC
 
 tqdm.pandas()
@@ -54,99 +55,78 @@ def choose_prediction_step(step: int, ast: pd.DataFrame, model_path, model_dir):
         return ast[ast['id'].isin(keys)]
 
 
-def generate_block_seqs(code_ast, vocab, max_token) -> list[list]:
+def pooling_class_interface_embedding(blocks: BlockSeqs, elements, segment_encodes, segment_rows):
     """
-    generate block sequences with index representations
-
-    Returns:
+    一次加权求和得到所有元素的 embedding，成员元素直接取自身 sequence 的编码，
+    类/接口为自身（去掉 body）和所有成员 embedding 的平均值，内部类/接口先递归平均
+
+    :param blocks: BlockSeqs
+    :param elements: 元素下标
+    :param segment_encodes: 所有需要的 sequence 的编码结果, [sequence 数, 2 * hidden_dim]
+    :param segment_rows: sequence 下标 -> segment_encodes 中的行号, np.ndarray
+    :return: [len(elements), 2 * hidden_dim]
     """
-    from utils import get_blocks_v1
-
-    def tree_to_index(node):
-        token = node.token
-        # 如果在词汇表中，就用词汇表的token，否则为最大的token
-        result = [vocab[token].index if token in vocab else max_token]
-        children = node.children
-        for child in children:
-            result.append(tree_to_index(child))
-        return result
+    ref_element, ref_segment, ref_weight = blocks.get_refs(elements)
+    device = segment_encodes.device
+    rows = torch.from_numpy(segment_rows[ref_segment]).to(device)
+    weights = torch.from_numpy(ref_weight).to(device=device, dtype=segment_encodes.dtype).unsqueeze(1)
+    pooled = torch.zeros(len(elements), segment_encodes.shape[1], dtype=segment_encodes.dtype, device=device)
+    return pooled.index_add(0, torch.from_numpy(ref_element).to(device), segment_encodes[rows] * weights)
 
-    def trans2seq(r):
-        """transfer tree to word token sequences
 
-        :arg r: ast tree
-        """
-        # print('ast tree: ', r)
-        blocks = []
-        get_blocks_v1(r, blocks)  # 这里应该是根据ast tree去得到子树的一系列表达
-        # print('get_blocks', r, '--------', blocks)
-        tree = []
-        for b in blocks:
-            btree = tree_to_index(b)  # 然后去转换为vocab token形式
-            tree.append(btree)
-        # print(tree)
-        return tree
-
-    blocks = trans2seq(code_ast)  # 将code转换为sequence
-    return blocks  # 这里实际上是用于去预测的处理过的数据，是code word2vec sequence
-
-
-def pooling_class_interface_embedding(tree, model, vocab, max_token):
-    # print(tree)
-    embeddings = []
-    chi = copy.deepcopy(tree.children[4])
-    tree.children[4].clear()
-    # embedding first using self information, prevent the error from no body
-    embeddings.append(model.encode(generate_block_seqs(tree, vocab, max_token)))
-    for i in chi:
-        tree.children[4].append(i)
-    children = tree.children[4]
-    for c in children:
-        if isinstance(c, FieldDeclaration) or isinstance(c, ConstantDeclaration):
-            embeddings.append(model.encode(generate_block_seqs(c, vocab, max_token)))
-        elif isinstance(c, MethodDeclaration) or isinstance(c, ConstructorDeclaration):
-            embeddings.append(model.encode(generate_block_seqs(c, vocab, max_token)))
-        elif isinstance(c, ClassDeclaration) or isinstance(c, InterfaceDeclaration):
-            embeddings.append(pooling_class_interface_embedding(c, model, vocab, max_token))
-    # print(len(embeddings))
-    # print(torch.cat(embeddings))
-    return torch.mean(torch.stack(embeddings), dim=0)
-    # return torch.max(torch.stack(embeddings), dim=0).values
-
-
-def get_embedding(ast_df: pd.DataFrame, model, vocab, max_token) -> pd.DataFrame:
+def get_embedding(ast_df: pd.DataFrame, model, blocks: BlockSeqs, vocab, max_token, cache: EmbeddingCache = None,
+                  sources: dict = None, batch_size=256) -> pd.DataFrame:
     """
     读取 block 文件，获取每个 element's 200 embedding vector，并保存到 vector.pkl 文件中
+
+    :param ast_df: 需要编码的元素，columns=['id'], index 为元素在 blocks 中的下标
+    :param blocks: model 的 BlockSeqs
+    :param cache: embedding 缓存，为 None 时不使用缓存
+    :param sources: id -> 元素源码，作为缓存的 key，为 None 时不使用缓存
+    :param batch_size: 每次批量编码的 sequence 数量
     """
     print(f'embedding code...->{ast_df.shape}')
+    elements = ast_df.index.tolist()
+    token_index = blocks.get_token_index(vocab, max_token)
 
-    def embedding(member):
+    def embedding(indices):
         """
         需要针对不同的类型进行不同的embedding code
         function and variable directly embedding，class and interface need to pooling
+        先批量编码所有元素（以及类/接口成员）用到的不同 sequence，再一次加权求和完成所有池化
 
-        :param member: [id, ast]
-        :return: code embedding
+        :param indices: elements 中需要计算的下标
+        :return: code embedding 列表
         """
-        _id: str = member[0]
-        _id = _id[_id.find('_') + 1:]
-        code_type = _id[:_id.find('_')]
-        code_ast = member[1]
-        # print(member)
-        if code_type == 'class' or code_type == 'interface':
-            # first get embedding of all fields and methods, and then max pooling
-            final_embedding = pooling_class_interface_embedding(code_ast, model, vocab, max_token)
-        else:
-            final_embedding = model.encode(generate_block_seqs(code_ast, vocab, max_token))
-        return final_embedding
-
-    for i, row in ast_df.iterrows():
-        ast_df.at[i, 'code'] = embedding(row)
-    ast_df.columns = ['id', 'embedding']
-    return ast_df
-
-
-def main_func(step, description, r=0.8, use_gpu=True, hidden_dim=100, code_dim=128):
+        selected = [elements[i] for i in indices]
+        segments = np.unique(blocks.get_refs(selected)[1])
+        segment_rows = np.zeros(len(blocks.segment_offsets) - 1, dtype=np.int64)
+        segment_rows[segments] = np.arange(len(segments))
+        encodes = []
+        with torch.no_grad():
+            for start in tqdm(range(0, len(segments), batch_size)):
+                batch = segments[start:start + batch_size]
+                linearized = model.encoder.linearize_arrays(*blocks.gather(batch, token_index))
+                encodes.append(model.encode_linearized(linearized))
+            encodes = torch.cat(encodes) if len(encodes) else torch.zeros(0, 2 * model.hidden_dim)
+            pooled = pooling_class_interface_embedding(blocks, selected, encodes, segment_rows)
+        # clone 避免保存时把整个 batch 的 storage 一起序列化
+        return [row.clone() for row in pooled]
+
+    if cache is None or sources is None:
+        results = embedding(list(range(len(elements))))
+    else:
+        # class/interface 和成员的解析方式不同，类型也作为 key 的一部分
+        texts = [_id.split('_')[1] + '\n' + sources[_id] for _id in ast_df['id']]
+        results = cached_embedding(cache, texts, embedding)
+    return pd.DataFrame({'id': ast_df['id'].tolist(), 'embedding': pd.Series(results, dtype=object)})
+
+
+def main_func(step, description, r=0.8, use_gpu=True, hidden_dim=100, code_dim=128, shard=None, workers=None):
+    """
+    :param shard: 'i/N', 只处理第 i 个分片的 model, None 为全部处理；所有分片需要在同一台机器上运行
+    :param workers: 源码有变化时解析 ast 的进程数, None 为 cpu 数量
+    """
     if description == 'all':
         project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
         ratio = r
@@ -184,18 +164,30 @@ def main_func(step, description, r=0.8, use_gpu=True, hidden_dim=100, code_dim=1
         model.cuda()
         # model.to('cuda:1')
     model.hidden = model.init_hidden()
-    for project_model_name in project_model_list:
-        print('**********', project_model_name)
-        project_path = join(repo_root_path, project_model_name, 'repo_first_3')
-        model_dir_list = os.listdir(project_path)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        for model_dir in model_dir_list:
-            print('---------------', model_dir)
-            model_path = join(project_path, model_dir)
-            ast_path = join(model_path, 'astnn_ast.pkl')
-            # 如果不存在ast，跳过处理
-            if not os.path.exists(ast_path):
-                continue
-            ast_df = pd.read_pickle(ast_path)
-            ast_df = choose_prediction_step(step, ast_df, model_path, model_dir)
-            get_embedding(ast_df, model, vocab, MAX_TOKENS).to_pickle(join(model_path, f'{description}_{step}_astnn_embedding.pkl'))
+    # 编码器权重（包括随机初始化的部分）和 word2vec 模型都作为缓存 key 的一部分，权重不同时不会命中
+    w2v_file = join(root_path, 'w2v', f'{description}_{str(step)}_{str(ratio)}_node_w2v_{code_dim}')
+    encoder = f'astnn:{get_file_identity(w2v_file)}:{hidden_dim}:{get_state_identity(model)}'
+    with EmbeddingCache(encoder) as cache, JobJournal(f'{description}_{step}:{encoder}') as journal, \
+            ParseCache() as parse_cache, parse_executor(workers) as executor:
+        for project_model_name in project_model_list:
+            print('**********', project_model_name)
+            project_path = join(repo_root_path, project_model_name, 'repo_first_3')
+            model_dir_list = os.listdir(project_path)
+            model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
+            for model_dir in select_shard(model_dir_list, shard):
+                model_path = join(project_path, model_dir)
+                output_file = join(model_path, f'{description}_{step}_astnn_embedding.pkl')
+                if journal.is_done(model_path, output_file):
+                    continue
+                print('---------------', model_dir)
+                blocks = load_blocks(model_path, parse_cache, executor)
+                # 如果不存在ast，跳过处理
+                if blocks is None:
+                    continue
+                ast_df = choose_prediction_step(step, pd.DataFrame({'id': blocks.ids}), model_path, model_dir)
+                sources = None
+                if os.path.exists(join(model_path, 'processed_java_codes.tsv')):
+                    sources = pd.read_csv(join(model_path, 'processed_java_codes.tsv'), sep='\t')
+                    sources = dict(zip(sources.iloc[:, 0], sources.iloc[:, 1]))
+                atomic_to_pickle(get_embedding(ast_df, model, blocks, vocab, MAX_TOKENS, cache, sources), output_file)
+                journal.mark_done(model_path, output_file)
@@ -1,6 +1,9 @@
 import torch.nn as nn
 import torch.nn.functional as F
 import torch
+import numpy as np
+
+from block_seq import flatten_blocks
 
 torch.manual_seed(0)
 print(torch.__version__)
@@ -78,6 +81,68 @@ class BatchTreeEncoder(nn.Module):
         # 返回输入张量给定维度上每行的最大值，并同时返回每个最大值的位置索引。
         return max_node
 
+    def linearize(self, seqs):
+        """
+        将多个元素的 block 树展开成按层排列的索引张量，树的递归只在这里做一次
+
+        traverse_mul 中每个节点的向量为 W_c(embedding(token)) + 子节点向量之和，
+        每个 block 的结果为该 block 所有节点向量的最大值；如果同一元素中存在该 block 没有的子节点路径，
+        traverse_mul 对这条路径输出的是全零向量，所以最大值还要和 0 比较
+
+        :param seqs: 多个元素的 block sequence, 即 generate_block_seqs 的返回值
+        :return: linearize_arrays 的返回值
+        """
+        tokens, parents, depths, block_sizes, block_zero = [], [], [], [], []
+        for seq in seqs:
+            for total, part in zip([tokens, parents, depths, block_sizes, block_zero], flatten_blocks(seq, self.stop)):
+                total.extend(part)
+        return self.linearize_arrays(tokens, parents, depths, block_sizes, block_zero, [len(seq) for seq in seqs])
+
+    def linearize_arrays(self, tokens, parents, depths, block_sizes, block_zero, lens):
+        """
+        由展开后的节点数组生成 forward_levels 的输入，block_seq.BlockSeqs.gather 也生成同样的数组
+
+        :param tokens: 节点的词表下标，block 内先序排列
+        :param parents: 父节点在 block 内的下标，根节点为 -1
+        :param depths: 节点深度
+        :param block_sizes: 每个 block 的节点数
+        :param block_zero: 每个 block 的最大值是否需要和 0 比较
+        :param lens: 每个元素的 block 数
+        :return: dict, tokens, parents, blocks, levels(每层的节点下标，从深到浅), block_zero, lens
+        """
+        block_sizes = np.asarray(block_sizes, dtype=np.int64)
+        blocks = np.repeat(np.arange(block_sizes.shape[0]), block_sizes)
+        block_start = np.concatenate([[0], np.cumsum(block_sizes)[:-1]]).astype(np.int64)
+        parents = np.asarray(parents, dtype=np.int64)
+        parents = np.where(parents >= 0, parents + block_start[blocks], -1)
+        depths = torch.from_numpy(np.asarray(depths, dtype=np.int64))
+        order = torch.argsort(depths, descending=True, stable=True)
+        level_sizes = torch.bincount(depths).flip(0).tolist()
+        return {
+            'tokens': self.create_tensor(torch.from_numpy(np.asarray(tokens, dtype=np.int64))),
+            'parents': self.create_tensor(torch.from_numpy(parents)),
+            'blocks': self.create_tensor(torch.from_numpy(blocks)),
+            'levels': [self.create_tensor(level) for level in torch.split(order, level_sizes)][:-1],
+            'block_zero': self.create_tensor(torch.from_numpy(np.asarray(block_zero, dtype=bool))),
+            'lens': list(lens),
+        }
+
+    def forward_levels(self, batch):
+        """
+        与 forward 相同的计算，但是一次处理 linearize 之后的多个元素，每层只做一次 index_add
+
+        :param batch: linearize 的返回值
+        :return: 每个 block 的向量, [block 数, encode_dim]
+        """
+        node = self.W_c(self.embedding(batch['tokens']))
+        # 从最深层开始，把子节点向量加到父节点上, 根节点层不需要处理
+        for level in batch['levels']:
+            node = node.index_add(0, batch['parents'][level], node[level])
+        blocks = batch['blocks'].unsqueeze(1).expand_as(node)
+        block_node = torch.full((batch['block_zero'].shape[0], self.encode_dim), float('-inf'), device=node.device)
+        block_node = block_node.scatter_reduce(0, blocks, node, reduce='amax')
+        return torch.where(batch['block_zero'].unsqueeze(1), block_node.clamp(min=0), block_node)
+
 
 class BatchProgramCC(nn.Module):
     def __init__(self, embedding_dim, hidden_dim, vocab_size, encode_dim, batch_size, use_gpu=True,
@@ -172,3 +237,31 @@ class BatchProgramCC(nn.Module):
         gru_out = F.max_pool1d(gru_out, gru_out.size(2)).squeeze(2)
         gru_out = gru_out[0]
         return gru_out
+
+    def encode_batch(self, seqs):
+        """
+        一次编码多个元素的 ast sequence，与对每个元素调用 encode 的结果相同
+
+        Args:
+            seqs: 多个元素的 ast sequences
+
+        Returns: [元素数, 2 * hidden_dim]
+        """
+        return self.encode_linearized(self.encoder.linearize(seqs))
+
+    def encode_linearized(self, batch):
+        """
+        编码 BatchTreeEncoder.linearize / linearize_arrays 展开后的多个元素
+
+        Args:
+            batch: linearize 的返回值
+
+        Returns: [元素数, 2 * hidden_dim]
+        """
+        encodes = torch.split(self.encoder.forward_levels(batch), batch['lens'])
+        encodes = nn.utils.rnn.pad_sequence(encodes, batch_first=True)
+        encodes = nn.utils.rnn.pack_padded_sequence(encodes, torch.LongTensor(batch['lens']), True, False)
+        # 初始 hidden 为全零，与 init_hidden 相同
+        gru_out, _ = self.bigru(encodes)
+        gru_out, _ = nn.utils.rnn.pad_packed_sequence(gru_out, batch_first=True, padding_value=-1e9)
+        return torch.max(gru_out, dim=1)[0]
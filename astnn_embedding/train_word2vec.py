@@ -2,7 +2,9 @@
 加载项目中的所有 ast,合并，并训练生成 word2vec 模型
 可以选择步长，根据步长那部分数据训练word2vec模型
 """
+import inspect
 import os
+import sys
 from os.path import join
 import xml.etree.ElementTree as ET
 
@@ -10,6 +12,8 @@ import pandas as pd
 import warnings
 from tqdm.auto import tqdm
 
+from ast_cache import ParseCache, parse_executor
+from block_seq import BLOCK_FILE, BlockSeqs, escape_token, load_blocks
 from dataset_split_util import get_models_by_ratio
 
 tqdm.pandas()
@@ -48,40 +52,87 @@ def choose_prediction_step(step: int, ast: pd.DataFrame, model_path, model_dir):
         return ast[ast['id'].isin(keys)]
 
 
-def dictionary_and_embedding(trees, size, step, ratio, description):
+class SequenceCorpus:
+    """
+    可以重复迭代的 word2vec 语料，每次迭代时才逐个读取 model 的 astnn_blocks.npz，内存中只保留一个 model
+    """
+
+    def __init__(self, models):
+        """
+        :param models: [(model_path, 需要的元素下标), ...]
+        """
+        self.models = models
+
+    def __iter__(self):
+        for model_path, indices in self.models:
+            blocks = BlockSeqs.load(join(model_path, BLOCK_FILE))
+            for i in indices:
+                yield blocks.get_sequence(i)
+
+
+def write_corpus_file(corpus, corpus_file):
+    """
+    将语料写成 gensim LineSentence 格式，每行一个 sequence，token 以空格分隔
+
+    :return: sequence 数量
+    """
+    count = 0
+    with open(corpus_file, 'w', encoding='utf-8') as f:
+        for sequence in corpus:
+            f.write(' '.join(escape_token(token) for token in sequence))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def dictionary_and_embedding(corpus, size, step, ratio, description, use_corpus_file=True):
     """
     分解词典和训练 word2vec 模型
 
     Args:
-        trees: 需要训练的 ast 集合 pd.DataFrame(['id', 'code'])
+        corpus: 需要训练的 token sequence 集合，可以重复迭代，即每个 ast 的 get_sequence 结果
         size: 嵌入大小 128
         step: 步长
         ratio: 训练的数据比例
         description: 训练的项目描述信息：all训练所有项目，onlymylyn，nopde,noplatform
+        use_corpus_file: 先把语料写入文件再训练，gensim 支持 corpus_file 时（>= 3.6）每个 worker 直接读文件。
+            gensim 3.5 中按行读取且不拆分长行，与内存中的语料训练结果相同（超过 10000 个 token 的 sequence 都只训练前 10000 个）；
+            corpus_file 模式下 gensim 会把超过 10000 个 token 的行拆成多个句子，与内存中的语料不完全相同
 
     Returns: 无
     """
     if not os.path.exists(join(astnn_root, 'w2v')):
         os.mkdir(join(astnn_root, 'w2v'))
-    from utils import get_sequence
-
-    def trans_to_sequences(ast):
-        sequence = []
-        get_sequence(ast, sequence)
-        return sequence
-
-    corpus = trees['code'].progress_apply(trans_to_sequences)  # 调用函数，将 code 转换为 sequence
-    # str_corpus = [' '.join(c) for c in corpus]  # 按照空格连接所有单词
     # 将这些 sentence 交给 word2vec 训练，并保存该模型
-    from gensim.models.word2vec import Word2Vec
+    from gensim.models.word2vec import Word2Vec, LineSentence
+    name = f'{description}_{str(step)}_{str(ratio)}_node_w2v_{str(size)}'
     print('training word2vec...')
     # w2v = Word2Vec(corpus, size=size, workers=16, sg=1, max_final_vocab=3000)
-    w2v = Word2Vec(corpus, size=size, workers=16, sg=1, max_final_vocab=50000)
+    if use_corpus_file:
+        corpus_file = join(astnn_root, 'w2v', f'{name}.corpus.txt')
+        try:
+            print(f'corpus size: {write_corpus_file(corpus, corpus_file)}')
+            if 'corpus_file' in inspect.signature(Word2Vec.__init__).parameters:
+                w2v = Word2Vec(corpus_file=corpus_file, size=size, workers=16, sg=1, max_final_vocab=50000)
+            else:
+                # 旧版本 gensim 没有 corpus_file，按行流式读取
+                # LineSentence 默认把长行拆成 10000 个 token 一句，这里每行一句，与内存中的语料一致
+                w2v = Word2Vec(LineSentence(corpus_file, max_sentence_length=sys.maxsize), size=size, workers=16, sg=1,
+                               max_final_vocab=50000)
+        finally:
+            # 语料文件可能有几个 GB，训练失败时也删除
+            if os.path.exists(corpus_file):
+                os.remove(corpus_file)
+    else:
+        w2v = Word2Vec(corpus, size=size, workers=16, sg=1, max_final_vocab=50000)
     print(len(w2v.wv.vocab))
-    w2v.save(join(astnn_root, 'w2v', f'{description}_{str(step)}_{str(ratio)}_node_w2v_{str(size)}'))
+    w2v.save(join(astnn_root, 'w2v', name))
 
 
-def main_func(step: int, description, r=0.8, code_dim=128):
+def main_func(step: int, description, r=0.8, code_dim=128, use_corpus_file=True, workers=None):
+    """
+    :param workers: 源码有变化时解析 ast 的进程数, None 为 cpu 数量
+    """
     if description == 'all':
         project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
         ratio = r
@@ -100,25 +151,28 @@ def main_func(step: int, description, r=0.8, code_dim=128):
     else:
         project_model_list = []
         ratio = 1
-    trees = pd.DataFrame(columns=['id', 'code'])
-    for project_model_name in project_model_list:
-        print('***********************', project_model_name)
-        project_path = join(root_path, project_model_name, 'repo_first_3')
-        model_dir_list = get_models_by_ratio(project_model_name, 0.0, ratio)
-        for model_dir in model_dir_list:
-            # if model_dir == '2813':
-            #     continue
-            print('---------------', model_dir)
-            model_path = join(project_path, model_dir)
-            ast_path = join(model_path, 'astnn_ast.pkl')
-            # 如果不存在ast，跳过处理
-            if not os.path.exists(ast_path):
-                continue
-            ast = pd.read_pickle(ast_path)
-            ast = choose_prediction_step(step, ast, model_path, model_dir)
-            print(f'ast size: {len(ast)}')
-            trees = pd.concat([trees, ast])
-    dictionary_and_embedding(trees, code_dim, step, ratio, description)
+    # 只记录每个 model 需要的元素下标，sequence 在训练时才读取
+    models = []
+    # 源码有变化的 model 会先重新解析，解析结果与 solve_ast 共享
+    with ParseCache() as parse_cache, parse_executor(workers) as executor:
+        for project_model_name in project_model_list:
+            print('***********************', project_model_name)
+            project_path = join(root_path, project_model_name, 'repo_first_3')
+            model_dir_list = get_models_by_ratio(project_model_name, 0.0, ratio)
+            for model_dir in model_dir_list:
+                # if model_dir == '2813':
+                #     continue
+                print('---------------', model_dir)
+                model_path = join(project_path, model_dir)
+                blocks = load_blocks(model_path, parse_cache, executor)
+                # 如果不存在ast，跳过处理
+                if blocks is None:
+                    continue
+                # sequence 在转换 astnn_blocks.npz 时已经生成，不需要再遍历 ast
+                ast = choose_prediction_step(step, pd.DataFrame({'id': blocks.ids}), model_path, model_dir)
+                print(f'ast size: {len(ast)}')
+                models.append((model_path, ast.index.tolist()))
+    dictionary_and_embedding(SequenceCorpus(models), code_dim, step, ratio, description, use_corpus_file)
 
 # Word2Vec(corpus, size=size, workers=16, sg=1, max_final_vocab=3000)
 # corpus： 这是你的文本语料库。确保 corpus 是一个经过预处理的、可以迭代的文本集合，其中每个文档都是一个词列表。
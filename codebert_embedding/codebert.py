@@ -5,12 +5,15 @@ import math
 from transformers import AutoTokenizer, AutoModel
 from tokenizers import Tokenizer
 import torch
+from tqdm.auto import tqdm
 
 tokenizer = AutoTokenizer.from_pretrained("./codebert_base")
 model = AutoModel.from_pretrained("./codebert_base", )
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model = model.to(device)
+# embedding 缓存的编码器版本，修改 batch_embedding 的切分或池化方式后需要更新
+ENCODER_VERSION = 'chunk512_mean_v1'
 # BPE_tokenizer = Tokenizer.from_file("./tokens/all_1_0.8_tokens_128.json")
 # torch.Size([1, 23, 768])
 # tensor([[-0.1423,  0.3766,  0.0443,  ..., -0.2513, -0.3099,  0.3183],
@@ -44,10 +47,46 @@ def single_embedding(node: str):
         torch.cuda.empty_cache()
         return torch.mean(torch.stack(all_embeddings), dim=0).squeeze(0).to(torch.device('cpu'))
 
-node = """
-nnn
-"""
-print(single_embedding(node).shape)
+def batch_embedding(nodes: list[str], batch_size=32, max_length=512) -> list[torch.Tensor]:
+    """
+    批量计算 embedding，与 single_embedding 的结果一致：
+    每个元素按 max_length 切分成多段，每段求 token 的平均，再对所有段求平均。
+    所有元素的段按长度排序后 padding 成 batch，使用 attention mask 计算平均
+
+    :param nodes: 代码元素列表
+    :param batch_size: 每次前向计算的段数
+    :param max_length: 每段的最大 token 数
+    :return: 每个元素的 embedding (cpu)，没有 token 的元素为全 0
+    """
+    # 一次性 tokenize 所有元素，不添加特殊 token，与 tokenizer.tokenize 一致
+    all_token_ids = tokenizer(nodes, add_special_tokens=False, verbose=False)['input_ids']
+    chunks = []  # (元素下标, token ids)
+    for i, token_ids in enumerate(all_token_ids):
+        for start in range(0, len(token_ids), max_length):
+            chunks.append((i, token_ids[start: start + max_length]))
+    order = sorted(range(len(chunks)), key=lambda c: len(chunks[c][1]))
+    chunk_embeddings = [None] * len(chunks)
+    with torch.inference_mode():
+        model.eval()
+        for start in tqdm(range(0, len(order), batch_size)):
+            batch = order[start: start + batch_size]
+            input_ids = torch.full((len(batch), len(chunks[batch[-1]][1])), tokenizer.pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros_like(input_ids)
+            for row, c in enumerate(batch):
+                token_ids = chunks[c][1]
+                input_ids[row, :len(token_ids)] = torch.tensor(token_ids)
+                attention_mask[row, :len(token_ids)] = 1
+            input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+            context_embeddings = model(input_ids, attention_mask=attention_mask)[0]
+            mask = attention_mask.unsqueeze(-1).to(context_embeddings.dtype)
+            pooled = ((context_embeddings * mask).sum(dim=1) / mask.sum(dim=1)).cpu()
+            for row, c in enumerate(batch):
+                chunk_embeddings[c] = pooled[row]
+    element_embeddings = [[] for _ in nodes]
+    for (i, _), embedding in zip(chunks, chunk_embeddings):
+        element_embeddings[i].append(embedding)
+    return [torch.mean(torch.stack(embeddings), dim=0) if len(embeddings) > 0
+            else torch.zeros(model.config.hidden_size) for embeddings in element_embeddings]
 
 
 # def codebert(current_node: list[str]):
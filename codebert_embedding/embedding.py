@@ -1,3 +1,4 @@
+import argparse
 import os
 from os.path import join
 import pandas as pd
@@ -5,7 +6,9 @@ import xml.etree.ElementTree as ET
 from tqdm.auto import tqdm
 import warnings
 
-from codebert_embedding.codebert import single_embedding
+from codebert_embedding.codebert import batch_embedding, model, ENCODER_VERSION
+from embedding_cache import EmbeddingCache, JobJournal, atomic_to_pickle, cached_embedding, get_state_identity, \
+    select_shard
 
 tqdm.pandas()
 warnings.filterwarnings('ignore')
@@ -42,15 +45,22 @@ def choose_prediction_step(step: int, sources: pd.DataFrame, model_path, model_d
         return sources[sources['id'].isin(keys)]
 
 
-def get_embedding(tokens: pd.DataFrame) -> pd.DataFrame:
+def get_embedding(tokens: pd.DataFrame, batch_size=32, cache: EmbeddingCache = None) -> pd.DataFrame:
     print('embedding codebert code...')
-    tokens['tokens'] = tokens['tokens'].progress_apply(lambda x: single_embedding(x))
+    texts = tokens['tokens'].tolist()
+    tokens['tokens'] = cached_embedding(cache, texts,
+                                        lambda indices: batch_embedding([texts[i] for i in indices], batch_size))
     tokens.columns = ['id', 'embedding']
     # tokens.info()
     return tokens
 
 
-def main_func(step, description):
+def main_func(step, description, shard=None):
+    """
+    已经完成的 model 记录在任务日志中，重新运行时自动跳过
+
+    :param shard: 'i/N', 只处理第 i 个分片的 model, None 为全部处理；所有分片需要在同一台机器上运行
+    """
     if description == 'all':
         project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
     elif description == 'onlymylyn':
@@ -63,15 +73,20 @@ def main_func(step, description):
         project_model_list = ['my_mylyn']
     else:
         project_model_list = []
+    # codebert 是预训练模型，所有 step 和 description 共享同一份缓存
+    cache = EmbeddingCache(f'codebert:{ENCODER_VERSION}:{get_state_identity(model)}')
+    journal = JobJournal(f'{description}_{step}:{cache.encoder}')
     for project_model_name in project_model_list:
         print('**********', project_model_name)
         project_path = join(repo_root_path, project_model_name, 'repo_first_3')
         model_dir_list = os.listdir(project_path)
         model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        index = model_dir_list.index('1115')
-        for model_dir in model_dir_list[index:]:
-            print('---------------', model_dir)
+        for model_dir in select_shard(model_dir_list, shard):
             model_path = join(project_path, model_dir)
+            output_file = join(model_path, f'{description}_{step}_codebert_embedding.pkl')
+            if journal.is_done(model_path, output_file):
+                continue
+            print('---------------', model_dir)
             tokens_path = join(model_path, 'java_tokens.tsv')
             # 如果不存在block_path，跳过处理
             if not os.path.exists(tokens_path):
@@ -79,11 +94,20 @@ def main_func(step, description):
             # sources = pd.read_csv(tokens_path, sep='\t')
             # sources = choose_prediction_step(step, pd.read_csv(tokens_path, sep='\t'), model_path, model_dir)
             embedding_result = get_embedding(
-                choose_prediction_step(step, pd.read_csv(tokens_path, sep='\t'), model_path, model_dir))
-            embedding_result.to_pickle(join(model_path, f'{description}_{step}_codebert_embedding.pkl'))
+                choose_prediction_step(step, pd.read_csv(tokens_path, sep='\t'), model_path, model_dir), cache=cache)
+            atomic_to_pickle(embedding_result, output_file)
+            journal.mark_done(model_path, output_file)
             # del embedding_result
             # gc.collect()
+    journal.close()
+    cache.close()
 
 
 if __name__ == '__main__':
-    main_func(3, 'mylyn')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--step", type=int, required=False, default=3)
+    parser.add_argument("--description", type=str, required=False, default='mylyn')
+    parser.add_argument("--shard", type=str, required=False, default=None,
+                        help='i/N, all shards must run on one host with the journal and cache on a local disk')
+    args = parser.parse_args()
+    main_func(args.step, args.description, args.shard)
@@ -0,0 +1,142 @@
+"""
+元素 embedding 的内容寻址缓存，保存在 SQLite 中，不同 step 和 description 之间共享
+
+key = sha256(编码器标识 + 元素源码文本)，同一段代码用同一个编码器只计算一次。
+编码器标识需要包含所有会影响结果的东西（模型文件、权重、维度等），否则会命中过期的结果
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from os.path import join
+
+import numpy as np
+import torch
+
+__all__ = ['CACHE_FILE', 'EmbeddingCache', 'get_cache_path', 'get_file_identity', 'get_state_identity',
+           'cached_embedding']
+
+CACHE_FILE = 'embedding_cache.sqlite'
+
+repo_root_path = join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'params_validation',
+                      'git_repo_code')
+
+
+def get_cache_path():
+    return join(repo_root_path, CACHE_FILE)
+
+
+def get_file_identity(file):
+    """
+    模型文件的标识，文件名 + 大小 + 修改时间，重新训练后自动失效
+
+    :param file: 模型文件
+    :return: str
+    """
+    stat = os.stat(file)
+    return f'{os.path.basename(file)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def get_state_identity(model: torch.nn.Module):
+    """
+    根据模型权重计算标识，权重相同的模型共享缓存
+
+    :param model: torch 模型
+    :return: 16 位 sha1
+    """
+    sha = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        sha.update(name.encode())
+        sha.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """
+    SQLite 键值存储, value 为 float32 的 bytes 和 shape，取出时还原为 torch.Tensor
+    """
+
+    def __init__(self, encoder: str, path=None):
+        """
+        :param encoder: 编码器标识和版本
+        :param path: sqlite 文件路径，默认为 git_repo_code/embedding_cache.sqlite
+        """
+        self.encoder = encoder
+        self.path = get_cache_path() if path is None else path
+        # 多个分片同时写入时等待锁；WAL 模式下读不阻塞写
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, shape TEXT, value BLOB)')
+        self.conn.commit()
+
+    def get_key(self, text: str):
+        return hashlib.sha256(f'{self.encoder}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """
+        :param keys: get_key 生成的 key 列表
+        :return: dict, key -> tensor, 只包含命中的 key
+        """
+        result = {}
+        keys = list(keys)
+        # sqlite 默认最多 999 个参数
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i + 900]
+            rows = self.conn.execute(
+                f'SELECT key, shape, value FROM embedding WHERE key IN ({",".join("?" * len(batch))})', batch)
+            for key, shape, value in rows:
+                result[key] = torch.from_numpy(np.frombuffer(value, dtype=np.float32).reshape(json.loads(shape)).copy())
+        return result
+
+    def put_many(self, items, batch_size=500):
+        """
+        分批提交，每个事务只短暂持有写锁，其他分片不会等待超时
+
+        :param items: [(key, tensor), ...]
+        :param batch_size: 每个事务写入的条数
+        :return: none
+        """
+        items = list(items)
+        for i in range(0, len(items), batch_size):
+            rows = []
+            for key, tensor in items[i:i + batch_size]:
+                array = tensor.detach().cpu().numpy().astype(np.float32)
+                rows.append((key, json.dumps(list(array.shape)), array.tobytes()))
+            self.conn.executemany('INSERT OR REPLACE INTO embedding (key, shape, value) VALUES (?, ?, ?)', rows)
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def cached_embedding(cache: EmbeddingCache, texts: list[str], compute) -> list[torch.Tensor]:
+    """
+    先查缓存，只对未命中且去重后的文本调用 compute，并把结果写回缓存
+
+    :param cache: EmbeddingCache, 为 None 时直接计算
+    :param texts: 元素源码文本
+    :param compute: 函数, list[int] (texts 中的下标) -> list[torch.Tensor]
+    :return: 与 texts 一一对应的 embedding
+    """
+    if cache is None:
+        return compute(list(range(len(texts))))
+    keys = [cache.get_key(text) for text in texts]
+    hits = cache.get_many(set(keys))
+    # 每个未命中的 key 只计算第一次出现的元素
+    misses = {}
+    for i, key in enumerate(keys):
+        if key not in hits and key not in misses:
+            misses[key] = i
+    print(f'embedding cache: {len(hits)} hits, {len(misses)} misses')
+    if len(misses) > 0:
+        computed = compute(list(misses.values()))
+        new_items = list(zip(misses.keys(), computed))
+        cache.put_many(new_items)
+        hits.update(new_items)
+    return [hits[key] for key in keys]
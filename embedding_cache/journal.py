@@ -0,0 +1,124 @@
+"""
+embedding 任务日志，记录每个 model 的输出文件和校验和，中断后重新运行时跳过已经完成的 model
+
+任务标识需要包含编码器标识（与 EmbeddingCache 相同），编码器改变后之前的记录不再有效
+输出先写入临时文件再 rename，中断时不会留下不完整的结果；--shard i/N 可以把 model 列表分给多个进程
+
+任务日志和 embedding 缓存都是 git_repo_code 下的 SQLite 文件，所有分片需要在同一台机器上运行，并且该目录在本地磁盘上。
+NFS 等共享文件系统上 SQLite 的文件锁不可靠，多台机器同时写入可能损坏这两个文件
+"""
+import hashlib
+import os
+import sqlite3
+from os.path import join
+
+__all__ = ['JOURNAL_FILE', 'JobJournal', 'get_journal_path', 'get_checksum', 'parse_shard', 'select_shard',
+           'atomic_to_pickle']
+
+JOURNAL_FILE = 'embedding_jobs.sqlite'
+
+repo_root_path = join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'params_validation',
+                      'git_repo_code')
+
+
+def get_journal_path():
+    return join(repo_root_path, JOURNAL_FILE)
+
+
+def get_checksum(file):
+    """
+    :return: 文件内容的 sha1
+    """
+    sha = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def parse_shard(shard):
+    """
+    :param shard: 'i/N', 第 i 个分片（从 0 开始）共 N 个分片, None 表示不分片
+    :return: (i, N)
+    """
+    if shard is None:
+        return 0, 1
+    index, count = (int(x) for x in shard.split('/'))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'invalid shard: {shard}, expected i/N with 0 <= i < N')
+    return index, count
+
+
+def select_shard(items, shard):
+    """
+    按照下标取模划分，items 的顺序需要在所有分片中一致（如排序后的 model_dir_list）。
+    分片共用同一个任务日志和 embedding 缓存，只能是同一台机器上的多个进程，不能分给多台机器
+
+    :param items: 列表
+    :param shard: 'i/N' 或 None
+    :return: 当前分片的元素
+    """
+    index, count = parse_shard(shard)
+    return items[index::count]
+
+
+def atomic_to_pickle(df, file):
+    """
+    先写入同目录下的临时文件，再 rename 为 file
+
+    :param df: pd.DataFrame
+    :param file: 输出文件
+    :return: none
+    """
+    base, ext = os.path.splitext(file)
+    # 保留扩展名，pandas 根据扩展名推断压缩方式
+    tmp_file = f'{base}.tmp{os.getpid()}{ext}'
+    try:
+        df.to_pickle(tmp_file)
+        os.replace(tmp_file, file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+class JobJournal:
+    """
+    SQLite 记录 (job, model) -> (output, checksum)，同一台机器上的多个分片可以共用同一个文件（需要在本地磁盘上）
+    """
+
+    def __init__(self, job: str, path=None):
+        """
+        :param job: 任务标识，如 description_step + 编码器标识
+        :param path: sqlite 文件路径，默认为 git_repo_code/embedding_jobs.sqlite
+        """
+        self.job = job
+        self.path = get_journal_path() if path is None else path
+        # 多个分片同时写入时等待锁
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS job '
+                          '(job TEXT, model TEXT, output TEXT, checksum TEXT, PRIMARY KEY (job, model))')
+        self.conn.commit()
+
+    def is_done(self, model: str, output: str):
+        """
+        :return: model 已经完成，并且输出文件存在且校验和一致
+        """
+        row = self.conn.execute('SELECT output, checksum FROM job WHERE job = ? AND model = ?',
+                                (self.job, model)).fetchone()
+        if row is None or row[0] != output or not os.path.exists(output):
+            return False
+        return get_checksum(output) == row[1]
+
+    def mark_done(self, model: str, output: str):
+        self.conn.execute('INSERT OR REPLACE INTO job (job, model, output, checksum) VALUES (?, ?, ?, ?)',
+                          (self.job, model, output, get_checksum(output)))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
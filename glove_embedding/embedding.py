@@ -14,6 +14,9 @@ from tqdm.auto import tqdm
 
 import warnings
 
+from embedding_cache import EmbeddingCache, JobJournal, atomic_to_pickle, cached_embedding, get_file_identity, \
+    select_shard
+
 tqdm.pandas()
 warnings.filterwarnings('ignore')
 
@@ -63,14 +66,19 @@ def get_all(glove_model, tokens):
     return torch.tensor(res)
 
 
-def get_embedding(tokens: pd.DataFrame, model) -> pd.DataFrame:
+def get_embedding(tokens: pd.DataFrame, model, cache: EmbeddingCache = None) -> pd.DataFrame:
     print('embedding glove code...')
-    tokens['tokens'] = tokens['tokens'].progress_apply(lambda x: torch.mean(get_all(model, x), dim=0))
+    texts = tokens['tokens'].tolist()
+    tokens['tokens'] = cached_embedding(
+        cache, texts, lambda indices: [torch.mean(get_all(model, texts[i]), dim=0) for i in tqdm(indices)])
     tokens.columns = ['id', 'embedding']
     return tokens
 
 
-def main_func(step, description, r=0.8):
+def main_func(step, description, r=0.8, shard=None):
+    """
+    :param shard: 'i/N', 只处理第 i 个分片的 model, None 为全部处理；所有分片需要在同一台机器上运行
+    """
     if description == 'all':
         project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
         ratio = r
@@ -92,19 +100,27 @@ def main_func(step, description, r=0.8):
     # 加载转化后的文件
     model_file = join(glove_root, 'trained_model', f'{description}_{step}_{ratio}', 'w2v_vectors.txt')
     model = KeyedVectors.load_word2vec_format(model_file)
+    # 模型文件重新训练后标识改变，旧的缓存不会命中
+    cache = EmbeddingCache(f'glove:{description}_{step}_{ratio}:{get_file_identity(model_file)}')
+    journal = JobJournal(f'{description}_{step}:{cache.encoder}')
     for project_model_name in project_model_list:
         print('**********', project_model_name)
         project_path = join(repo_root_path, project_model_name, 'repo_first_3')
         model_dir_list = os.listdir(project_path)
         model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        for model_dir in model_dir_list:
-            print('---------------', model_dir)
+        for model_dir in select_shard(model_dir_list, shard):
             model_path = join(project_path, model_dir)
+            output_file = join(model_path, f'{description}_{step}_glove_embedding.pkl')
+            if journal.is_done(model_path, output_file):
+                continue
+            print('---------------', model_dir)
             tokens_path = join(model_path, 'java_tokens.tsv')
             # 如果不存在block_path，跳过处理
             if not os.path.exists(tokens_path):
                 continue
             sources = pd.read_csv(tokens_path, sep='\t')
             sources = choose_prediction_step(step, sources, model_path, model_dir)
-            get_embedding(sources, model).to_pickle(
-                join(model_path, f'{description}_{step}_glove_embedding.pkl'))
+            atomic_to_pickle(get_embedding(sources, model, cache), output_file)
+            journal.mark_done(model_path, output_file)
+    journal.close()
+    cache.close()
@@ -1,6 +1,6 @@
 """
 该程序用来针对code context model进行扩展，得到用于训练的大图集合
-分1-step,2-step,3-step分别扩展，然后分别保存到相应的文件中
+一次遍历得到1-step,2-step,3-step的扩展结果，然后分别保存到相应的文件中
 """
 import os
 from os.path import join
@@ -31,19 +31,11 @@ def main_func(project_model_name: str):
         # 加载doxygen矩阵
         all_repo_metrics = get_relations.solve_doxygen_metrics(model_path)
         print('----metrics loaded')
-        # 1 step扩展
-        # 读code context model
+        # 读code context model，扩展3步，同时得到每一步的结果
         model_graphs = model_loader.load_code_context_model(model_file)
-        expand_graph.expand_model(model_graphs, all_repo_metrics, 1)
-        model_loader.save_expanded_model(model_graphs, join(model_path, 'new_1_step_expanded_model.xml'))
-        # # 2 step扩展 需要重置
-        model_graphs = model_loader.load_code_context_model(model_file)
-        expand_graph.expand_model(model_graphs, all_repo_metrics, 2)
-        model_loader.save_expanded_model(model_graphs, join(model_path, 'new_2_step_expanded_model.xml'))
-        # # 3 step扩展
-        model_graphs = model_loader.load_code_context_model(model_file)
-        expand_graph.expand_model(model_graphs, all_repo_metrics, 3)
-        model_loader.save_expanded_model(model_graphs, join(model_path, 'new_3_step_expanded_model.xml'))
+        step_graph_lists = expand_graph.expand_model_steps(model_graphs, all_repo_metrics, 3)
+        for step, step_graphs in enumerate(step_graph_lists, start=1):
+            model_loader.save_expanded_model(step_graphs, join(model_path, f'new_{step}_step_expanded_model.xml'))
 
 
 if __name__ == '__main__':
@@ -16,7 +16,10 @@ import xml.etree.ElementTree as ET
 import warnings
 from gensim.models.word2vec import Word2Vec
 
+from ast_cache import ParseCache, load_ast, parse_executor
+from embedding_cache import JobJournal, atomic_to_pickle, get_state_identity, select_shard
 from my_model import BatchProgramCC
+from token_table import get_table_file, build_token_table, load_token_table, get_input_fingerprint, is_table_current
 
 tqdm.pandas()
 warnings.filterwarnings('ignore')
@@ -54,10 +57,11 @@ def choose_prediction_step(step: int, ast: pd.DataFrame, model_path, model_dir):
         return ast[ast['id'].isin(keys)]
 
 
-def generate_block_seqs(code_ast) -> list[list]:
+def generate_block_seqs(code_ast, vocab=None) -> list[list]:
     """
     generate block sequences with index representations
 
+    :param vocab: token_table 的词表，为 None 时保留 token 字符串
     Returns:
     """
     from utils import get_blocks_v1
@@ -65,7 +69,7 @@ def generate_block_seqs(code_ast) -> list[list]:
     def tree_to_index(node):
         token = node.token
         # 如果在词汇表中，就用词汇表的token，否则为最大的token
-        result = [token]
+        result = [token if vocab is None else vocab.get(token, len(vocab))]
         children = node.children
         for child in children:
             result.append(tree_to_index(child))
@@ -91,32 +95,34 @@ def generate_block_seqs(code_ast) -> list[list]:
     return blocks  # 这里实际上是用于去预测的处理过的数据，是code word2vec sequence
 
 
-def pooling_class_interface_embedding(tree, model):
+def pooling_class_interface_embedding(tree, model, vocab=None):
     # print(tree)
     embeddings = []
     chi = copy.deepcopy(tree.children[4])
     tree.children[4].clear()
     # embedding first using self information, prevent the error from no body
-    embeddings.append(model.encode(generate_block_seqs(tree)))
+    embeddings.append(model.encode(generate_block_seqs(tree, vocab)))
     for i in chi:
         tree.children[4].append(i)
     children = tree.children[4]
     for c in children:
         if isinstance(c, FieldDeclaration) or isinstance(c, ConstantDeclaration):
-            embeddings.append(model.encode(generate_block_seqs(c)))
+            embeddings.append(model.encode(generate_block_seqs(c, vocab)))
         elif isinstance(c, MethodDeclaration) or isinstance(c, ConstructorDeclaration):
-            embeddings.append(model.encode(generate_block_seqs(c)))
+            embeddings.append(model.encode(generate_block_seqs(c, vocab)))
         elif isinstance(c, ClassDeclaration) or isinstance(c, InterfaceDeclaration):
-            embeddings.append(pooling_class_interface_embedding(c, model))
+            embeddings.append(pooling_class_interface_embedding(c, model, vocab))
     # print(len(embeddings))
     # print(torch.cat(embeddings))
     return torch.mean(torch.stack(embeddings), dim=0)
     # return torch.max(torch.stack(embeddings), dim=0).values
 
 
-def get_embedding(ast_df: pd.DataFrame, model) -> pd.DataFrame:
+def get_embedding(ast_df: pd.DataFrame, model, vocab=None) -> pd.DataFrame:
     """
     读取 block 文件，获取每个 element's 200 embedding vector，并保存到 vector.pkl 文件中
+
+    :param vocab: token_table 的词表，model 使用对应的向量表时传入
     """
     print(f'embedding code...->{ast_df.shape}')
 
@@ -135,9 +141,9 @@ def get_embedding(ast_df: pd.DataFrame, model) -> pd.DataFrame:
         # print(member)
         if code_type == 'class' or code_type == 'interface':
             # first get embedding of all fields and methods, and then max pooling
-            final_embedding = pooling_class_interface_embedding(code_ast, model)
+            final_embedding = pooling_class_interface_embedding(code_ast, model, vocab)
         else:
-            final_embedding = model.encode(generate_block_seqs(code_ast))
+            final_embedding = model.encode(generate_block_seqs(code_ast, vocab))
         return final_embedding
 
     for i, row in ast_df.iterrows():
@@ -147,7 +153,15 @@ def get_embedding(ast_df: pd.DataFrame, model) -> pd.DataFrame:
 
 
 
-def main_func(step, description, r=0.8, use_gpu=True):
+def main_func(step, description, r=0.8, use_gpu=True, use_token_table=True, shard=None, workers=None,
+              token_table_only=False):
+    """
+    :param shard: 'i/N', 只处理第 i 个分片的 model, None 为全部处理；所有分片需要在同一台机器上运行
+    :param workers: 源码有变化时解析 ast 的进程数, None 为 cpu 数量
+    :param use_token_table: 预先计算词表中所有 token 的 codebert 向量，编码时查表；为 False 时在编码过程中调用 codebert。
+        向量表不存在或者输入有变化时重新生成，分片运行时不生成，需要先用 token_table_only=True 运行一次
+    :param token_table_only: 只生成向量表，不计算 embedding
+    """
     if description == 'all':
         # project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
         project_model_list = ['my_pde']
@@ -173,25 +187,43 @@ def main_func(step, description, r=0.8, use_gpu=True):
     ENCODE_DIM = 256
     BATCH_SIZE = 1
     USE_GPU = use_gpu
+    vocab, pretrained_weight = None, None
+    if use_token_table:
+        table_file = get_table_file(step, description, ratio)
+        if not is_table_current(table_file, get_input_fingerprint(project_model_list)):
+            # 所有分片同时生成会重复在 gpu 上计算整个向量表，分片之间使用的向量表也可能不同
+            if shard is not None:
+                raise RuntimeError(f'token table {table_file} is missing or out of date, '
+                                   f'run main_func({step}, {description!r}, token_table_only=True) first')
+            build_token_table(project_model_list, table_file, workers=workers)
+        if token_table_only:
+            return
+        vocab, pretrained_weight = load_token_table(table_file)
     model = BatchProgramCC(EMBEDDING_DIM, HIDDEN_DIM, ENCODE_DIM, BATCH_SIZE,
-                           USE_GPU)
+                           USE_GPU, pretrained_weight)
     if USE_GPU:
         model.cuda()
         # model.to('cuda:1')
     model.hidden = model.init_hidden()
-    for project_model_name in project_model_list:
-        print('**********', project_model_name)
-        project_path = join(repo_root_path, project_model_name, 'repo_first_3')
-        model_dir_list = os.listdir(project_path)
-        model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
-        for model_dir in model_dir_list[model_dir_list.index('1714'):]:
-            print('---------------', model_dir)
-            model_path = join(project_path, model_dir)
-            ast_path = join(model_path, 'astnn_ast.pkl')
-            # 如果不存在ast，跳过处理
-            if not os.path.exists(ast_path):
-                continue
-            ast_df = pd.read_pickle(ast_path)
-            ast_df = choose_prediction_step(step, ast_df, model_path, model_dir)
-            get_embedding(ast_df, model).to_pickle(join(model_path, f'{description}_{step}_my_embedding.pkl'))
-            torch.cuda.empty_cache()
+    # 编码器权重不同时（如重新生成了 token_table），之前的记录不再有效
+    with JobJournal(f'{description}_{step}:my:{get_state_identity(model)}') as journal, ParseCache() as parse_cache, \
+            parse_executor(workers) as executor:
+        for project_model_name in project_model_list:
+            print('**********', project_model_name)
+            project_path = join(repo_root_path, project_model_name, 'repo_first_3')
+            model_dir_list = os.listdir(project_path)
+            model_dir_list = sorted(model_dir_list, key=lambda x: int(x))
+            for model_dir in select_shard(model_dir_list, shard):
+                model_path = join(project_path, model_dir)
+                output_file = join(model_path, f'{description}_{step}_my_embedding.pkl')
+                if journal.is_done(model_path, output_file):
+                    continue
+                print('---------------', model_dir)
+                ast_df = load_ast(model_path, parse_cache, executor)
+                # 如果不存在ast，跳过处理
+                if ast_df is None:
+                    continue
+                ast_df = choose_prediction_step(step, ast_df, model_path, model_dir)
+                atomic_to_pickle(get_embedding(ast_df, model, vocab), output_file)
+                journal.mark_done(model_path, output_file)
+                torch.cuda.empty_cache()
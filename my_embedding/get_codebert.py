@@ -1,10 +1,26 @@
+import os
+from collections import OrderedDict
+
 from transformers import AutoTokenizer, AutoModel
 from tokenizers import Tokenizer
 import torch
 
+from embedding_cache import EmbeddingCache, get_file_identity, get_state_identity
+
 tokenizer = AutoTokenizer.from_pretrained("./codebert_base")
 model = AutoModel.from_pretrained("./codebert_base")
-BPE_tokenizer = Tokenizer.from_file("./tokens/all_1_0.8_tokens_128.json")
+BPE_file = "./tokens/all_1_0.8_tokens_128.json"
+BPE_tokenizer = Tokenizer.from_file(BPE_file)
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+model = model.to(device)
+model.eval()
+# 内存中的 token -> 向量 LRU 缓存，向量保存在 cpu
+CACHE_SIZE = 200000
+BATCH_SIZE = 64
+# 持久化缓存的编码器版本，修改 token 的切分或池化方式后需要更新
+ENCODER_VERSION = 'bpe_mean_v1'
+token_cache = OrderedDict()
+persistent_cache = None
 # torch.Size([1, 23, 768])
 # tensor([[-0.1423,  0.3766,  0.0443,  ..., -0.2513, -0.3099,  0.3183],
 #         [-0.5739,  0.1333,  0.2314,  ..., -0.1240, -0.1219,  0.2033],
@@ -15,14 +31,84 @@ BPE_tokenizer = Tokenizer.from_file("./tokens/all_1_0.8_tokens_128.json")
 #         [-0.1433,  0.3785,  0.0450,  ..., -0.2527, -0.3121,  0.3207]],
 #        grad_fn=<SelectBackward>)
 
-def codebert(current_node: list[str]):
-    result = []
-    for node in current_node:
-        output = BPE_tokenizer.encode(node)
-        tokens = tokenizer.tokenize(' '.join(output.tokens))
-        tokens_ids = tokenizer.convert_tokens_to_ids(tokens)
-        if len(tokens_ids) == 0:
-            tokens_ids = tokenizer.convert_tokens_to_ids(['[UNK]'])
-        context_embeddings = model(torch.tensor(tokens_ids)[None, :])[0]
-        result.append(torch.mean(context_embeddings, dim=1))
-    return torch.cat(result, dim=0)
+def get_persistent_cache():
+    """
+    第一次未命中时才打开 sqlite 缓存，编码器标识包含 BPE 词表和 codebert 权重
+    """
+    global persistent_cache
+    if persistent_cache is None:
+        persistent_cache = EmbeddingCache(
+            f'my_codebert:{ENCODER_VERSION}:{get_file_identity(BPE_file)}:{get_state_identity(model)}')
+    return persistent_cache
+
+
+def get_token_ids(node: str):
+    output = BPE_tokenizer.encode(node)
+    tokens = tokenizer.tokenize(' '.join(output.tokens))
+    tokens_ids = tokenizer.convert_tokens_to_ids(tokens)
+    if len(tokens_ids) == 0:
+        tokens_ids = tokenizer.convert_tokens_to_ids(['[UNK]'])
+    return tokens_ids[:tokenizer.model_max_length]
+
+
+def batch_codebert(nodes: list[str]) -> list[torch.Tensor]:
+    """
+    批量计算 token 的向量，按长度排序后 padding，与逐个计算 mean(model(tokens_ids)) 的结果相同
+
+    :param nodes: 不重复的 token
+    :return: 每个 token 的向量 [768], cpu
+    """
+    all_token_ids = [get_token_ids(node) for node in nodes]
+    order = sorted(range(len(nodes)), key=lambda i: len(all_token_ids[i]))
+    result = [None] * len(nodes)
+    with torch.inference_mode():
+        for start in range(0, len(order), BATCH_SIZE):
+            batch = order[start:start + BATCH_SIZE]
+            max_len = len(all_token_ids[batch[-1]])
+            input_ids = torch.full((len(batch), max_len), tokenizer.pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(all_token_ids[i])] = torch.tensor(all_token_ids[i])
+                attention_mask[row, :len(all_token_ids[i])] = 1
+            input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+            context_embeddings = model(input_ids, attention_mask=attention_mask)[0]
+            mask = attention_mask.unsqueeze(-1).to(context_embeddings.dtype)
+            embeddings = ((context_embeddings * mask).sum(dim=1) / mask.sum(dim=1)).cpu()
+            for row, i in enumerate(batch):
+                result[i] = embeddings[row].clone()
+    return result
+
+
+def codebert(current_node: list[str], use_persistent_cache=True):
+    """
+    每个 token 经过 BPE 和 codebert 得到的向量，先查内存 LRU 缓存，再查 sqlite 缓存，未命中的批量计算
+
+    :param current_node: token 列表
+    :param use_persistent_cache: 是否使用 sqlite 缓存
+    :return: [len(current_node), 768], cpu
+    """
+    found = {}
+    misses = []
+    for node in dict.fromkeys(current_node):
+        if node in token_cache:
+            token_cache.move_to_end(node)
+            found[node] = token_cache[node]
+        else:
+            misses.append(node)
+    if len(misses) > 0:
+        if use_persistent_cache:
+            cache = get_persistent_cache()
+            keys = {node: cache.get_key(node) for node in misses}
+            hits = cache.get_many(keys.values())
+            computing = [node for node in misses if keys[node] not in hits]
+            computed = batch_codebert(computing) if len(computing) > 0 else []
+            cache.put_many([(keys[node], vector) for node, vector in zip(computing, computed)])
+            found.update({node: hits[keys[node]] for node in misses if keys[node] in hits})
+            found.update(zip(computing, computed))
+        else:
+            found.update(zip(misses, batch_codebert(misses)))
+        for node in misses:
+            token_cache[node] = found[node]
+        while len(token_cache) > CACHE_SIZE:
+            token_cache.popitem(last=False)
+    return torch.stack([found[node] for node in current_node])
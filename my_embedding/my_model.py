@@ -2,14 +2,16 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch
 
-from my_embedding.get_codebert import codebert
-
 torch.manual_seed(0)
 print(torch.__version__)
 class BatchTreeEncoder(nn.Module):
-    def __init__(self, embedding_dim, encode_dim, batch_size, use_gpu):
+    def __init__(self, embedding_dim, encode_dim, batch_size, use_gpu, pretrained_weight=None):
         super(BatchTreeEncoder, self).__init__()
         self.embedding_dim = embedding_dim
+        # 传入 token_table 生成的向量表时，节点为向量表中的行号，直接查表；否则节点为 token 字符串，调用 codebert
+        self.embedding = None
+        if pretrained_weight is not None:
+            self.embedding = nn.Embedding.from_pretrained(torch.as_tensor(pretrained_weight), freeze=True)
         self.encode_dim = encode_dim
         self.W_c = nn.Linear(embedding_dim, encode_dim)
         self.activation = F.relu
@@ -48,8 +50,12 @@ class BatchTreeEncoder(nn.Module):
                         children_index[j].append(i)
                         children[j].append(temp[j])
         # embedding默认会随机生成词向量，这里应该是不需要的，设置种子为0可以针对相同输入输出固定词向量
-        batch_current = self.W_c(batch_current.index_copy(0, torch.Tensor(self.th.LongTensor(index)),
-                                                          codebert(current_node).cuda()))
+        if self.embedding is not None:
+            node_embedding = self.embedding(self.create_tensor(torch.LongTensor(current_node)))
+        else:
+            from my_embedding.get_codebert import codebert
+            node_embedding = self.create_tensor(codebert(current_node))
+        batch_current = self.W_c(batch_current.index_copy(0, torch.Tensor(self.th.LongTensor(index)), node_embedding))
         for c in range(len(children)):
             zeros = self.create_tensor(torch.Tensor(torch.zeros(size, self.encode_dim)))
             batch_children_index = [batch_index[i] for i in children_index[c]]
@@ -75,7 +81,7 @@ class BatchTreeEncoder(nn.Module):
 
 
 class BatchProgramCC(nn.Module):
-    def __init__(self, embedding_dim, hidden_dim, encode_dim, batch_size, use_gpu=True):
+    def __init__(self, embedding_dim, hidden_dim, encode_dim, batch_size, use_gpu=True, pretrained_weight=None):
         super(BatchProgramCC, self).__init__()
         self.hidden_dim = hidden_dim
         self.num_layers = 1
@@ -84,7 +90,7 @@ class BatchProgramCC(nn.Module):
         self.embedding_dim = embedding_dim
         self.encode_dim = encode_dim
         self.encoder = BatchTreeEncoder(self.embedding_dim, self.encode_dim,
-                                        self.batch_size, self.gpu)
+                                        self.batch_size, self.gpu, pretrained_weight)
         # gru
         self.bigru = nn.GRU(self.encode_dim, self.hidden_dim, num_layers=self.num_layers, bidirectional=True,
                             batch_first=True)
@@ -0,0 +1,156 @@
+"""
+离线生成 token -> codebert 向量表，编码时直接用 nn.Embedding 查表，不再在遍历树的过程中调用 codebert
+
+词表为所有 model 的 block 树中出现的 token 以及 BPE 词表中的 token，最后一行为词表外 token 的向量（与空 token 相同，即 [UNK]）
+保存为 tokens/{description}_{step}_{ratio}_token_table.npz: tokens [V], embeddings [V + 1, 768], fingerprint
+fingerprint 为输入（每个 model 的源码文件和 BPE 词表）的标识，输入变化后需要重新生成，否则新的 token 都会使用 [UNK] 的向量
+"""
+import hashlib
+import json
+import os
+from collections import Counter
+from os.path import join
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from ast_cache import AST_FILE, SOURCE_FILE, ParseCache, load_ast, parse_executor
+from embedding_cache import get_file_identity
+
+repo_root_path = join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'params_validation',
+                      'git_repo_code')
+my_root = join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'my_embedding')
+# 与 get_codebert.BPE_file 相同，这里不导入 get_codebert，检查向量表是否过期时不需要加载 codebert
+BPE_FILE = join(my_root, 'tokens', 'all_1_0.8_tokens_128.json')
+# 生成方式变化时更新，旧的向量表会重新生成
+TABLE_VERSION = 1
+
+
+def get_table_file(step, description, ratio):
+    return join(my_root, 'tokens', f'{description}_{str(step)}_{str(ratio)}_token_table.npz')
+
+
+def get_input_fingerprint(project_model_list, max_vocab=None):
+    """
+    每个 model 的 processed_java_codes.tsv（没有源码时为 astnn_ast.pkl）和 BPE 词表的文件标识，新增 model 或者源码变化后不同
+
+    :param project_model_list: 项目列表
+    :param max_vocab: build_token_table 的 max_vocab
+    :return: sha1
+    """
+    sha = hashlib.sha1(f'{TABLE_VERSION}:{max_vocab}:{get_file_identity(BPE_FILE)}\n'.encode('utf-8'))
+    for project_model_name in project_model_list:
+        project_path = join(repo_root_path, project_model_name, 'repo_first_3')
+        for model_dir in sorted(os.listdir(project_path), key=lambda x: int(x)):
+            for name in [SOURCE_FILE, AST_FILE]:
+                file = join(project_path, model_dir, name)
+                if os.path.exists(file):
+                    sha.update(f'{project_model_name}/{model_dir}/{get_file_identity(file)}\n'.encode('utf-8'))
+                    break
+    return sha.hexdigest()
+
+
+def is_table_current(table_file, fingerprint):
+    """
+    :return: 向量表存在并且 fingerprint 一致
+    """
+    if not os.path.exists(table_file):
+        return False
+    try:
+        with np.load(table_file, allow_pickle=False) as table:
+            return 'fingerprint' in table.files and str(table['fingerprint']) == fingerprint
+    except (OSError, ValueError):
+        return False
+
+
+def collect_block_tokens(project_model_list, workers=None):
+    """
+    统计所有 model 的 block 树中 token 出现的次数，类/接口的 block 树中 token 与其成员相同，不需要单独处理
+
+    :param project_model_list: 项目列表
+    :param workers: 源码有变化时解析 ast 的进程数, None 为 cpu 数量
+    :return: Counter
+    """
+    from utils import get_blocks_v1
+
+    counter = Counter()
+
+    def count(node):
+        counter[node.token] += 1
+        for child in node.children:
+            count(child)
+
+    with ParseCache() as parse_cache, parse_executor(workers) as executor:
+        for project_model_name in project_model_list:
+            print('**********', project_model_name)
+            project_path = join(repo_root_path, project_model_name, 'repo_first_3')
+            for model_dir in tqdm(sorted(os.listdir(project_path), key=lambda x: int(x))):
+                ast_df = load_ast(join(project_path, model_dir), parse_cache, executor)
+                # 如果不存在ast，跳过处理
+                if ast_df is None:
+                    continue
+                for code_ast in ast_df['code']:
+                    blocks = []
+                    get_blocks_v1(code_ast, blocks)
+                    for block in blocks:
+                        count(block)
+    return counter
+
+
+def get_bpe_tokens(bpe_file):
+    """
+    :return: BPE 词表中除特殊 token 以外的 token
+    """
+    with open(bpe_file, encoding='utf-8') as f:
+        bpe = json.load(f)
+    special = {token['content'] for token in bpe.get('added_tokens', [])}
+    return [token for token in bpe['model']['vocab'] if token not in special]
+
+
+def build_token_table(project_model_list, table_file, max_vocab=None, batch_size=4096, workers=None):
+    """
+    计算词表中所有 token 的 codebert 向量，先写入临时文件再 rename，其他进程不会读到不完整的向量表
+
+    :param project_model_list: 项目列表
+    :param table_file: 保存路径
+    :param max_vocab: block 树中的 token 只保留出现次数最多的 max_vocab 个, None 为全部保留
+    :param batch_size: 每次交给 codebert 的 token 数量, codebert 内部再按长度分批
+    :param workers: 源码有变化时解析 ast 的进程数, None 为 cpu 数量
+    :return: none
+    """
+    from my_embedding.get_codebert import BPE_file, codebert
+
+    # 在读取输入之前计算，生成过程中输入发生变化时下次会重新生成
+    fingerprint = get_input_fingerprint(project_model_list, max_vocab)
+    counter = collect_block_tokens(project_model_list, workers)
+    tokens = [token for token, _ in counter.most_common(max_vocab)]
+    tokens += [token for token in get_bpe_tokens(BPE_file) if token not in counter]
+    tokens = list(dict.fromkeys(tokens))
+    print(f'token table size: {len(tokens)}')
+    embeddings = []
+    for start in tqdm(range(0, len(tokens), batch_size)):
+        embeddings.append(codebert(tokens[start:start + batch_size]).numpy())
+    # 词表外的 token，与空 token 一样为 [UNK] 的向量
+    embeddings.append(codebert(['']).numpy())
+    if not os.path.exists(os.path.dirname(table_file)):
+        os.makedirs(os.path.dirname(table_file))
+    base, ext = os.path.splitext(table_file)
+    # 保留扩展名，否则 np.savez 会追加 .npz
+    tmp_file = f'{base}.tmp{os.getpid()}{ext}'
+    try:
+        np.savez(tmp_file, tokens=np.array(tokens, dtype=str), embeddings=np.concatenate(embeddings).astype(np.float32),
+                 fingerprint=np.array(fingerprint))
+        os.replace(tmp_file, table_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def load_token_table(table_file):
+    """
+    :return: (vocab: token -> 行号, embeddings: np.ndarray [V + 1, 768])，词表外的 token 使用最后一行
+    """
+    with np.load(table_file, allow_pickle=False) as table:
+        tokens = table['tokens'].tolist()
+        embeddings = table['embeddings']
+    return {token: i for i, token in enumerate(tokens)}, embeddings
@@ -10,6 +10,7 @@ import pandas as pd
 import warnings
 from tqdm.auto import tqdm
 
+from ast_cache import ParseCache, load_ast, parse_executor
 from dataset_split_util import get_models_by_ratio
 
 tqdm.pandas()
@@ -82,7 +83,10 @@ def dictionary_and_embedding(trees, size, step, ratio, description):
     tokenizer.save(join(my_root, 'tokens', f'{description}_{str(step)}_{str(ratio)}_tokens_{str(size)}.json'))
 
 
-def main_func(step: int, description, r=0.8):
+def main_func(step: int, description, r=0.8, workers=None):
+    """
+    :param workers: 源码有变化时解析 ast 的进程数, None 为 cpu 数量
+    """
     if description == 'all':
         project_model_list = ['my_pde', 'my_platform', 'my_mylyn']
         ratio = r
@@ -102,21 +106,22 @@ def main_func(step: int, description, r=0.8):
         project_model_list = []
         ratio = 1
     trees = pd.DataFrame(columns=['id', 'code'])
-    for project_model_name in project_model_list:
-        print('***********************', project_model_name)
-        project_path = join(root_path, project_model_name, 'repo_first_3')
-        model_dir_list = get_models_by_ratio(project_model_name, 0.0, ratio)
-        for model_dir in model_dir_list:
-            print('---------------', model_dir)
-            model_path = join(project_path, model_dir)
-            ast_path = join(model_path, 'astnn_ast.pkl')
-            # 如果不存在ast，跳过处理
-            if not os.path.exists(ast_path):
-                continue
-            ast = pd.read_pickle(ast_path)
-            ast = choose_prediction_step(step, ast, model_path, model_dir)
-            print(f'ast size: {len(ast)}')
-            trees = pd.concat([trees, ast])
+    # 源码有变化的 model 会先重新解析，解析结果与 solve_ast 共享
+    with ParseCache() as parse_cache, parse_executor(workers) as executor:
+        for project_model_name in project_model_list:
+            print('***********************', project_model_name)
+            project_path = join(root_path, project_model_name, 'repo_first_3')
+            model_dir_list = get_models_by_ratio(project_model_name, 0.0, ratio)
+            for model_dir in model_dir_list:
+                print('---------------', model_dir)
+                model_path = join(project_path, model_dir)
+                ast = load_ast(model_path, parse_cache, executor)
+                # 如果不存在ast，跳过处理
+                if ast is None:
+                    continue
+                ast = choose_prediction_step(step, ast, model_path, model_dir)
+                print(f'ast size: {len(ast)}')
+                trees = pd.concat([trees, ast])
     dictionary_and_embedding(trees, 128, step, ratio, description)
 
 # Word2Vec(corpus, size=size, workers=16, sg=1, max_final_vocab=3000)
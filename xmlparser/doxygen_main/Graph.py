@@ -12,17 +12,28 @@ class EdgeLabel:
 class Graph:
     """
     关系图
+
+    节点的 id 就是在 vertices 中的下标。除了 vertices 和 edges 列表外，还维护 ref_id -> 节点、(start, end) 边集合和邻接表，
+    需要通过 add_* 方法修改图，不要直接修改列表
     """
     repo_name: str  # repo_name
     repo_path: str  # repo_path
     vertices: list[Vertex]  # { id, ref_id, kind, label, origin } origin=1表示是否是context model中的，而不是扩展的
     edges: list[Edge]  # { start, end, label, origin }
+    vertex_index: dict[str, Vertex]  # ref_id -> 第一个 ref_id 相同的节点
+    edge_set: set[tuple[int, int]]  # 已有的 (start, end)
+    out_edges: dict[int, list[Edge]]  # 节点 id -> 以该节点为起点的边
+    in_edges: dict[int, list[Edge]]  # 节点 id -> 以该节点为终点的边
 
     def __init__(self):
         self.repo_name = ''
         self.repo_path = ''
         self.vertices = []
         self.edges = []
+        self.vertex_index = {}
+        self.edge_set = set()
+        self.out_edges = {}
+        self.in_edges = {}
 
     def print(self):
         print("repo_name: {0}, vertices: {0}, edges: {1}".format(self.repo_name, self.vertices, self.edges))
@@ -36,9 +47,10 @@ class Graph:
     def add_whole_vertex(self, vertex: Vertex):
         vertex.id = len(self.vertices)
         self.vertices.append(vertex)
+        self.vertex_index.setdefault(vertex.ref_id, vertex)
 
     def add_vertex(self, ref_id: str, kind: str, label: str):
-        self.vertices.append(Vertex(
+        self.add_whole_vertex(Vertex(
             _id=len(self.vertices),
             ref_id=ref_id,
             kind=kind,
@@ -48,7 +60,7 @@ class Graph:
         return len(self.vertices)
 
     def add_vertex_origin(self, ref_id: str, kind: str, label: str):
-        self.vertices.append(Vertex(
+        self.add_whole_vertex(Vertex(
             _id=len(self.vertices),
             ref_id=ref_id,
             kind=kind,
@@ -59,14 +71,16 @@ class Graph:
 
     def add_whole_edge(self, edge: Edge):
         self.edges.append(edge)
+        self.edge_set.add((edge.start, edge.end))
+        self.out_edges.setdefault(edge.start, []).append(edge)
+        self.in_edges.setdefault(edge.end, []).append(edge)
 
     def add_edge(self, start: int, end: int, label: str):
         if start < 0 or start >= len(self.vertices) or end < 0 or end >= len(self.vertices) or label == '':
             return
-        for edge in self.edges:
-            if edge.start == start and edge.end == end:
-                return
-        self.edges.append(Edge(
+        if (start, end) in self.edge_set:
+            return
+        self.add_whole_edge(Edge(
             start=start,
             end=end,
             label=label,
@@ -76,16 +90,42 @@ class Graph:
     def add_edge_origin(self, start: int, end: int, label: str):
         if start < 0 or start >= len(self.vertices) or end < 0 or end >= len(self.vertices) or label == '':
             return
-        for edge in self.edges:
-            if edge.start == start and edge.end == end:
-                return
-        self.edges.append(Edge(
+        if (start, end) in self.edge_set:
+            return
+        self.add_whole_edge(Edge(
             start=start,
             end=end,
             label=label,
             origin=1
         ))
 
+    def has_edge(self, start: int, end: int):
+        return (start, end) in self.edge_set
+
+    def get_out_edges(self, _id: int):
+        """
+        :return: 以节点 _id 为起点的边，按加入顺序
+        """
+        return self.out_edges.get(_id, [])
+
+    def get_in_edges(self, _id: int):
+        """
+        :return: 以节点 _id 为终点的边，按加入顺序
+        """
+        return self.in_edges.get(_id, [])
+
+    def get_successors(self, _id: int):
+        return [edge.end for edge in self.get_out_edges(_id)]
+
+    def get_predecessors(self, _id: int):
+        return [edge.start for edge in self.get_in_edges(_id)]
+
+    def get_neighbors(self, _id: int):
+        """
+        :return: 与节点 _id 相连的节点 id（不区分方向，去重）
+        """
+        return list(dict.fromkeys(self.get_successors(_id) + self.get_predecessors(_id)))
+
     def get_vertex_by_id(self, _id: int):
         """
         根据id获取vertex
@@ -93,9 +133,8 @@ class Graph:
         :param _id: id
         :return: vertex，否则为 None
         """
-        for vertex in self.vertices:
-            if vertex.id == _id:
-                return vertex
+        if 0 <= _id < len(self.vertices):
+            return self.vertices[_id]
         return None
 
     def get_vertex_id_by_ref_id(self, ref_id: str):
@@ -105,10 +144,10 @@ class Graph:
         :param ref_id: ref_id
         :return: 顶点的 id，没有则返回空字符串
         """
-        for vertex in self.vertices:
-            if vertex.ref_id == ref_id:
-                return vertex.id
-        return -1
+        vertex = self.vertex_index.get(ref_id)
+        if vertex is None:
+            return -1
+        return vertex.id
 
     def get_vertex_id_and_kind_by_ref_id(self, ref_id: str):
         """
@@ -117,7 +156,7 @@ class Graph:
         :param ref_id: ref_id
         :return: 顶点的 id，没有则返回空字符串
         """
-        for vertex in self.vertices:
-            if vertex.ref_id == ref_id:
-                return vertex.id, vertex.kind
-        return -1, ''
+        vertex = self.vertex_index.get(ref_id)
+        if vertex is None:
+            return -1, ''
+        return vertex.id, vertex.kind
@@ -1,18 +1,33 @@
 from xmlparser.doxygen_main.ClassEntity import ClassEntity
+from xmlparser.doxygen_main.FieldEntity import FieldEntity
+from xmlparser.doxygen_main.MethodEntity import MethodEntity
 
 
 class RepoMetrics:
     """
     解析的working periods的每个仓库的内容实体
+
+    除了 classes 列表外，还维护 ref_id 和名称到实体的索引，在 add_class_entity 时更新，
+    所以类需要在解析完字段和方法之后再加入。ref_id 或名称重复时和按顺序遍历一样保留第一个
     """
     repo_name: str
     repo_location: str
     classes: list[ClassEntity]
+    class_index: dict[str, ClassEntity]  # ref_id -> 类
+    method_index: dict[str, MethodEntity]  # ref_id -> 方法
+    field_index: dict[str, FieldEntity]  # ref_id -> 字段
+    inner_class_ids: set[str]  # 所有内部类的 ref_id
+    name_index: dict[str, ClassEntity | FieldEntity | MethodEntity]  # 类名(.分隔)/字段 qualified_name/方法 full_name -> 实体
 
     def __init__(self):
         self.repo_name = ''
         self.repo_location = ''
         self.classes = []
+        self.class_index = {}
+        self.method_index = {}
+        self.field_index = {}
+        self.inner_class_ids = set()
+        self.name_index = {}
 
     def print(self):
         print("repo_name: ", self.repo_name)
@@ -26,33 +41,28 @@ class RepoMetrics:
 
     def add_class_entity(self, class_entity: ClassEntity):
         self.classes.append(class_entity)
+        self.class_index.setdefault(class_entity.ref_id, class_entity)
+        self.inner_class_ids.update(class_entity.inner_class)
+        # 名称索引的顺序与 solve_graph.element_exist 原来的遍历顺序一致：类名，字段，方法
+        self.name_index.setdefault(class_entity.compound_name.replace('::', '.'), class_entity)
+        for f in class_entity.fields:
+            self.field_index.setdefault(f.ref_id, f)
+            self.name_index.setdefault(f.qualified_name, f)
+        for m in class_entity.methods:
+            self.method_index.setdefault(m.ref_id, m)
+            self.name_index.setdefault(m.full_name, m)
 
     def get_class_by_id(self, ref_id: str):
-        for c in self.classes:
-            if c.ref_id == ref_id:
-                return c
-        return None
+        return self.class_index.get(ref_id)
 
     def is_inner_class(self, ref_id: str):
-        for c in self.classes:
-            for i in c.inner_class:
-                if ref_id == i:
-                    return True
-        return False
+        return ref_id in self.inner_class_ids
 
     def get_field_by_id(self, ref_id: str):
-        for c in self.classes:
-            for f in c.fields:
-                if f.ref_id == ref_id:
-                    return f
-        return None
+        return self.field_index.get(ref_id)
 
     def get_method_by_id(self, ref_id: str):
-        for c in self.classes:
-            for f in c.methods:
-                if f.ref_id == ref_id:
-                    return f
-        return None
+        return self.method_index.get(ref_id)
 
     def get_element_by_id(self, ref_id: str):
         c = self.get_class_by_id(ref_id)
@@ -65,3 +75,10 @@ class RepoMetrics:
         if f is not None:
             return f
         return None
+
+    def get_element_by_name(self, name: str):
+        """
+        :param name: 类名(.分隔), 字段的 qualified_name 或者方法的 full_name
+        :return: 实体，不存在时返回 None
+        """
+        return self.name_index.get(name)
@@ -2,6 +2,7 @@
 根据结构关系扩展 code context model 的相关 API
 v_element.prot != 'package' 是为了剔除 static 代码块
 """
+import copy
 import random
 from typing import Union
 
@@ -274,3 +275,73 @@ def expand_model(graph_list: list[Graph], all_repo_metrics: list[RepoMetrics], s
                 expand_model_graph(graph, repo_metrics, step)
                 add_location_to_field_and_method(graph, repo_metrics)
     print("{} step expand model over~~~~~~~~~~~~~~~~".format(step))
+
+
+def expand_model_graph_steps(graph: Graph, repo_metrics: RepoMetrics, steps: int):
+    """
+    一次遍历扩展 1..steps 步，结果与分别调用 expand_model_graph(graph, repo_metrics, step) 相同
+
+    每一步只扩展上一步新加入的节点，扩展完后每个扩展节点只在最终的图上找一次边。
+    由于节点 id 在每一步都是前缀，step 步的图就是前 n_step 个节点，加上两端都在前 n_step 个节点中的边
+
+    :param graph: 图，扩展为 steps 步的结果
+    :param repo_metrics: 该图对应的doxygen矩阵
+    :param steps: 最大步长
+    :return: [1-step 图, 2-step 图, ..., steps-step 图]
+    """
+    origin_edge_number = len(graph.edges)
+    vertex_numbers = []
+    start = 0
+    for _ in range(steps):
+        start = expand_graph_1_step(graph, repo_metrics, start)
+        vertex_numbers.append(len(graph.vertices))
+    add_location_to_field_and_method(graph, repo_metrics)
+    vertex_edges = {vertex.id: solve_graph.get_edges_of_vertex(graph, repo_metrics, vertex)
+                    for vertex in graph.vertices if vertex.origin == 0}
+    graphs = []
+    for vertex_number in vertex_numbers:
+        step_graph = Graph()
+        step_graph.set_repo_name(graph.repo_name)
+        step_graph.set_repo_path(graph.repo_path)
+        for vertex in graph.vertices[:vertex_number]:
+            step_graph.add_whole_vertex(vertex)
+        for edge in graph.edges[:origin_edge_number]:
+            step_graph.add_whole_edge(edge)
+        # 与 complete_graph 相同的顺序加入边
+        for vertex in step_graph.vertices:
+            for edge_start, edge_end, label in vertex_edges.get(vertex.id, []):
+                if edge_start < vertex_number and edge_end < vertex_number:
+                    step_graph.add_edge(edge_start, edge_end, label)
+        graphs.append(step_graph)
+    return graphs
+
+
+def expand_model_steps(graph_list: list[Graph], all_repo_metrics: list[RepoMetrics], steps: int):
+    """
+    一次遍历得到 1..steps 步扩展的模型，代替对每个 step 重新加载模型并调用 expand_model。
+    与 expand_model 一样使用所有 repo_name 相同的doxygen矩阵；只有一个时一次遍历，有多个时依次扩展，每个 step 分别计算
+
+    :param graph_list: 模型的图集合，会被扩展为 steps 步的结果
+    :param all_repo_metrics: 所有的doxygen矩阵
+    :param steps: 最大步长
+    :return: [1-step 图集合, ..., steps-step 图集合]
+    """
+    step_graph_lists = [[] for _ in range(steps)]
+    for graph in graph_list:
+        matched_metrics = [repo_metrics for repo_metrics in all_repo_metrics
+                           if graph.repo_name == repo_metrics.repo_name]
+        if len(matched_metrics) == 0:
+            graphs = [graph] * steps
+        elif len(matched_metrics) == 1:
+            graphs = expand_model_graph_steps(graph, matched_metrics[0], steps)
+        else:
+            # 后面的矩阵在前一个扩展后的图上继续扩展，step 步的图不是 steps 步的图的前缀
+            graphs = [copy.deepcopy(graph) for _ in range(steps - 1)] + [graph]
+            for step, step_graph in enumerate(graphs, start=1):
+                for repo_metrics in matched_metrics:
+                    expand_model_graph(step_graph, repo_metrics, step)
+                    add_location_to_field_and_method(step_graph, repo_metrics)
+        for step_graphs, step_graph in zip(step_graph_lists, graphs):
+            step_graphs.append(step_graph)
+    print("1-{} step expand model over~~~~~~~~~~~~~~~~".format(steps))
+    return step_graph_lists
@@ -3,7 +3,7 @@ from os.path import join, isdir
 
 from xmlparser import doxmlparser
 from xmlparser.doxmlparser.compound import DoxCompoundKind, DoxMemberKind, MixedContainer
-from xmlparser.doxygen_main import get_standard_elements, solve_graph
+from xmlparser.doxygen_main import get_standard_elements, solve_graph, metrics_snapshot, stream_parser
 from xmlparser.doxygen_main.ClassEntity import ClassEntity
 from xmlparser.doxygen_main.FieldEntity import FieldEntity
 from xmlparser.doxygen_main.Graph import Graph
@@ -153,11 +153,32 @@ def parse_index(repo_path: str, repo: str):
     return metrics
 
 
-def parse_working_periods(period_path: str):
+def parse_index_cached(repo_path: str, repo: str, stream=False):
+    """
+    xml 没有变化时直接读取 metrics_snapshot 保存的结果，否则解析后保存快照
+
+    :param repo_path: doxygen/<repo> 目录
+    :param repo: 项目名
+    :param stream: 使用 stream_parser 解析，结果相同
+    :return: RepoMetrics
+    """
+    fingerprint = metrics_snapshot.get_doxygen_fingerprint(repo_path)
+    metrics = metrics_snapshot.load_snapshot(repo_path, fingerprint)
+    if metrics is None:
+        metrics = stream_parser.parse_index(repo_path, repo) if stream else parse_index(repo_path, repo)
+        metrics_snapshot.save_snapshot(repo_path, fingerprint, metrics)
+    # 目录移动后 repo_location 仍然指向当前路径
+    metrics.set_repo_info(repo, repo_path)
+    return metrics
+
+
+def parse_working_periods(period_path: str, use_snapshot=True, stream=False):
     """
     解析working periods的doxygen文件
 
     :param period_path: 路径
+    :param use_snapshot: 使用 metrics_snapshot 缓存的解析结果
+    :param stream: 使用 stream_parser 流式解析 xml，不构建 doxmlparser 的对象树
     :return: 返回解析的项目metrics数组
     """
     period_path = join(period_path, 'doxygen')
@@ -168,21 +189,28 @@ def parse_working_periods(period_path: str):
         print(repo_path)
         if not isdir(repo_path):
             continue
-        all_repo_metrics.append(parse_index(repo_path, repo))
+        if use_snapshot:
+            all_repo_metrics.append(parse_index_cached(repo_path, repo, stream))
+        elif stream:
+            all_repo_metrics.append(stream_parser.parse_index(repo_path, repo))
+        else:
+            all_repo_metrics.append(parse_index(repo_path, repo))
     return all_repo_metrics
 
 
-def solve_doxygen_metrics(repo_path: str):
+def solve_doxygen_metrics(repo_path: str, use_snapshot=True, stream=False):
     """
     根据项目目录，解析每个项目的 doxygen 矩阵
 
     :param repo_path: 每个working period的项目根目录
+    :param use_snapshot: 使用 metrics_snapshot 缓存的解析结果
+    :param stream: 使用 stream_parser 流式解析 xml
     :return: doxygen矩阵列表
     """
     dir_list = os.listdir(repo_path)  # 如果该路径下没有文件夹，说明没有从git上找到匹配的commit
     if len(dir_list) == 0:
         return []
-    all_repo_metrics = parse_working_periods(repo_path)  # 分项目解析repo_metrics
+    all_repo_metrics = parse_working_periods(repo_path, use_snapshot, stream)  # 分项目解析repo_metrics
     # for m in all_repo_metrics:
     #     m.print()
     return all_repo_metrics
@@ -0,0 +1,70 @@
+"""
+RepoMetrics 的二进制快照，避免每次都重新解析 doxygen 的 xml
+
+快照保存在 doxygen/<repo> 目录旁边的 doxygen/<repo>.metrics 中，文件内依次是两个 pickle：
+    头部 {'version', 'fingerprint'}，RepoMetrics
+fingerprint 由 doxygen/<repo> 下所有 xml 文件的文件名、大小和修改时间计算，doxygen 重新生成后快照自动失效
+"""
+import hashlib
+import os
+import pickle
+
+from xmlparser.doxygen_main.Metrics import RepoMetrics
+
+# RepoMetrics 或者实体类的结构改变时需要修改版本号
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = '.metrics'
+
+
+def get_snapshot_file(repo_path: str):
+    return repo_path.rstrip('/\\') + SNAPSHOT_SUFFIX
+
+
+def get_doxygen_fingerprint(repo_path: str):
+    """
+    :param repo_path: doxygen/<repo> 目录
+    :return: sha1
+    """
+    sha = hashlib.sha1()
+    entries = sorted((entry for entry in os.scandir(repo_path) if entry.name.endswith('.xml')), key=lambda e: e.name)
+    for entry in entries:
+        stat = entry.stat()
+        sha.update(f'{entry.name}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return sha.hexdigest()
+
+
+def load_snapshot(repo_path: str, fingerprint: str):
+    """
+    :param repo_path: doxygen/<repo> 目录
+    :param fingerprint: 当前 xml 的 fingerprint
+    :return: RepoMetrics，快照不存在或者过期时返回 None
+    """
+    snapshot_file = get_snapshot_file(repo_path)
+    if not os.path.exists(snapshot_file):
+        return None
+    try:
+        with open(snapshot_file, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('version') != SNAPSHOT_VERSION or header.get('fingerprint') != fingerprint:
+                return None
+            metrics = pickle.load(f)
+    except Exception:
+        # 写入中断、实体类被移动/重命名或者结构变化（忘记更新 SNAPSHOT_VERSION）等，都重新解析
+        return None
+    return metrics if isinstance(metrics, RepoMetrics) else None
+
+
+def save_snapshot(repo_path: str, fingerprint: str, metrics: RepoMetrics):
+    """
+    先写入临时文件再 rename，中断时不会留下不完整的快照
+    """
+    snapshot_file = get_snapshot_file(repo_path)
+    tmp_file = f'{snapshot_file}.tmp{os.getpid()}'
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'version': SNAPSHOT_VERSION, 'fingerprint': fingerprint}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(metrics, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, snapshot_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
@@ -21,16 +21,9 @@ def element_exist(all_repo_metrics: list[RepoMetrics], element: list[str]):
     for metric in all_repo_metrics:
         if metric.repo_name != element[0]:
             continue
-        for c in metric.classes:
-            c_name = c.compound_name.replace('::', '.')
-            if c_name == element[1]:
-                return c.ref_id, c.kind
-            for f in c.fields:
-                if f.qualified_name == element[1]:
-                    return f.ref_id, f.kind
-            for m in c.methods:
-                if m.full_name == element[1]:
-                    return m.ref_id, m.kind
+        e = metric.get_element_by_name(element[1])
+        if e is not None:
+            return e.ref_id, e.kind
     return '', ''
 
 
@@ -72,15 +65,16 @@ def transfer_elements(all_repo_metrics: list[RepoMetrics], standard_elements: li
     return new_elements, valid_list
 
 
-def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
+def get_edges_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
     """
-    给定节点，完善他与图中的其他节点的边
+    给定节点，找到他与图中的其他节点的边，不修改图
 
     :param graph: 图
     :param metric: doxygen矩阵
     :param vertex: 节点
-    :return: 无
+    :return: [(start, end, label), ...]，按照加入图的顺序
     """
+    edges = []
     kind = vertex.kind
     ref_id = vertex.ref_id
     origin_id = vertex.id
@@ -88,7 +82,7 @@ def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
         # 如果是类，找继承关系和声明关系
         cla = metric.get_class_by_id(ref_id)
         if cla is None:
-            return
+            return edges
         # 先找继承,目前只考虑直接继承
         for base_ref in cla.base_compound_ref:
             if base_ref != '':
@@ -96,24 +90,12 @@ def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
                 if v_id != -1:
                     # 需要区分是接口还是类，关系到边是inherits 还是 implements
                     if v_kind == DoxCompoundKind.CLASS:  # 能继承类的只有类
-                        graph.add_edge(
-                            start=origin_id,
-                            end=v_id,
-                            label=EdgeLabel.INHERIT
-                        )
+                        edges.append((origin_id, v_id, EdgeLabel.INHERIT))
                     elif v_kind == DoxCompoundKind.INTERFACE:  # 能继承接口的，可以是类实现接口，也可以是接口继承接口
                         if kind == DoxCompoundKind.INTERFACE:
-                            graph.add_edge(
-                                start=origin_id,
-                                end=v_id,
-                                label=EdgeLabel.INHERIT
-                            )
+                            edges.append((origin_id, v_id, EdgeLabel.INHERIT))
                         else:
-                            graph.add_edge(
-                                start=origin_id,
-                                end=v_id,
-                                label=EdgeLabel.IMPLEMENT
-                            )
+                            edges.append((origin_id, v_id, EdgeLabel.IMPLEMENT))
         # 找被继承,或者被实现
         for derived_ref in cla.derived_compound_ref:
             if derived_ref != '':
@@ -121,60 +103,36 @@ def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
                 if v_id != -1:
                     if v_kind == DoxCompoundKind.CLASS:  # 能被类实现的，可以是类被类继承，也可以接口被类实现
                         if kind == DoxCompoundKind.CLASS:
-                            graph.add_edge(
-                                start=v_id,
-                                end=origin_id,
-                                label=EdgeLabel.INHERIT
-                            )
+                            edges.append((v_id, origin_id, EdgeLabel.INHERIT))
                         else:
-                            graph.add_edge(
-                                start=v_id,
-                                end=origin_id,
-                                label=EdgeLabel.IMPLEMENT
-                            )
+                            edges.append((v_id, origin_id, EdgeLabel.IMPLEMENT))
                     elif v_kind == DoxCompoundKind.INTERFACE:  # 能被接口继承的只有接口
                         if kind == DoxCompoundKind.INTERFACE:
-                            graph.add_edge(
-                                start=v_id,
-                                end=origin_id,
-                                label=EdgeLabel.INHERIT
-                            )
+                            edges.append((v_id, origin_id, EdgeLabel.INHERIT))
         # 找声明的字段
         for c_f in cla.fields:
             v_id = graph.get_vertex_id_by_ref_id(c_f.ref_id)
             if v_id != -1:
-                graph.add_edge(
-                    start=origin_id,
-                    end=v_id,
-                    label=EdgeLabel.DECLARE
-                )
+                edges.append((origin_id, v_id, EdgeLabel.DECLARE))
         # 找声明的方法
         for c_m in cla.methods:
             v_id = graph.get_vertex_id_by_ref_id(c_m.ref_id)
             if v_id != -1:
-                graph.add_edge(
-                    start=origin_id,
-                    end=v_id,
-                    label=EdgeLabel.DECLARE
-                )
+                edges.append((origin_id, v_id, EdgeLabel.DECLARE))
     elif kind in function_like_kind:
         # 被声明,由于该API在后续扩展图时要用到，所以声明需要加上，但是这里改动不影响前面
         v_ref_id = ref_id[:ref_id.rfind('_')]
         v_id = graph.get_vertex_id_by_ref_id(v_ref_id)
         # 如果该类不存在，则加入,并更新节点id
         if v_id != -1:
-            graph.add_edge(start=v_id, end=origin_id, label=EdgeLabel.DECLARE)
+            edges.append((v_id, origin_id, EdgeLabel.DECLARE))
         # 如果是方法，要找声明和调用，声明在类的时候会完成，调用要找主动和被动
         met = metric.get_method_by_id(ref_id)
         for ref_by_id in met.referenced_by:
             v_id = graph.get_vertex_id_by_ref_id(ref_by_id)
             if v_id != -1:
                 # 注意是被调用关系
-                graph.add_edge(
-                    start=v_id,
-                    end=origin_id,
-                    label=EdgeLabel.CALL
-                )
+                edges.append((v_id, origin_id, EdgeLabel.CALL))
         for ref_id in met.references:
             v_element = metric.get_element_by_id(ref_id)
             if v_element is not None:
@@ -183,37 +141,25 @@ def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
                     v_id = graph.get_vertex_id_by_ref_id(ref_id)
                     if v_id != -1:
                         # 注意是调用关系
-                        graph.add_edge(
-                            start=origin_id,
-                            end=v_id,
-                            label=EdgeLabel.CALL
-                        )
+                        edges.append((origin_id, v_id, EdgeLabel.CALL))
         # 方法还需要找实现关系
         for ref_by_id in met.reimplemented_by:
             v_id = graph.get_vertex_id_by_ref_id(ref_by_id)
             if v_id != -1:
                 # 注意是被实现关系
-                graph.add_edge(
-                    start=v_id,
-                    end=origin_id,
-                    label=EdgeLabel.IMPLEMENT
-                )
+                edges.append((v_id, origin_id, EdgeLabel.IMPLEMENT))
         for ref_by_id in met.reimplements:
             v_id = graph.get_vertex_id_by_ref_id(ref_by_id)
             if v_id != -1:
                 # 注意是实现关系
-                graph.add_edge(
-                    start=origin_id,
-                    end=v_id,
-                    label=EdgeLabel.IMPLEMENT
-                )
+                edges.append((origin_id, v_id, EdgeLabel.IMPLEMENT))
     elif kind in variable_like_kind:
         # 被声明,由于该API在后续扩展图时要用到，所以声明需要加上
         v_ref_id = ref_id[:ref_id.rfind('_')]
         v_id = graph.get_vertex_id_by_ref_id(v_ref_id)
         # 如果该类不存在，则加入,并更新节点id
         if v_id != -1:
-            graph.add_edge(start=v_id, end=origin_id, label=EdgeLabel.DECLARE)
+            edges.append((v_id, origin_id, EdgeLabel.DECLARE))
         # 如果是字段，需要找声明和调用，声明在类的时候会完成，只需要找被调用即可
         # fie = metric.get_field_by_id(ref_id)
         # for ref_by_id in fie.referenced_by:
@@ -225,6 +171,20 @@ def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
         #             end=origin_id,
         #             label=EdgeLabel.CALL
         #         )
+    return edges
+
+
+def complete_edge_of_vertex(graph: Graph, metric: RepoMetrics, vertex: Vertex):
+    """
+    给定节点，完善他与图中的其他节点的边
+
+    :param graph: 图
+    :param metric: doxygen矩阵
+    :param vertex: 节点
+    :return: 无
+    """
+    for start, end, label in get_edges_of_vertex(graph, metric, vertex):
+        graph.add_edge(start=start, end=end, label=label)
 
 
 def solve_repo_relation(metric: RepoMetrics, dict_elements: list[dict[str, str]]):
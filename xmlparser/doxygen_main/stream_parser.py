@@ -0,0 +1,253 @@
+"""
+基于 lxml.etree.iterparse 的 doxygen xml 解析，结果与 get_relations.parse_index 相同，但是不构建 doxmlparser 的完整对象树
+
+只处理 index.xml 中 kind 为 class/interface 的 compound，memberdef 解析完之后立即清除，compounddef 的其他子元素也随读随清，
+大项目（如 platform）的解析时间和内存都小很多。字段取值规则与 doxmlparser 一致：
+属性和子元素不存在时为 None，子元素为空时为 ''，location 中的行列号转换为 int
+"""
+from lxml import etree
+
+from xmlparser.doxmlparser.compound import DoxCompoundKind, DoxMemberKind
+from xmlparser.doxygen_main.ClassEntity import ClassEntity
+from xmlparser.doxygen_main.FieldEntity import FieldEntity
+from xmlparser.doxygen_main.LocationEntity import LocationEntity
+from xmlparser.doxygen_main.MethodEntity import MethodEntity
+from xmlparser.doxygen_main.Metrics import RepoMetrics
+
+class_like_kind = [DoxCompoundKind.CLASS, DoxCompoundKind.INTERFACE]
+function_like_kind = [DoxMemberKind.FUNCTION]
+variable_like_kind = [DoxMemberKind.VARIABLE]
+
+
+def local_name(element):
+    tag = element.tag
+    return tag[tag.find('}') + 1:]
+
+
+def iterparse(file: str, events):
+    # 与 doxmlparser 使用的 ETCompatXMLParser 一样去掉注释和处理指令
+    return etree.iterparse(file, events=events, remove_comments=True, remove_pis=True)
+
+
+def release(element):
+    """
+    清除已经处理过的元素以及它前面的兄弟元素
+    """
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def get_all_text(element):
+    """
+    与 doxmlparser 的 valueOf_ 相同：元素自身的文本加上子元素的 tail，不包括子元素的文本
+    """
+    text = element.text if element.text is not None else ''
+    for child in element:
+        if child.tail is not None:
+            text += child.tail
+    return text
+
+
+def linked_text_to_string(element):
+    """
+    与 get_relations.linked_text_to_string 相同，ref 使用其 valueOf_
+    """
+    if element is None:
+        return ''
+    res_str = element.text if element.text is not None else ''
+    for child in element:
+        if local_name(child) == 'ref':
+            res_str += get_all_text(child)
+        if child.tail is not None:
+            res_str += child.tail
+    return res_str
+
+
+def get_child_text(children: dict, name: str):
+    """
+    :return: 子元素不存在时为 None，文本为空时为 ''
+    """
+    element = children.get(name)
+    if element is None:
+        return None
+    return element.text if element.text is not None else ''
+
+
+def to_int(value):
+    return None if value is None else int(value)
+
+
+def parse_location(element):
+    return LocationEntity(
+        file=element.get('file'),
+        line=to_int(element.get('line')),
+        column=to_int(element.get('column')),
+        body_file=element.get('bodyfile'),
+        body_start=to_int(element.get('bodystart')),
+        body_end=to_int(element.get('bodyend'))
+    )
+
+
+def parse_member(member_def, class_entity: ClassEntity):
+    """
+    与 get_relations.parse_members 中单个 memberdef 的处理相同
+    """
+    kind = member_def.get('kind')
+    if kind not in function_like_kind and kind not in variable_like_kind:
+        return
+    # 单个子元素重复出现时与 doxmlparser 一样取最后一个
+    children = {}
+    params, references, referenced_by, reimplements, reimplemented_by = [], [], [], [], []
+    for child in member_def:
+        name = local_name(child)
+        if name == 'param':
+            params.append(child)
+        elif name == 'references':
+            references.append(child.get('refid'))
+        elif name == 'referencedby':
+            referenced_by.append(child.get('refid'))
+        elif name == 'reimplements':
+            reimplements.append(child.get('refid'))
+        elif name == 'reimplementedby':
+            reimplemented_by.append(child.get('refid'))
+        else:
+            children[name] = child
+    location = children.get('location')
+    if kind in function_like_kind:
+        method_entity = MethodEntity()
+        method_entity.set_method_info(
+            ref_id=member_def.get('id'),
+            prot=member_def.get('prot'),
+            static=member_def.get('static'),
+            kind=kind,
+            return_type=linked_text_to_string(children.get('type')),
+            definition=get_child_text(children, 'definition'),
+            name=get_child_text(children, 'name'),
+            qualified_name=get_child_text(children, 'qualifiedname'),
+            args_string=get_child_text(children, 'argsstring'),
+            location_file=location.get('file')
+        )
+        param_str = []
+        for param in params:
+            param_children = {local_name(child): child for child in param}
+            param_type = linked_text_to_string(param_children.get('type'))
+            method_entity.add_param({
+                'name': get_child_text(param_children, 'declname'),
+                'param_type': param_type.split(' ')[-1]
+            })
+            param_str.append(param_type)
+        method_entity.set_method_info(
+            full_name=get_child_text(children, 'qualifiedname') + "(" + ','.join(param_str) + ")"
+        )
+        method_entity.set_location(parse_location(location))
+        for reference in references:
+            method_entity.add_reference(reference)
+        for reference in referenced_by:
+            method_entity.add_referenced_by(reference)
+        for reimplement in reimplements:
+            method_entity.add_reimplement(reimplement)
+        for reimplement in reimplemented_by:
+            method_entity.add_reimplemented_by(reimplement)
+        class_entity.add_method(method_entity)
+    else:
+        field_entity = FieldEntity()
+        field_entity.set_field_info(
+            ref_id=member_def.get('id'),
+            prot=member_def.get('prot'),
+            static=member_def.get('static'),
+            kind=kind,
+            field_type=linked_text_to_string(children.get('type')),
+            definition=get_child_text(children, 'definition'),
+            name=get_child_text(children, 'name'),
+            qualified_name=get_child_text(children, 'qualifiedname'),
+            initializer=linked_text_to_string(children.get('initializer')),
+            location_file=location.get('file')
+        )
+        field_entity.set_location(parse_location(location))
+        for reference in referenced_by:
+            field_entity.add_referenced_by(reference)
+        class_entity.add_field(field_entity)
+
+
+def parse_compound(compound_file: str, metrics: RepoMetrics):
+    """
+    流式解析单个 compound xml，与 get_relations.parse_compound 相同
+
+    :param compound_file: xml 文件
+    :param metrics: 解析的类加入 metrics
+    :return: 无
+    """
+    class_entity: ClassEntity = None
+    compound_name = None
+    for event, element in iterparse(compound_file, ('start', 'end')):
+        parent = element.getparent()
+        if parent is None:
+            continue
+        name = local_name(element)
+        # <doxygen> 下的 compounddef
+        if name == 'compounddef' and parent.getparent() is None:
+            if event == 'start':
+                class_entity, compound_name = None, None
+                if element.get('kind') in class_like_kind:
+                    class_entity = ClassEntity()
+            else:
+                if class_entity is not None:
+                    class_entity.set_class_info(
+                        ref_id=element.get('id'),
+                        kind=element.get('kind'),
+                        prot=element.get('prot'),
+                        compound_name=compound_name,
+                    )
+                    metrics.add_class_entity(class_entity)
+                    class_entity = None
+                release(element)
+            continue
+        if event == 'start' or class_entity is None:
+            continue
+        grandparent = parent.getparent()
+        if grandparent is None:
+            continue
+        # compounddef 的直接子元素
+        if local_name(parent) == 'compounddef' and grandparent.getparent() is None:
+            if name == 'compoundname':
+                compound_name = element.text if element.text is not None else ''
+            elif name == 'basecompoundref':
+                ref_id = element.get('refid')
+                class_entity.add_base_compound_ref(ref_id if ref_id else get_all_text(element))
+            elif name == 'derivedcompoundref':
+                ref_id = element.get('refid')
+                class_entity.add_derived_compound_ref(ref_id if ref_id else get_all_text(element))
+            elif name == 'innerclass':
+                ref_id = element.get('refid')
+                class_entity.add_inner_class(ref_id if ref_id else get_all_text(element))
+            release(element)
+        # sectiondef 中的 memberdef
+        elif name == 'memberdef' and local_name(parent) == 'sectiondef' and local_name(grandparent) == 'compounddef' \
+                and grandparent.getparent() is not None and grandparent.getparent().getparent() is None:
+            parse_member(element, class_entity)
+            release(element)
+
+
+def parse_index(repo_path: str, repo: str):
+    """
+    与 get_relations.parse_index 相同，index.xml 中不是类/接口的 compound（文件、包等，xml 中包含源码，体积最大）不解析
+
+    :param repo_path: doxygen/<repo> 目录
+    :param repo: 项目名
+    :return: RepoMetrics
+    """
+    metrics = RepoMetrics()
+    metrics.set_repo_info(repo, repo_path)
+    compounds = []
+    for _, element in iterparse(repo_path + "/index.xml", ('end',)):
+        parent = element.getparent()
+        if parent is not None and parent.getparent() is None and local_name(element) == 'compound':
+            compounds.append((element.get('refid'), element.get('kind')))
+            release(element)
+    for refid, kind in compounds:
+        if kind in class_like_kind:
+            parse_compound(repo_path + "/" + refid + ".xml", metrics)
+    return metrics